@@ -1,21 +1,26 @@
 from datetime import datetime, timedelta
 from typing import Optional
+import hmac
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from app.cluster import cluster
 from app.config import settings
 from app.database import db
 from app.models import UserInDB, User
+from app.tracing import span, traced
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
 
+@traced("auth.password_hash")
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+@traced("auth.password_hash")
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
@@ -32,6 +37,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+def create_user_token(user: UserInDB) -> str:
+    """Access token for a user"""
+    return create_access_token(data={"sub": user.id})
+
+
+def user_id_from_token(token: str) -> Optional[str]:
+    """The verified `sub` of a bearer token, or None; no database lookup"""
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
+
 def authenticate_user(email: str, password: str) -> Optional[UserInDB]:
     user = db.get_user_by_email(email)
     if not user:
@@ -50,15 +69,22 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 
     try:
         token = credentials.credentials
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        with span("auth.decode"):
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
 
-    user = db.get_user_by_id(user_id)
+    with span("db.get_user_by_id"):
+        user = db.get_user_by_id(user_id)
     if user is None:
+        # In a cluster the user may be stored on another node: ask it
+        if cluster.enabled:
+            remote_user = await cluster.get_user(user_id)
+            if remote_user is not None:
+                return remote_user
         raise credentials_exception
 
     return User(
@@ -79,3 +105,17 @@ async def get_current_user_optional(
         return await get_current_user(credentials)
     except HTTPException:
         return None
+
+
+async def get_admin_user(
+    current_user: User = Depends(get_current_user),
+    x_admin_token: Optional[str] = Header(None)
+) -> User:
+    """Require a signed-in user who also presents ADMIN_TOKEN in X-Admin-Token"""
+    if (not settings.ADMIN_TOKEN or x_admin_token is None
+            or not hmac.compare_digest(x_admin_token.encode(), settings.ADMIN_TOKEN.encode())):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
@@ -1,50 +1,90 @@
 from google.cloud import bigquery
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 import json
 from app.config import settings
+from app.logger import BackgroundQueue, logger
+from app.moderation import ReportCase
+from app.tracing import traced
+
+# BigQuery's recommended upper bound for one streaming insert request
+INSERT_BATCH_ROWS = 500
 
 
 class BigQueryLogger:
     """
     Logger for analytics events to BigQuery.
+    Rows are queued and streamed in per-table batches by a background
+    thread, so logging never waits on the BigQuery API.
     """
     def __init__(self):
         self.client = None
         self.enabled = False
+        self.rows = BackgroundQueue("bigquery-writer", self._insert_batch,
+                                    max_items=settings.BIGQUERY_MAX_QUEUED_ROWS,
+                                    flush_interval=settings.BIGQUERY_BATCH_INTERVAL_SECONDS)
+        self._reported_dropped = 0
         try:
             self.client = bigquery.Client(project=settings.GOOGLE_CLOUD_PROJECT)
             self.enabled = True
         except Exception as e:
-            print(f"BigQuery client initialization failed: {e}")
-            print("Analytics logging disabled. Set up Google Cloud credentials to enable.")
+            logger.warning("bigquery_disabled", error=str(e),
+                           hint="Set up Google Cloud credentials to enable analytics logging")
 
     def _get_table_id(self, table_name: str) -> str:
         return f"{settings.GOOGLE_CLOUD_PROJECT}.{settings.BIGQUERY_DATASET}.{table_name}"
 
+    @traced("logger")
+    def _insert(self, table_name: str, row: dict):
+        self.rows.put((table_name, row))
+
+    def _insert_batch(self, batch: List[Tuple[str, dict]]):
+        """Runs on the writer thread"""
+        dropped = self.rows.dropped
+        if dropped > self._reported_dropped:
+            logger.warning("bigquery_rows_dropped", count=dropped - self._reported_dropped,
+                           total=dropped)
+            self._reported_dropped = dropped
+
+        by_table: Dict[str, List[dict]] = {}
+        for table_name, row in batch:
+            by_table.setdefault(table_name, []).append(row)
+
+        for table_name, rows in by_table.items():
+            for start in range(0, len(rows), INSERT_BATCH_ROWS):
+                chunk = rows[start:start + INSERT_BATCH_ROWS]
+                try:
+                    errors = self.client.insert_rows_json(self._get_table_id(table_name), chunk)
+                    if errors:
+                        logger.error("bigquery_insert_errors", table=table_name,
+                                     rows=len(chunk), errors=errors[:5])
+                except Exception as e:
+                    logger.error("bigquery_insert_failed", table=table_name,
+                                 rows=len(chunk), error=str(e))
+
+    def stats(self) -> dict:
+        return {"queued": len(self.rows.items), "dropped": self.rows.dropped}
+
+    def close(self):
+        """Flush queued rows"""
+        self.rows.close()
+
     def log_event(self, event_type: str, user_id: str, room_id: str,
                   metadata: Optional[Dict] = None):
         """Log an analytics event to BigQuery"""
         if not self.enabled:
-            print(f"[Analytics] {event_type}: user={user_id}, room={room_id}")
+            logger.sampled("analytics_event", sample_key=event_type,
+                           event_type=event_type, user_id=user_id, room_id=room_id)
             return
 
-        try:
-            table_id = self._get_table_id("events")
-            rows_to_insert = [{
-                "event_id": f"{user_id}_{room_id}_{event_type}_{datetime.utcnow().timestamp()}",
-                "event_type": event_type,
-                "user_id": user_id,
-                "room_id": room_id,
-                "metadata": json.dumps(metadata) if metadata else None,
-                "timestamp": datetime.utcnow().isoformat()
-            }]
-
-            errors = self.client.insert_rows_json(table_id, rows_to_insert)
-            if errors:
-                print(f"BigQuery insert errors: {errors}")
-        except Exception as e:
-            print(f"Failed to log event to BigQuery: {e}")
+        self._insert("events", {
+            "event_id": f"{user_id}_{room_id}_{event_type}_{datetime.utcnow().timestamp()}",
+            "event_type": event_type,
+            "user_id": user_id,
+            "room_id": room_id,
+            "metadata": json.dumps(metadata) if metadata else None,
+            "timestamp": datetime.utcnow().isoformat()
+        })
 
     def log_room_session(self, room_id: str, room_title: str, created_by: str,
                          started_at: datetime, ended_at: Optional[datetime] = None,
@@ -53,49 +93,56 @@ class BigQueryLogger:
         if not self.enabled:
             return
 
-        try:
-            table_id = self._get_table_id("room_sessions")
-            rows_to_insert = [{
-                "session_id": f"{room_id}_{started_at.timestamp()}",
-                "room_id": room_id,
-                "room_title": room_title,
-                "created_by": created_by,
-                "started_at": started_at.isoformat(),
-                "ended_at": ended_at.isoformat() if ended_at else None,
-                "participants": json.dumps(participants) if participants else None,
-                "participant_count": len(participants) if participants else 0
-            }]
-
-            errors = self.client.insert_rows_json(table_id, rows_to_insert)
-            if errors:
-                print(f"BigQuery insert errors: {errors}")
-        except Exception as e:
-            print(f"Failed to log room session to BigQuery: {e}")
+        self._insert("room_sessions", {
+            "session_id": f"{room_id}_{started_at.timestamp()}",
+            "room_id": room_id,
+            "room_title": room_title,
+            "created_by": created_by,
+            "started_at": started_at.isoformat(),
+            "ended_at": ended_at.isoformat() if ended_at else None,
+            "participants": json.dumps(participants) if participants else None,
+            "participant_count": len(participants) if participants else 0
+        })
 
-    def log_report(self, reporter_id: str, reported_user_id: str,
-                   room_id: str, reason: str):
-        """Log a user report to BigQuery"""
+    def log_report(self, case: ReportCase):
+        """Log a closed report case (deduplicated reporters, aggregated) to BigQuery"""
         if not self.enabled:
-            print(f"[Report] Reporter={reporter_id}, Reported={reported_user_id}, Reason={reason}")
+            logger.info("report", reported_user_id=case.reported_user_id, room_id=case.room_id,
+                        reporter_ids=case.reporters, duplicates=case.duplicates,
+                        reasons=case.reasons, status=case.status)
             return
 
-        try:
-            table_id = self._get_table_id("reports")
-            rows_to_insert = [{
-                "report_id": f"{reporter_id}_{reported_user_id}_{datetime.utcnow().timestamp()}",
-                "reporter_id": reporter_id,
-                "reported_user_id": reported_user_id,
-                "room_id": room_id,
-                "reason": reason,
-                "timestamp": datetime.utcnow().isoformat(),
-                "status": "pending"
-            }]
-
-            errors = self.client.insert_rows_json(table_id, rows_to_insert)
-            if errors:
-                print(f"BigQuery insert errors: {errors}")
-        except Exception as e:
-            print(f"Failed to log report to BigQuery: {e}")
+        self._insert("report_cases", {
+            "report_id": f"{case.reported_user_id}_{case.room_id}_{case.first_reported_at.timestamp()}",
+            "reported_user_id": case.reported_user_id,
+            "room_id": case.room_id,
+            "reporter_ids": json.dumps(case.reporters),
+            "report_count": len(case.reporters),
+            "duplicate_count": case.duplicates,
+            "reasons": json.dumps(case.reasons),
+            "first_reported_at": case.first_reported_at.isoformat(),
+            "timestamp": case.last_reported_at.isoformat(),
+            "status": case.status
+        })
+
+    def log_submission(self, submission_id: str, user_id: str, room_id: str,
+                       language: str, code: str, output: str, status: str,
+                       submitted_at: datetime, execution_time_ms: int):
+        """Log a code execution to BigQuery"""
+        if not self.enabled:
+            return
+
+        self._insert("submissions", {
+            "submission_id": submission_id,
+            "user_id": user_id,
+            "room_id": room_id,
+            "language": language,
+            "code": code,
+            "output": output,
+            "status": status,
+            "submitted_at": submitted_at.isoformat(),
+            "execution_time_ms": execution_time_ms
+        })
 
 
 # Global BigQuery logger instance
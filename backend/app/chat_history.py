@@ -0,0 +1,297 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import time
+
+from app.config import settings
+from app.models import ChatMessage
+
+
+class ChatRecord:
+    """Compact in-memory chat message. `seq` is per room and strictly increasing."""
+    __slots__ = ("seq", "user_id", "user_name", "text", "timestamp")
+
+    def __init__(self, seq: int, user_id: str, user_name: str, text: str, timestamp: float):
+        self.seq = seq
+        self.user_id = user_id
+        self.user_name = user_name
+        self.text = text
+        self.timestamp = timestamp
+
+    def to_row(self) -> list:
+        return [self.seq, self.user_id, self.user_name, self.text, self.timestamp]
+
+    @classmethod
+    def from_row(cls, row: list) -> "ChatRecord":
+        return cls(*row)
+
+    def to_message(self, room_id: str) -> ChatMessage:
+        return ChatMessage(
+            id=self.seq,
+            room_id=room_id,
+            user_id=self.user_id,
+            user_name=self.user_name,
+            text=self.text,
+            timestamp=datetime.fromtimestamp(self.timestamp, tz=timezone.utc)
+        )
+
+
+class RoomRing:
+    """
+    Fixed-capacity ring buffer of one room's most recent messages.
+    Slots are addressed by `seq % capacity`, so any page is a slice of
+    consecutive slots and reading it costs O(page size).
+    """
+    __slots__ = ("capacity", "slots", "first_seq", "next_seq", "spill_pending", "spill_pages",
+                 "spill_bytes")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.slots: List[Optional[ChatRecord]] = []
+        self.first_seq = 1  # oldest seq still in memory
+        self.next_seq = 1
+        # Evicted records waiting to be written as one page, and the on-disk
+        # page index: (first_seq, last_seq, byte offset), oldest first.
+        self.spill_pending: List[ChatRecord] = []
+        self.spill_pages: List[Tuple[int, int, int]] = []
+        self.spill_bytes = 0  # size of the page file once queued writes land
+
+    def __len__(self) -> int:
+        return self.next_seq - self.first_seq
+
+    def append(self, record: ChatRecord) -> Optional[ChatRecord]:
+        """Store a record, returning the one it displaced when the ring is full"""
+        evicted = None
+        if len(self) == self.capacity:
+            evicted = self.pop_oldest()
+        index = record.seq % self.capacity
+        if index >= len(self.slots):
+            # Grow lazily so quiet rooms do not pay for a full ring
+            self.slots.extend([None] * (index + 1 - len(self.slots)))
+        self.slots[index] = record
+        self.next_seq = record.seq + 1
+        return evicted
+
+    def pop_oldest(self) -> ChatRecord:
+        index = self.first_seq % self.capacity
+        record = self.slots[index]
+        self.slots[index] = None
+        self.first_seq += 1
+        return record
+
+    def get(self, seq: int) -> ChatRecord:
+        return self.slots[seq % self.capacity]
+
+
+class ChatHistory:
+    """
+    Recent chat messages per room, bounded both per room and across all rooms.
+    When the global cap is hit, the oldest messages of the least recently
+    active room are evicted first. Evicted messages are either dropped or,
+    if CHAT_HISTORY_SPILL_DIR is set, appended to a per-room page file so
+    older history can still be paged in. Records waiting to fill a page
+    count toward the cap. Page files are written and read on one I/O thread,
+    so reads queued after a write see it.
+
+    A room whose messages have all been evicted keeps its (empty) ring, so
+    seqs keep increasing and never repeat within a room.
+    """
+    def __init__(self, per_room: int, max_total: int,
+                 spill_dir: Optional[str] = None, spill_page_size: int = 50):
+        self.per_room = per_room
+        self.max_total = max_total
+        self.spill_dir = spill_dir
+        self.spill_page_size = spill_page_size
+        self.rooms: "OrderedDict[str, RoomRing]" = OrderedDict()  # LRU order
+        self.spilled_rooms: Dict[str, RoomRing] = {}  # nothing left in memory
+        self.total = 0  # records in rings plus records waiting to be spilled
+        self._io: Optional[ThreadPoolExecutor] = None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-spill")
+
+    def add_message(self, room_id: str, user_id: str, user_name: str, text: str) -> ChatRecord:
+        ring = self.rooms.get(room_id)
+        if ring is None:
+            # Not `or`: an empty ring is falsy
+            ring = self.spilled_rooms.pop(room_id, None)
+            if ring is None:
+                ring = RoomRing(self.per_room)
+            self.rooms[room_id] = ring
+        else:
+            self.rooms.move_to_end(room_id)
+
+        record = ChatRecord(ring.next_seq, user_id, user_name, text, time.time())
+        evicted = ring.append(record)
+        self.total += 1
+        if evicted is not None:
+            self._spill(room_id, ring, evicted)
+
+        while self.total > self.max_total:
+            self._evict_one()
+        return record
+
+    async def get_messages(self, room_id: str, before: Optional[int] = None,
+                           limit: int = 50) -> List[ChatRecord]:
+        """Up to `limit` messages with seq < `before`, oldest first"""
+        ring = self._ring(room_id)
+        if ring is None:
+            return []
+        end = ring.next_seq if before is None else min(before, ring.next_seq)
+        start = max(1, end - limit)
+
+        # Copy what is in memory before awaiting the disk, which may evict it
+        in_memory_from = max(start, ring.first_seq)
+        in_memory = [ring.get(seq) for seq in range(in_memory_from, end)]
+        if in_memory_from == start:
+            return in_memory
+        spill_end = min(end, ring.first_seq)
+        pending = [r for r in ring.spill_pending if start <= r.seq < spill_end]
+        on_disk = []
+        pages = self._pages_between(ring, start, spill_end)
+        if pages:
+            on_disk = await asyncio.wrap_future(self._io.submit(
+                self._read_pages, self._spill_path(room_id), pages, start, spill_end))
+        return on_disk + pending + in_memory
+
+    async def export_room(self, room_id: str) -> dict:
+        """A room's most recent `per_room` messages, to move it to another node"""
+        ring = self._ring(room_id)
+        if ring is None:
+            return {"next_seq": 1, "rows": []}
+        records = await self.get_messages(room_id, limit=self.per_room)
+        return {"next_seq": ring.next_seq, "rows": [r.to_row() for r in records]}
+
+    def import_room(self, room_id: str, data: dict):
+        """Replace a room's history with an `export_room` result, keeping message seqs"""
+        self.remove_room(room_id)
+        rows = data["rows"]
+        ring = RoomRing(self.per_room)
+        ring.first_seq = ring.next_seq = rows[0][0] if rows else data["next_seq"]
+        for row in rows:
+            evicted = ring.append(ChatRecord.from_row(row))
+            self.total += 1
+            if evicted is not None:
+                self._spill(room_id, ring, evicted)
+        if len(ring):
+            self.rooms[room_id] = ring
+        elif ring.next_seq > 1:
+            self.spilled_rooms[room_id] = ring  # keeps the seq counter going
+        while self.total > self.max_total:
+            self._evict_one()
+
+    def remove_room(self, room_id: str):
+        """Drop a room's history, including anything spilled to disk"""
+        ring = self._ring(room_id)
+        self.rooms.pop(room_id, None)
+        self.spilled_rooms.pop(room_id, None)
+        if ring is not None:
+            self.total -= len(ring) + len(ring.spill_pending)
+        if self._io is not None:
+            # Queued behind any pending write to the same file
+            self._io.submit(self._remove_file, self._spill_path(room_id))
+
+    def close(self):
+        """Wait for queued page writes (blocking; call from a thread)"""
+        if self._io is not None:
+            self._io.shutdown(wait=True)
+
+    def _ring(self, room_id: str) -> Optional[RoomRing]:
+        ring = self.rooms.get(room_id)
+        return ring if ring is not None else self.spilled_rooms.get(room_id)
+
+    def _evict_one(self):
+        room_id, ring = next(iter(self.rooms.items()))
+        if self.spill_dir:
+            # A page at a time: moving records to the pending batch alone
+            # would not lower the total
+            while len(ring) and len(ring.spill_pending) < self.spill_page_size:
+                ring.spill_pending.append(ring.pop_oldest())
+            self._write_spill_page(room_id, ring)
+        else:
+            ring.pop_oldest()
+            self.total -= 1
+        if len(ring) == 0:
+            del self.rooms[room_id]
+            # Keep the seq counter, and the page index so history stays reachable
+            ring.slots = []
+            self.spilled_rooms[room_id] = ring
+
+    # Spill to disk
+
+    def _spill_path(self, room_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{room_id}.jsonl")
+
+    def _spill(self, room_id: str, ring: RoomRing, record: ChatRecord):
+        """Take a record the ring displaced: drop it, or batch it for the page file"""
+        if not self.spill_dir:
+            self.total -= 1
+            return
+        ring.spill_pending.append(record)
+        if len(ring.spill_pending) >= self.spill_page_size:
+            self._write_spill_page(room_id, ring)
+
+    def _write_spill_page(self, room_id: str, ring: RoomRing):
+        """Index the pending batch as a page now and queue the write"""
+        if not ring.spill_pending:
+            return
+        data = (json.dumps([r.to_row() for r in ring.spill_pending]) + "\n").encode()
+        offset = ring.spill_bytes
+        ring.spill_pages.append((ring.spill_pending[0].seq, ring.spill_pending[-1].seq, offset))
+        ring.spill_bytes += len(data)
+        self.total -= len(ring.spill_pending)
+        ring.spill_pending = []
+        self._io.submit(self._append_page, self._spill_path(room_id), offset, data)
+
+    @staticmethod
+    def _pages_between(ring: RoomRing, start: int, end: int) -> List[Tuple[int, int, int]]:
+        """Index entries of the pages holding seqs in [start, end), oldest first"""
+        if not ring.spill_pages or ring.spill_pages[-1][1] < start:
+            return []
+        # Pages are contiguous and sorted by seq: find the newest page that
+        # starts before `end` and walk back only as far as `start`.
+        index = bisect_left(ring.spill_pages, (end,)) - 1
+        first = index
+        while first >= 0 and ring.spill_pages[first][1] >= start:
+            first -= 1
+        return ring.spill_pages[first + 1:index + 1]
+
+    # On the I/O thread
+
+    @staticmethod
+    def _append_page(path: str, offset: int, data: bytes):
+        # A room's first page truncates whatever an earlier process left behind
+        with open(path, "wb" if offset == 0 else "ab") as f:
+            f.write(data)
+
+    @staticmethod
+    def _read_pages(path: str, pages: List[Tuple[int, int, int]],
+                    start: int, end: int) -> List[ChatRecord]:
+        records = []
+        with open(path, "rb") as f:
+            for _, _, offset in pages:
+                f.seek(offset)
+                records.extend(ChatRecord.from_row(row) for row in json.loads(f.readline())
+                               if start <= row[0] < end)
+        return records
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Global chat history instance
+chat_history = ChatHistory(
+    per_room=settings.CHAT_HISTORY_PER_ROOM,
+    max_total=settings.CHAT_HISTORY_MAX_MESSAGES,
+    spill_dir=settings.CHAT_HISTORY_SPILL_DIR,
+    spill_page_size=settings.CHAT_HISTORY_PAGE_SIZE,
+)
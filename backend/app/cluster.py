@@ -0,0 +1,681 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl
+import asyncio
+import hashlib
+import hmac
+import json
+import re
+import time
+
+import httpx
+from fastapi import HTTPException, Request, status
+from starlette.responses import JSONResponse
+
+from app.chat_history import ChatHistory, chat_history
+from app.config import settings
+from app.database import Database, db
+from app.logger import logger
+from app.models import Room, User
+from app.moderation import ModerationManager, moderation
+from app.snapshots import SnapshotStore, snapshots
+from app.tracing import span
+
+# Room-scoped paths, served by the node that owns the room
+ROOM_PATH = re.compile(r"^/rooms/([^/]+)(?:/|$)")
+NOT_ROOM_IDS = {"quick-join", "join-by-code"}
+# Room-scoped routes that carry the room id in the JSON body: body field per route
+BODY_ROOM_ROUTES = {
+    ("POST", "/moderation/kick"): "room_id",
+    ("POST", "/moderation/report"): "room_id",
+    ("POST", "/liveblocks/auth"): "room",
+    ("POST", "/daily/token"): "room_id",
+}
+# Users live on the node they signed up on (their home node)
+EMAIL_ROUTES = {("POST", "/auth/signup"), ("POST", "/auth/login")}
+
+# Mirrors the quick join endpoint: rooms with fewer people than this are offered
+QUICK_JOIN_MAX_PARTICIPANTS = 5
+QUICK_JOIN_CANDIDATES = 20
+QUICK_JOIN_ATTEMPTS = 3
+
+# "<unix time>.<hex HMAC-SHA256>" over the time, method, path with query and
+# body digest, keyed with CLUSTER_SECRET. Also marks a request as already routed.
+FORWARDED_HEADER = b"x-cluster-forwarded"
+SIGNATURE_MAX_AGE_SECONDS = 30  # also bounds the clock skew tolerated between nodes
+PEER_SCOPE_KEY = "cluster_peer"
+# Not passed on to the owning node. Origin is dropped so only the entry node
+# adds CORS headers.
+_DROPPED_REQUEST_HEADERS = {b"host", b"origin", b"content-length", b"connection",
+                            b"transfer-encoding", b"keep-alive", FORWARDED_HEADER}
+_DROPPED_RESPONSE_HEADERS = {b"connection", b"transfer-encoding", b"keep-alive",
+                             b"date", b"server"}
+
+MIGRATION_BATCH_ROOMS = 200
+MIGRATION_MAX_PASSES = 3  # sends of a batch before giving up on rooms that keep changing
+REMOTE_USER_CACHE_SIZE = 100_000  # profiles of users whose home is another node
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes. Each node owns `vnodes` points on
+    the ring, so keys spread evenly and adding a node moves only about
+    1/(N+1) of them, taken from every existing node.
+    """
+    def __init__(self, nodes: List[str], vnodes: int):
+        self.nodes = list(dict.fromkeys(node.rstrip("/") for node in nodes))
+        points = sorted((_hash(f"{node}#{index}"), node)
+                        for node in self.nodes for index in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        index = bisect_right(self._hashes, _hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+class Cluster:
+    """
+    Membership and room placement for a cluster of backend nodes. Rooms are
+    keyed "room:<room_id>" on a HashRing and each node keeps only the rooms
+    it owns; new rooms get ids that hash to the node creating them. When
+    membership changes, every node moves the rooms (with their participants,
+    kicks, chat and code history) it no longer owns to their new owners.
+
+    Users are created on the node owning "email:<email>" and stay on that
+    home node: password hashes never leave it. Other nodes find a user's home
+    by asking every node, and cache the profiles they look up.
+
+    Membership changes may only name nodes in CLUSTER_NODES or
+    CLUSTER_ALLOWED_NODES. Nodes authenticate each other with a per-request
+    HMAC (see FORWARDED_HEADER); CLUSTER_SECRET itself is never sent.
+    """
+    def __init__(self, self_url: Optional[str], nodes: List[str], vnodes: int,
+                 secret: Optional[str], database: Database, chat: ChatHistory,
+                 code_snapshots: SnapshotStore, moderation_manager: ModerationManager,
+                 allowed_nodes: Optional[List[str]] = None):
+        self.enabled = bool(nodes)
+        self.vnodes = vnodes
+        self.database = database
+        self.chat = chat
+        self.code_snapshots = code_snapshots
+        self.moderation = moderation_manager
+        self.ring = HashRing(nodes, vnodes)
+        self.allowed_nodes = set(self.ring.nodes) | {node.rstrip("/") for node in allowed_nodes or []}
+        self.self_url = (self_url or "").rstrip("/")
+        self.secret = (secret or "").encode()
+        self.remote_users: "OrderedDict[str, User]" = OrderedDict()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._rebalance_lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        # Rooms being handed to another node; peers get 503 for them meanwhile
+        self.moving: Set[str] = set()
+
+        if self.enabled:
+            if self.self_url not in self.ring.nodes:
+                raise ValueError("CLUSTER_SELF_URL must be one of CLUSTER_NODES")
+            if not self.secret:
+                raise ValueError("CLUSTER_SECRET is required when CLUSTER_NODES is set")
+            database.room_placement = self.owns_room
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(30.0, connect=2.0),
+                limits=httpx.Limits(max_connections=200, max_keepalive_connections=100)
+            )
+        return self._client
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def owner_of_room(self, room_id: str) -> str:
+        return self.ring.owner("room:" + room_id)
+
+    def owner_of_email(self, email: str) -> str:
+        return self.ring.owner("email:" + email.strip().lower())
+
+    def owns_room(self, room_id: str) -> bool:
+        return self.owner_of_room(room_id) == self.self_url
+
+    # Peer authentication
+
+    def _signature(self, timestamp: str, method: str, target: bytes, body: bytes) -> str:
+        message = b"\n".join([timestamp.encode(), method.encode(), target,
+                              hashlib.sha256(body).hexdigest().encode()])
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def sign(self, request: httpx.Request) -> httpx.Request:
+        """Add the X-Cluster-Forwarded signature to a request for a peer"""
+        timestamp = str(int(time.time()))
+        signature = self._signature(timestamp, request.method, request.url.raw_path,
+                                    request.content)
+        request.headers[FORWARDED_HEADER.decode()] = f"{timestamp}.{signature}"
+        return request
+
+    def verify(self, value: bytes, method: str, target: bytes, body: bytes) -> bool:
+        """Whether `value` is a fresh signature of this request by a node"""
+        timestamp, _, signature = value.decode("latin-1").partition(".")
+        if (not self.secret or not timestamp.isdigit()
+                or abs(time.time() - int(timestamp)) > SIGNATURE_MAX_AGE_SECONDS):
+            return False
+        return hmac.compare_digest(signature, self._signature(timestamp, method, target, body))
+
+    async def post_to_peer(self, node: str, path: str, payload) -> httpx.Response:
+        request = self.client.build_request("POST", node + path, json=payload)
+        return await self.client.send(self.sign(request))
+
+    # Users
+
+    async def _find_user(self, lookup: dict) -> Optional[Tuple[str, User]]:
+        """Ask every other node for a user by id or email: (home node, profile)"""
+        async def ask(node: str) -> Optional[User]:
+            try:
+                response = await self.post_to_peer(node, "/cluster/users/lookup", lookup)
+            except httpx.HTTPError as e:
+                logger.warning("cluster_node_unreachable", node=node,
+                               path="/cluster/users/lookup", error=str(e))
+                return None
+            return User.model_validate(response.json()) if response.status_code == 200 else None
+
+        peers = [node for node in self.ring.nodes if node != self.self_url]
+        with span("cluster.find_user"):
+            found = await asyncio.gather(*(ask(node) for node in peers))
+        for node, user in zip(peers, found):
+            if user is not None:
+                return node, user
+        return None
+
+    async def get_user(self, user_id: str) -> Optional[User]:
+        """Profile of a user whose home is another node"""
+        user = self.remote_users.get(user_id)
+        if user is not None:
+            self.remote_users.move_to_end(user_id)
+            return user
+        found = await self._find_user({"user_id": user_id})
+        if found is None:
+            return None
+        user = self.remote_users[user_id] = found[1]
+        if len(self.remote_users) > REMOTE_USER_CACHE_SIZE:
+            self.remote_users.popitem(last=False)
+        return user
+
+    async def home_of_email(self, email: str) -> str:
+        """The node holding the account for `email`, or the node that would create it"""
+        if self.database.get_user_by_email(email.strip()) is not None:
+            return self.self_url
+        found = await self._find_user({"email": email.strip()})
+        return found[0] if found else self.owner_of_email(email)
+
+    # Membership
+
+    def disallowed_nodes(self, nodes: List[str]) -> List[str]:
+        return [node for node in nodes if node.rstrip("/") not in self.allowed_nodes]
+
+    async def broadcast_nodes(self, nodes: List[str]) -> Dict[str, str]:
+        """Send a new node list to every old and new node, then apply it here"""
+        new_ring = HashRing(nodes, self.vnodes)
+        peers = [node for node in dict.fromkeys(self.ring.nodes + new_ring.nodes)
+                 if node != self.self_url]
+
+        async def notify(node: str) -> str:
+            try:
+                response = await self.post_to_peer(node, "/cluster/membership",
+                                                   {"nodes": new_ring.nodes})
+                return "ok" if response.status_code == 200 else f"HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                return f"unreachable: {e!r}"
+
+        results = dict(zip(peers, await asyncio.gather(*(notify(node) for node in peers))))
+        self.apply_nodes(new_ring.nodes)
+        results[self.self_url] = "ok"
+        return results
+
+    def apply_nodes(self, nodes: List[str]):
+        """Switch to a new node list and move what this node no longer owns in the background"""
+        self.ring = HashRing(nodes, self.vnodes)
+        logger.info("cluster_membership_changed", nodes=self.ring.nodes)
+        self.schedule_rebalance()
+
+    def schedule_rebalance(self):
+        task = asyncio.create_task(self.rebalance())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def rebalance(self) -> Dict[str, int]:
+        """Hand rooms owned by other nodes to their owners; users stay home"""
+        async with self._rebalance_lock:
+            rooms_by_owner: Dict[str, List[str]] = {}
+            for room_id in list(self.database.rooms):
+                owner = self.owner_of_room(room_id)
+                if owner != self.self_url:
+                    rooms_by_owner.setdefault(owner, []).append(room_id)
+
+            moved = {"rooms": 0}
+            for owner, room_ids in rooms_by_owner.items():
+                for start in range(0, len(room_ids), MIGRATION_BATCH_ROOMS):
+                    batch = room_ids[start:start + MIGRATION_BATCH_ROOMS]
+                    try:
+                        moved["rooms"] += await self._move_batch(owner, batch)
+                    except httpx.HTTPError as e:
+                        logger.error("cluster_migration_failed", node=owner,
+                                     rooms=len(batch), error=str(e))
+                        break
+                    except Exception as e:
+                        # Keep going: the rooms stay here until the next rebalance
+                        logger.error("cluster_migration_failed", node=owner,
+                                     rooms=len(batch), error=repr(e))
+            logger.info("cluster_rebalanced", **moved)
+            return moved
+
+    async def _move_batch(self, owner: str, batch: List[str]) -> int:
+        """
+        Copy rooms to their new owner, then drop them here. Requests already
+        running here can still change a room after it is exported, so rooms
+        are exported again after the import and resent until nothing changed.
+        Returns how many rooms moved.
+        """
+        self.moving.update(batch)
+        try:
+            exported: Dict[str, dict] = {}
+            for room_id in batch:
+                data = await self.export_room(room_id)
+                if data is not None:
+                    exported[room_id] = data
+
+            outgoing = exported
+            for _ in range(MIGRATION_MAX_PASSES):
+                if not outgoing:
+                    break
+                response = await self.post_to_peer(owner, "/cluster/import",
+                                                   {"rooms": list(outgoing.values())})
+                response.raise_for_status()
+                outgoing = {}
+                for room_id, data in exported.items():
+                    current = await self.export_room(room_id)
+                    if current is not None and current != data:
+                        outgoing[room_id] = exported[room_id] = current
+            if outgoing:
+                raise RuntimeError(f"{len(outgoing)} rooms kept changing during the move")
+
+            for room_id in exported:
+                self.remove_room(room_id)
+            return len(exported)
+        finally:
+            self.moving.difference_update(batch)
+
+    # Room transfer
+
+    async def export_room(self, room_id: str) -> Optional[dict]:
+        """Everything stored about a room, or None if it no longer exists"""
+        room = self.database.rooms.get(room_id)
+        if room is None:
+            return None
+        return {
+            "room": room.model_dump(mode="json"),
+            "participants": list(self.database.get_room_participants(room_id)),
+            "kicks": {user_id: expiry.isoformat() for user_id, expiry
+                      in self.moderation.kicked_users.get(room_id, {}).items()},
+            "chat": await self.chat.export_room(room_id),
+            "snapshots": self.code_snapshots.export_room(room_id),
+        }
+
+    def import_bundle(self, bundle: dict) -> Dict[str, int]:
+        imported = {"rooms": 0}
+        for data in bundle.get("rooms", []):
+            room = Room.model_validate(data["room"])
+            self.remove_room(room.room_id)
+            room.active_count = 0
+            self.database.insert_room(room)
+            for user_id in data["participants"]:
+                self.database.add_participant(room.room_id, user_id)
+            for user_id, expiry in data["kicks"].items():
+                self.moderation.add_kick(room.room_id, user_id, datetime.fromisoformat(expiry))
+            self.chat.import_room(room.room_id, data["chat"])
+            self.code_snapshots.import_room(room.room_id, data["snapshots"])
+            imported["rooms"] += 1
+        return imported
+
+    def remove_room(self, room_id: str):
+        self.database.evict_room(room_id)
+        self.chat.remove_room(room_id)
+        self.code_snapshots.remove_room(room_id)
+        self.moderation.remove_room(room_id)
+
+
+class _Captured:
+    """A fully buffered response from this node or a peer"""
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status_code: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        self.status = status_code
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class ClusterPeerMiddleware:
+    """
+    ASGI middleware that checks the X-Cluster-Forwarded signature of requests
+    from other nodes and marks those that pass with PEER_SCOPE_KEY. Added
+    outside the rate limiter and the router, which rely on the mark.
+    """
+    def __init__(self, app, cluster: Cluster):
+        self.app = app
+        self.cluster = cluster
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope[PEER_SCOPE_KEY] = False
+            value = dict(scope["headers"]).get(FORWARDED_HEADER)
+            if value is not None:
+                # The signature covers the body; peer bodies are small and buffered anyway
+                body = await _read_body(receive)
+                target = scope.get("raw_path") or scope["path"].encode()
+                if scope.get("query_string"):
+                    target += b"?" + scope["query_string"]
+                scope[PEER_SCOPE_KEY] = self.cluster.verify(value, scope["method"], target, body)
+                receive = _replay(body, receive)
+        await self.app(scope, receive, send)
+
+
+def is_peer_request(scope) -> bool:
+    return scope.get(PEER_SCOPE_KEY, False)
+
+
+class ClusterRouterMiddleware:
+    """
+    ASGI middleware that sends each request to the node owning its data.
+    Room-scoped requests go to the room's owner, signup and login to the
+    account's home node; requests owned here, and requests already forwarded
+    by a peer, pass straight through. Responses from peers are streamed back.
+
+    The room list, quick join and join-by-code have no single owner and are
+    answered by asking every node (scatter-gather).
+    """
+    def __init__(self, app, cluster: Cluster):
+        self.app = app
+        self.cluster = cluster
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        if is_peer_request(scope):
+            if self.cluster.moving:
+                # Already buffered by ClusterPeerMiddleware
+                body = await _read_body(receive)
+                receive = _replay(body, receive)
+                if self._moving_room(scope, body):
+                    await _unavailable()(scope, receive, send)
+                    return
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope["method"], scope["path"]
+        if method == "GET" and path == "/rooms":
+            await self._list_rooms(scope, receive, send)
+            return
+        if method == "GET" and path == "/rooms/quick-join/find":
+            await self._quick_join(scope, receive, send)
+            return
+        if method == "POST" and path == "/rooms/join-by-code":
+            await self._join_by_code(scope, receive, send)
+            return
+
+        match = ROOM_PATH.match(path)
+        if match and match.group(1) not in NOT_ROOM_IDS:
+            owner = self.cluster.owner_of_room(match.group(1))
+            if owner == self.cluster.self_url:
+                await self.app(scope, receive, send)
+            else:
+                await self._forward(owner, scope, await _read_body(receive), receive, send)
+            return
+
+        field = BODY_ROOM_ROUTES.get((method, path))
+        if field is None and (method, path) not in EMAIL_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        key = _json_field(body, field or "email")
+        if not isinstance(key, str):
+            owner = self.cluster.self_url  # let validation answer here
+        elif field is None:
+            owner = await self.cluster.home_of_email(key)
+        else:
+            owner = self.cluster.owner_of_room(key)
+        if owner == self.cluster.self_url:
+            await self.app(scope, _replay(body, receive), send)
+        else:
+            await self._forward(owner, scope, body, receive, send)
+
+    def _moving_room(self, scope, body: bytes) -> bool:
+        """Whether a peer's request addresses a room this node is handing off"""
+        match = ROOM_PATH.match(scope["path"])
+        if match:
+            return match.group(1) in self.cluster.moving
+        field = BODY_ROOM_ROUTES.get((scope["method"], scope["path"]))
+        room_id = _json_field(body, field) if field else None
+        return isinstance(room_id, str) and room_id in self.cluster.moving
+
+    # Forwarding
+
+    def _peer_request(self, node: str, scope, body: bytes) -> httpx.Request:
+        headers = [(name, value) for name, value in scope["headers"]
+                   if name not in _DROPPED_REQUEST_HEADERS]
+        client = scope.get("client")
+        if client and not any(name == b"x-forwarded-for" for name, _ in headers):
+            headers.append((b"x-forwarded-for", client[0].encode()))
+        url = node + scope.get("root_path", "") + scope["path"]
+        if scope.get("query_string"):
+            url += "?" + scope["query_string"].decode("latin-1")
+        return self.cluster.sign(self.cluster.client.build_request(
+            scope["method"], url, headers=headers, content=body))
+
+    async def _forward(self, node: str, scope, body: bytes, receive, send):
+        try:
+            with span("cluster.forward"):
+                response = await self.cluster.client.send(
+                    self._peer_request(node, scope, body), stream=True)
+        except httpx.HTTPError as e:
+            logger.warning("cluster_forward_failed", node=node, path=scope["path"], error=str(e))
+            await _unavailable()(scope, receive, send)
+            return
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [(name, value) for name, value in response.headers.raw
+                            if name.lower() not in _DROPPED_RESPONSE_HEADERS],
+            })
+            async for chunk in response.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await response.aclose()
+
+    async def _call(self, node: str, scope, body: bytes) -> Optional[_Captured]:
+        """Buffered request to one node (this one in-process); None if unreachable"""
+        if node == self.cluster.self_url:
+            return await self._call_local(scope, body)
+        try:
+            with span("cluster.gather"):
+                response = await self.cluster.client.send(self._peer_request(node, scope, body))
+        except httpx.HTTPError as e:
+            logger.warning("cluster_node_unreachable", node=node, path=scope["path"], error=str(e))
+            return None
+        return _Captured(response.status_code, list(response.headers.raw), response.content)
+
+    async def _call_local(self, scope, body: bytes) -> _Captured:
+        captured = _Captured(500, [], b"")
+        chunks = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                captured.status = message["status"]
+                captured.headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(dict(scope), receive, send)
+        captured.body = b"".join(chunks)
+        return captured
+
+    async def _gather(self, scope, body: bytes) -> Dict[str, Optional[_Captured]]:
+        nodes = self.cluster.ring.nodes
+        results = await asyncio.gather(*(self._call(node, scope, body) for node in nodes))
+        return dict(zip(nodes, results))
+
+    # Scatter-gather
+
+    async def _gathered_rooms(self, scope) -> Tuple[Optional[_Captured], List[dict]]:
+        """Every node's answer to a room list request, merged newest first"""
+        results = await self._gather(scope, b"")
+        local = results[self.cluster.self_url]
+        if local.status != 200:
+            return local, []
+        rooms = []
+        for result in results.values():
+            if result is not None and result.status == 200:
+                rooms.extend(result.json())
+        rooms.sort(key=lambda room: room["created_at"], reverse=True)
+        return None, rooms
+
+    async def _list_rooms(self, scope, receive, send):
+        error, rooms = await self._gathered_rooms(scope)
+        if error is not None:
+            await _relay(error, send)
+            return
+        query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        limit = int(query["limit"]) if query.get("limit", "").isdigit() else 100
+        await JSONResponse(rooms[:limit])(scope, receive, send)
+
+    async def _quick_join(self, scope, receive, send):
+        probe = _sub_scope(scope, "GET", "/rooms",
+                           f"has_slots=true&limit={QUICK_JOIN_CANDIDATES}".encode())
+        error, rooms = await self._gathered_rooms(probe)
+        if error is not None:
+            await _relay(error, send)
+            return
+
+        candidates = [room for room in rooms
+                      if room["active_count"] < QUICK_JOIN_MAX_PARTICIPANTS]
+        for room in candidates[:QUICK_JOIN_ATTEMPTS]:
+            room_id = room["room_id"]
+            join = _sub_scope(scope, "POST", f"/rooms/{room_id}/join", b"",
+                              content_type=b"application/json")
+            result = await self._call(self.cluster.owner_of_room(room_id), join, b"{}")
+            if result is not None and result.status == 200:
+                await JSONResponse({"room": result.json()["room"], "created": False})(
+                    scope, receive, send)
+                return
+        # Nothing to join anywhere (or it filled up meanwhile): create one here
+        await self.app(scope, receive, send)
+
+    async def _join_by_code(self, scope, receive, send):
+        # Only the node holding the code can do anything but 404, so asking
+        # every node at once has no side effects elsewhere
+        results = await self._gather(scope, await _read_body(receive))
+        local = results[self.cluster.self_url]
+        for result in results.values():
+            if result is not None and result.status != 404:
+                await _relay(result, send)
+                return
+        await _relay(local, send)
+
+
+async def _read_body(receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return bytes(body)
+        body.extend(message.get("body", b""))
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+def _replay(body: bytes, receive):
+    """A receive callable that yields an already read body once, then defers"""
+    sent = False
+
+    async def replayed():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+    return replayed
+
+
+def _json_field(body: bytes, field: str):
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    return data.get(field) if isinstance(data, dict) else None
+
+
+def _sub_scope(scope, method: str, path: str, query_string: bytes,
+               content_type: Optional[bytes] = None) -> dict:
+    headers = [(name, value) for name, value in scope["headers"]
+               if name not in (b"content-type", b"content-length")]
+    if content_type is not None:
+        headers.append((b"content-type", content_type))
+    return dict(scope, method=method, path=path, raw_path=path.encode(),
+                query_string=query_string, headers=headers)
+
+
+async def _relay(captured: _Captured, send):
+    await send({
+        "type": "http.response.start",
+        "status": captured.status,
+        "headers": [(name, value) for name, value in captured.headers
+                    if name.lower() not in _DROPPED_RESPONSE_HEADERS],
+    })
+    await send({"type": "http.response.body", "body": captured.body})
+
+
+def _unavailable() -> JSONResponse:
+    return JSONResponse({"detail": "Room server unavailable, try again shortly"},
+                        status_code=503, headers={"Retry-After": "1"})
+
+
+async def verify_cluster_peer(request: Request):
+    """Dependency for internal endpoints that only other nodes may call"""
+    if not cluster.enabled or not is_peer_request(request.scope):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Cluster peers only"
+        )
+
+
+# Global cluster membership; disabled unless CLUSTER_NODES is set
+cluster = Cluster(
+    self_url=settings.CLUSTER_SELF_URL,
+    nodes=settings.CLUSTER_NODES,
+    vnodes=settings.CLUSTER_VIRTUAL_NODES,
+    secret=settings.CLUSTER_SECRET,
+    database=db,
+    chat=chat_history,
+    code_snapshots=snapshots,
+    moderation_manager=moderation,
+    allowed_nodes=settings.CLUSTER_ALLOWED_NODES,
+)
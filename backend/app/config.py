@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -18,10 +18,106 @@ class Settings(BaseSettings):
     DAILY_API_KEY: str
     DAILY_DOMAIN: str
 
+    # Upstream APIs (point these at a local stub to test failure handling)
+    LIVEBLOCKS_API_URL: str = "https://api.liveblocks.io"
+    DAILY_API_URL: str = "https://api.daily.co"
+    UPSTREAM_MIN_TIMEOUT_SECONDS: float = 1.0
+    UPSTREAM_MAX_TIMEOUT_SECONDS: float = 10.0
+    UPSTREAM_TIMEOUT_P99_MULTIPLIER: float = 3.0
+    UPSTREAM_HEDGING_ENABLED: bool = True
+    UPSTREAM_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    UPSTREAM_CIRCUIT_RESET_SECONDS: float = 30.0
+
     # BigQuery
     GOOGLE_CLOUD_PROJECT: str
     BIGQUERY_DATASET: str = "binarysearch"
     GOOGLE_APPLICATION_CREDENTIALS: Optional[str] = None
+    BIGQUERY_BATCH_INTERVAL_SECONDS: float = 1.0  # rows are inserted in batches off the event loop
+    BIGQUERY_MAX_QUEUED_ROWS: int = 50_000
+
+    # Structured logging (JSON lines, written by a background thread)
+    LOG_FILE: Optional[str] = None  # unset: stdout
+    LOG_QUEUE_MAX_RECORDS: int = 10_000  # beyond this, records are dropped and counted
+    LOG_FLUSH_INTERVAL_SECONDS: float = 0.2
+    LOG_SAMPLE_RATE: float = 1.0  # fraction of high-volume event logs kept
+    LOG_SAMPLE_RATES: Dict[str, float] = {}  # per event type, e.g. {"room_join": 0.1}
+
+    # Code execution
+    EXECUTOR_POOL_SIZE: int = 4  # warm workers per language
+    EXECUTOR_MAX_QUEUED_JOBS: int = 64  # per language, beyond busy workers
+    EXECUTOR_TIME_LIMIT_SECONDS: float = 5.0
+    EXECUTOR_MEMORY_LIMIT_MB: int = 256
+    EXECUTOR_MAX_OUTPUT_BYTES: int = 64 * 1024
+    EXECUTOR_RECYCLE_AFTER_JOBS: int = 200
+    SANDBOX_USER: str = "nobody"  # runs switch to this user when the backend runs as root; "" disables
+    SANDBOX_MAX_PROCESSES: int = 512  # RLIMIT_NPROC for the sandbox user, across concurrent runs
+    EXECUTOR_ALLOW_UNISOLATED: bool = False  # development only: keep pools whose runs are not sandboxed
+
+    # Rate limiting and load shedding
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_MAX_KEYS: int = 100_000  # buckets kept before LRU eviction
+    TRUST_FORWARDED_FOR: bool = False  # key by X-Forwarded-For behind a proxy
+    # Per IP, sized for a classroom behind one NAT address; per account (email)
+    # the limits stay tight to slow password guessing
+    LOGIN_RATE_PER_IP: float = 1.0  # tokens per second
+    LOGIN_BURST_PER_IP: int = 60
+    LOGIN_RATE_PER_ACCOUNT: float = 0.2
+    LOGIN_BURST_PER_ACCOUNT: int = 5
+    SIGNUP_RATE_PER_IP: float = 0.5
+    SIGNUP_BURST_PER_IP: int = 60
+    SIGNUP_RATE_PER_ACCOUNT: float = 0.05
+    SIGNUP_BURST_PER_ACCOUNT: int = 3
+    LOAD_SHED_LAG_MS: float = 100.0  # halve refill rates above this event-loop lag
+    LOAD_SHED_CRITICAL_LAG_MS: float = 500.0  # reject with 503 above this lag
+
+    # Rooms
+    ROOM_IDLE_EVICTION_MINUTES: int = 60  # evict rooms that stay empty this long
+    MAINTENANCE_INTERVAL_SECONDS: int = 60
+
+    # Invite codes for private rooms
+    INVITE_CODE_LENGTH: int = 8  # characters from a 32-letter alphabet
+    INVITE_CODE_TTL_HOURS: Optional[float] = None  # unset: codes last as long as the room
+
+    # Report triage
+    REPORT_WINDOW_MINUTES: float = 10.0  # sliding window for counting reports about a user in a room
+    REPORT_AUTO_KICK_THRESHOLD: int = 3  # distinct reporters in the window; 0 disables auto-kick
+    REPORT_AUTO_KICK_MINUTES: int = 10
+
+    # Chat history
+    CHAT_HISTORY_PER_ROOM: int = 500
+    CHAT_HISTORY_MAX_MESSAGES: int = 200_000  # across all rooms
+    CHAT_HISTORY_PAGE_SIZE: int = 50
+    CHAT_HISTORY_SPILL_DIR: Optional[str] = None  # unset: evicted messages are dropped
+
+    # Code snapshots
+    SNAPSHOT_KEYFRAME_INTERVAL: int = 20  # full copy every N versions
+    SNAPSHOT_MAX_VERSIONS_PER_ROOM: int = 500
+    SNAPSHOT_MAX_BYTES_PER_ROOM: int = 4 * 1024 * 1024  # compressed
+    SNAPSHOT_MAX_TOTAL_BYTES: int = 256 * 1024 * 1024  # across all rooms, compressed
+
+    # State persistence across restarts
+    STATE_DIR: Optional[str] = None  # unset: users, rooms and kicks live only in memory
+    STATE_SNAPSHOT_INTERVAL_SECONDS: int = 300
+    CHANGE_LOG_MAX_QUEUED: int = 100_000  # journal lines waiting for the writer thread
+    CHANGE_LOG_FLUSH_INTERVAL_SECONDS: float = 0.05  # at most this much is lost on a crash
+
+    # Traffic recording (anonymised request trace for scripts/replay_traffic.py)
+    TRAFFIC_RECORD_PATH: Optional[str] = None  # unset: not recording
+    TRAFFIC_RECORD_MAX_BYTES: int = 50 * 1024 * 1024  # rotate past this size
+    TRAFFIC_RECORD_BACKUPS: int = 5
+
+    # Cluster (rooms sharded across backend nodes by consistent hashing)
+    CLUSTER_NODES: List[str] = []  # base URL of every node; empty: single node
+    CLUSTER_SELF_URL: Optional[str] = None  # this node's entry in CLUSTER_NODES
+    CLUSTER_SECRET: Optional[str] = None  # shared by all nodes; keys the HMAC on node-to-node calls
+    CLUSTER_ALLOWED_NODES: List[str] = []  # nodes PUT /cluster/nodes may add besides CLUSTER_NODES
+    CLUSTER_VIRTUAL_NODES: int = 128  # ring points per node
+
+    # Diagnostics (admin-only profiler and slow request log)
+    ADMIN_TOKEN: Optional[str] = None  # X-Admin-Token for admin endpoints; unset: they are disabled
+    SLOW_REQUEST_THRESHOLD_MS: float = 500.0  # requests slower than this keep their span breakdown
+    SLOW_REQUEST_LOG_SIZE: int = 200  # most recent slow requests kept
+    PROFILER_MAX_SECONDS: int = 60
 
     # Environment
     ENVIRONMENT: str = "development"
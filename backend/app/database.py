@@ -1,7 +1,67 @@
-from typing import Dict, List, Optional
-from datetime import datetime
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Set
+from datetime import datetime, timedelta
+import heapq
+import re
+import secrets
+import time
 import uuid
+from app.config import settings
 from app.models import UserInDB, Room
+from app.tracing import traced
+
+_WORD_RE = re.compile(r"\w+")
+
+# 32 letters without the look-alikes 0/O and 1/I, so a byte maps to a letter
+# without bias through its low five bits
+INVITE_CODE_ALPHABET = "23456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+
+
+def normalize_invite_code(code: str) -> str:
+    """Invite codes are matched case-insensitively, ignoring surrounding spaces"""
+    return code.strip().upper()
+
+
+def title_terms(title: str) -> Set[str]:
+    """
+    Index terms for a room title: the 1- and 2-character prefix of every
+    word (marked with a leading "^") and every trigram inside a word.
+    """
+    terms = set()
+    for word in _WORD_RE.findall(title.lower()):
+        terms.add("^" + word[:1])
+        if len(word) >= 2:
+            terms.add("^" + word[:2])
+        for i in range(len(word) - 2):
+            terms.add(word[i:i + 3])
+    return terms
+
+
+def query_terms(word: str) -> Set[str]:
+    """Terms a title must contain to possibly match one query word"""
+    if len(word) < 3:
+        return {"^" + word}
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def title_matches(title: str, words: List[str]) -> bool:
+    """
+    Confirm an index candidate: 1-2 character query words must start a title
+    word, longer ones may appear anywhere (trigrams can match out of order).
+    """
+    title = title.lower()
+    title_words = None
+    for word in words:
+        if len(word) >= 3:
+            if word not in title:
+                return False
+            continue
+        if title_words is None:
+            title_words = _WORD_RE.findall(title)
+        if not any(w.startswith(word) for w in title_words):
+            return False
+    return True
 
 
 class Database:
@@ -9,14 +69,36 @@ class Database:
     In-memory database for MVP.
     In production, replace with PostgreSQL/MongoDB.
     """
-    def __init__(self):
+    def __init__(self, invite_code_length: int = 8, invite_code_ttl: Optional[timedelta] = None):
         self.users: Dict[str, UserInDB] = {}
         self.users_by_email: Dict[str, str] = {}  # email -> user_id
         self.rooms: Dict[str, Room] = {}
         self.room_participants: Dict[str, set] = {}  # room_id -> set of user_ids
-        self.active_rooms: List[str] = []  # List of active public room IDs
+        # Active public room IDs in creation order (dict used as an ordered set)
+        self.active_rooms: Dict[str, None] = {}
+
+        # Lobby search indexes, public rooms only
+        self.public_rooms_by_language: Dict[str, Set[str]] = {}
+        self.public_rooms_with_slots: Set[str] = set()
+        self.title_index: Dict[str, Set[str]] = {}  # title term -> room_ids
+
+        # Private room invite codes (normalized) -> room_id, and
+        # (expires_at, code, room_id) for codes with a TTL, in issue order
+        self.invite_code_length = invite_code_length
+        self.invite_code_ttl = invite_code_ttl
+        self.rooms_by_invite_code: Dict[str, str] = {}
+        self.invite_code_expiry: deque = deque()
+
+        # Rooms with no participants, in the order they became empty
+        self.empty_rooms: "OrderedDict[str, float]" = OrderedDict()
+
+        # Set by the state store (app.persistence) to journal changes
+        self.change_log = None
+        # Set by the cluster (app.cluster) so new rooms get ids this node owns
+        self.room_placement: Optional[Callable[[str], bool]] = None
 
     # User methods
+    @traced("db.create_user")
     def create_user(self, email: str, display_name: str, hashed_password: str) -> UserInDB:
         user_id = str(uuid.uuid4())
         user = UserInDB(
@@ -26,10 +108,21 @@ class Database:
             hashed_password=hashed_password,
             created_at=datetime.utcnow()
         )
-        self.users[user_id] = user
-        self.users_by_email[email.lower()] = user_id
+        self.insert_user(user)
         return user
 
+    def insert_user(self, user: UserInDB):
+        """Add a fully built user (new, or restored from a snapshot)"""
+        self.users[user.id] = user
+        self.users_by_email[user.email.lower()] = user.id
+        if self.change_log is not None:
+            self.change_log.append("user", user)
+
+    def insert_users(self, users: List[UserInDB]):
+        """Add many users at once when restoring a snapshot; not journaled"""
+        self.users.update({user.id: user for user in users})
+        self.users_by_email.update({user.email.lower(): user.id for user in users})
+
     def get_user_by_email(self, email: str) -> Optional[UserInDB]:
         user_id = self.users_by_email.get(email.lower())
         if user_id:
@@ -40,10 +133,18 @@ class Database:
         return self.users.get(user_id)
 
     # Room methods
+    @traced("db.create_room")
     def create_room(self, title: str, language: str, is_public: bool,
                    max_users: int, created_by: str, created_by_name: str) -> Room:
         room_id = str(uuid.uuid4())
-        invite_code = None if is_public else str(uuid.uuid4())[:8]
+        while self.room_placement is not None and not self.room_placement(room_id):
+            room_id = str(uuid.uuid4())
+        created_at = datetime.utcnow()
+        invite_code = invite_expires_at = None
+        if not is_public:
+            invite_code = self.new_invite_code()
+            if self.invite_code_ttl is not None:
+                invite_expires_at = created_at + self.invite_code_ttl
 
         room = Room(
             room_id=room_id,
@@ -53,40 +154,199 @@ class Database:
             max_users=max_users,
             created_by=created_by,
             created_by_name=created_by_name,
-            created_at=datetime.utcnow(),
+            created_at=created_at,
             active_count=0,
-            invite_code=invite_code
+            invite_code=invite_code,
+            invite_expires_at=invite_expires_at
         )
+        self.insert_room(room)
+        return room
+
+    def insert_room(self, room: Room, participants: Optional[Set[str]] = None):
+        """Add a fully built room and index it (new, or restored from a snapshot)"""
+        room_id = room.room_id
+        if room.invite_code is not None:
+            self._index_invite_code(room)
+        if self.change_log is not None:
+            self.change_log.append("room", room)
         self.rooms[room_id] = room
         self.room_participants[room_id] = set()
 
-        if is_public:
-            self.active_rooms.append(room_id)
+        if room.is_public:
+            self.active_rooms[room_id] = None
+            self.public_rooms_by_language.setdefault(room.language, set()).add(room_id)
+            for term in title_terms(room.title):
+                self.title_index.setdefault(term, set()).add(room_id)
+
+        if participants:
+            self.room_participants[room_id] = set(participants)
+        self._participants_changed(room_id)
+
+    @traced("db.evict_room")
+    def evict_room(self, room_id: str) -> Optional[Room]:
+        """Remove a room and its index entries"""
+        room = self.rooms.pop(room_id, None)
+        if room is None:
+            return None
+        if self.change_log is not None:
+            self.change_log.append("evict", room_id)
+        self.room_participants.pop(room_id, None)
+        self.empty_rooms.pop(room_id, None)
+        if room.invite_code is not None:
+            code = normalize_invite_code(room.invite_code)
+            if self.rooms_by_invite_code.get(code) == room_id:
+                del self.rooms_by_invite_code[code]
 
+        if room.is_public:
+            self.active_rooms.pop(room_id, None)
+            self.public_rooms_with_slots.discard(room_id)
+            language_rooms = self.public_rooms_by_language.get(room.language)
+            if language_rooms is not None:
+                language_rooms.discard(room_id)
+                if not language_rooms:
+                    del self.public_rooms_by_language[room.language]
+            for term in title_terms(room.title):
+                term_rooms = self.title_index.get(term)
+                if term_rooms is not None:
+                    term_rooms.discard(room_id)
+                    if not term_rooms:
+                        del self.title_index[term]
         return room
 
+    def evict_idle_rooms(self, idle_seconds: float) -> List[Room]:
+        """Evict rooms that have been empty for longer than `idle_seconds`"""
+        cutoff = time.monotonic() - idle_seconds
+        evicted = []
+        while self.empty_rooms:
+            room_id, emptied_at = next(iter(self.empty_rooms.items()))
+            if emptied_at > cutoff:
+                break
+            evicted.append(self.evict_room(room_id))
+        return evicted
+
     def get_room(self, room_id: str) -> Optional[Room]:
         return self.rooms.get(room_id)
 
+    # Invite code methods
+    def new_invite_code(self) -> str:
+        """A random code that no live room is using"""
+        while True:
+            code = "".join(INVITE_CODE_ALPHABET[byte & 31]
+                           for byte in secrets.token_bytes(self.invite_code_length))
+            if code not in self.rooms_by_invite_code:
+                return code
+
+    def _index_invite_code(self, room: Room):
+        code = normalize_invite_code(room.invite_code)
+        holder = self.rooms_by_invite_code.get(code)
+        if holder is not None and holder != room.room_id:
+            # Only possible for rooms restored from before codes were
+            # collision-checked: the later room gets a fresh code
+            room.invite_code = code = self.new_invite_code()
+        self.rooms_by_invite_code[code] = room.room_id
+        if room.invite_expires_at is not None:
+            self.invite_code_expiry.append((room.invite_expires_at, code, room.room_id))
+
+    def get_room_by_invite_code(self, invite_code: str) -> Optional[Room]:
+        """The room a live, unexpired invite code opens, in one hash lookup"""
+        room_id = self.rooms_by_invite_code.get(normalize_invite_code(invite_code))
+        if room_id is None:
+            return None
+        room = self.rooms[room_id]
+        if room.invite_expires_at is not None and room.invite_expires_at <= datetime.utcnow():
+            return None
+        return room
+
+    def release_expired_invite_codes(self) -> int:
+        """Drop expired codes from the index so they can be issued again"""
+        now = datetime.utcnow()
+        released = 0
+        while self.invite_code_expiry and self.invite_code_expiry[0][0] <= now:
+            _, code, room_id = self.invite_code_expiry.popleft()
+            if self.rooms_by_invite_code.get(code) == room_id:
+                del self.rooms_by_invite_code[code]
+                released += 1
+        return released
+
+    @traced("db.get_public_rooms")
     def get_public_rooms(self) -> List[Room]:
         """Get all active public rooms sorted by creation time (newest first)"""
-        public_rooms = [
-            room for room in self.rooms.values()
-            if room.is_public
-        ]
-        return sorted(public_rooms, key=lambda x: x.created_at, reverse=True)
+        return [self.rooms[room_id] for room_id in reversed(self.active_rooms)]
+
+    @traced("db.search_public_rooms")
+    def search_public_rooms(self, language: Optional[str] = None,
+                            has_slots: bool = False, query: Optional[str] = None,
+                            limit: Optional[int] = None) -> List[Room]:
+        """
+        Filter public rooms through the indexes, newest first. Title queries
+        match per word (see `title_matches`). Candidates come
+        from the smallest matching index, so cost follows the number of
+        matches rather than the number of rooms.
+        """
+        candidate_sets: List[Set[str]] = []
+        if language is not None:
+            candidate_sets.append(self.public_rooms_by_language.get(language, set()))
+        if has_slots:
+            candidate_sets.append(self.public_rooms_with_slots)
+
+        words = _WORD_RE.findall(query.lower()) if query else []
+        for word in words:
+            for term in query_terms(word):
+                candidate_sets.append(self.title_index.get(term, set()))
+
+        if not candidate_sets:
+            newest = (self.rooms[room_id] for room_id in reversed(self.active_rooms))
+            return list(islice(newest, limit))
+
+        candidate_sets.sort(key=len)
+        smallest, rest = candidate_sets[0], candidate_sets[1:]
+        matches = []
+        for room_id in smallest:
+            if any(room_id not in other for other in rest):
+                continue
+            room = self.rooms[room_id]
+            if title_matches(room.title, words):
+                matches.append(room)
 
+        if limit is not None:
+            return heapq.nlargest(limit, matches, key=lambda x: x.created_at)
+        return sorted(matches, key=lambda x: x.created_at, reverse=True)
+
+    @traced("db.add_participant")
     def add_participant(self, room_id: str, user_id: str):
-        if room_id in self.room_participants:
-            self.room_participants[room_id].add(user_id)
-            if room_id in self.rooms:
-                self.rooms[room_id].active_count = len(self.room_participants[room_id])
+        participants = self.room_participants.get(room_id)
+        if participants is not None and user_id not in participants:
+            participants.add(user_id)
+            if self.change_log is not None:
+                self.change_log.append("join", room_id, user_id)
+            self._participants_changed(room_id)
 
+    @traced("db.remove_participant")
     def remove_participant(self, room_id: str, user_id: str):
-        if room_id in self.room_participants:
-            self.room_participants[room_id].discard(user_id)
-            if room_id in self.rooms:
-                self.rooms[room_id].active_count = len(self.room_participants[room_id])
+        participants = self.room_participants.get(room_id)
+        if participants is not None and user_id in participants:
+            participants.discard(user_id)
+            if self.change_log is not None:
+                self.change_log.append("leave", room_id, user_id)
+            self._participants_changed(room_id)
+
+    def _participants_changed(self, room_id: str):
+        count = len(self.room_participants[room_id])
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        room.active_count = count
+
+        if count == 0:
+            self.empty_rooms.setdefault(room_id, time.monotonic())
+        else:
+            self.empty_rooms.pop(room_id, None)
+
+        if room.is_public:
+            if count < room.max_users:
+                self.public_rooms_with_slots.add(room_id)
+            else:
+                self.public_rooms_with_slots.discard(room_id)
 
     def get_room_participants(self, room_id: str) -> set:
         return self.room_participants.get(room_id, set())
@@ -98,13 +358,19 @@ class Database:
         participants = self.get_room_participants(room_id)
         return len(participants) >= room.max_users
 
+    @traced("db.find_available_public_room")
     def find_available_public_room(self, max_participants: int = 5) -> Optional[Room]:
         """Find a public room with fewer than max_participants people"""
-        for room in self.get_public_rooms():
+        for room_id in reversed(self.active_rooms):
+            room = self.rooms[room_id]
             if room.active_count < max_participants and room.active_count < room.max_users:
                 return room
         return None
 
 
 # Global database instance
-db = Database()
+db = Database(
+    invite_code_length=settings.INVITE_CODE_LENGTH,
+    invite_code_ttl=(timedelta(hours=settings.INVITE_CODE_TTL_HOURS)
+                     if settings.INVITE_CODE_TTL_HOURS else None),
+)
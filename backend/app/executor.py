@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+
+from app.config import settings
+from app.logger import logger
+from app.sandbox_worker import COMPILE_TIME_LIMIT_SECONDS, LANGUAGES, worker_env
+
+
+class ExecutorBusy(Exception):
+    """Raised when a language's job queue is full"""
+
+
+class LanguageUnavailable(Exception):
+    """Raised when no warm pool exists for a language"""
+
+
+class SandboxWorker:
+    """
+    Handle on one pre-warmed `app.sandbox_worker` process.
+    """
+    def __init__(self, language: str):
+        self.language = language
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.jobs_run = 0
+        self.isolation: dict = {}
+
+    async def start(self):
+        # Never the server's environment: user code must not see its secrets
+        env = worker_env(os.environ)
+        env["SANDBOX_USER"] = settings.SANDBOX_USER
+        env["SANDBOX_MAX_PROCESSES"] = str(settings.SANDBOX_MAX_PROCESSES)
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "app.sandbox_worker", self.language,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            cwd=str(Path(__file__).resolve().parent.parent),
+            env=env,
+            limit=2 ** 20,
+        )
+        ready = json.loads(await self.process.stdout.readline())
+        if ready.get("type") != "ready":
+            raise RuntimeError(f"Sandbox worker for {self.language} failed to start")
+        self.isolation = {key: ready.get(key, False) for key in ("network_isolated", "sandbox_user")}
+
+    @property
+    def isolated(self) -> bool:
+        """Whether runs may use this worker: fully sandboxed, or explicitly allowed not to be"""
+        return all(self.isolation.values()) or settings.EXECUTOR_ALLOW_UNISOLATED
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def run(self, job: dict) -> AsyncIterator[dict]:
+        """Send one job and yield its output frames up to and including `done`"""
+        self.jobs_run += 1
+        self.process.stdin.write((json.dumps(job) + "\n").encode())
+        await self.process.stdin.drain()
+
+        # The worker enforces the time limits itself; this is a backstop.
+        compile_time = COMPILE_TIME_LIMIT_SECONDS if LANGUAGES[self.language].get("compile") else 0
+        deadline = time.monotonic() + compile_time + job["time_limit"] + 5
+        while True:
+            line = await asyncio.wait_for(
+                self.process.stdout.readline(), timeout=max(0.1, deadline - time.monotonic())
+            )
+            if not line:
+                raise RuntimeError("Sandbox worker exited unexpectedly")
+            frame = json.loads(line)
+            yield frame
+            if frame["type"] == "done":
+                return
+
+    def kill(self):
+        if self.alive:
+            self.process.kill()
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of warm workers for one language. Idle workers sit in a
+    FIFO queue, so waiting jobs are served in arrival order.
+    """
+    def __init__(self, language: str, size: int, max_queued: int):
+        self.language = language
+        self.size = size
+        self.max_queued = max_queued
+        self.idle: asyncio.Queue = asyncio.Queue()
+        self.waiting = 0
+        self._respawning: set = set()
+
+    async def start(self):
+        workers = [SandboxWorker(self.language) for _ in range(self.size)]
+        await asyncio.gather(*(w.start() for w in workers))
+        if workers and not all(workers[0].isolation.values()):
+            logger.warning("sandbox_weak_isolation", language=self.language, **workers[0].isolation)
+        if not all(worker.isolated for worker in workers):
+            # Fail closed: without its own user and network namespace a run
+            # can read the server's files and reach the network
+            for worker in workers:
+                worker.kill()
+            raise RuntimeError("sandbox is not isolated; set EXECUTOR_ALLOW_UNISOLATED to run anyway")
+        for worker in workers:
+            self.idle.put_nowait(worker)
+
+    def ensure_capacity(self):
+        if self.idle.empty() and self.waiting >= self.max_queued:
+            raise ExecutorBusy(self.language)
+
+    async def acquire(self) -> SandboxWorker:
+        self.ensure_capacity()
+        self.waiting += 1
+        try:
+            return await self.idle.get()
+        finally:
+            self.waiting -= 1
+
+    def release(self, worker: SandboxWorker, healthy: bool):
+        """Return a worker to the pool, replacing it if it is broken or worn out"""
+        if healthy and worker.alive and worker.jobs_run < settings.EXECUTOR_RECYCLE_AFTER_JOBS:
+            self.idle.put_nowait(worker)
+            return
+
+        worker.kill()
+        task = asyncio.ensure_future(self._respawn())
+        self._respawning.add(task)
+        task.add_done_callback(self._respawning.discard)
+
+    async def _respawn(self):
+        replacement = SandboxWorker(self.language)
+        try:
+            await replacement.start()
+            if not replacement.isolated:
+                replacement.kill()
+                raise RuntimeError("replacement sandbox is not isolated")
+        except Exception as e:
+            logger.error("sandbox_respawn_failed", language=self.language, error=str(e))
+            # Retry on the next release rather than shrinking the pool
+            replacement.jobs_run = settings.EXECUTOR_RECYCLE_AFTER_JOBS
+        self.idle.put_nowait(replacement)
+
+    async def shutdown(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().kill()
+
+
+class CodeExecutor:
+    """
+    Runs user code in per-language pools of pre-warmed sandbox workers.
+    Only languages whose toolchain is installed on this host get a pool.
+    """
+    def __init__(self):
+        self.pools: Dict[str, WorkerPool] = {}
+
+    @staticmethod
+    def _toolchain_available(language: str) -> bool:
+        spec = LANGUAGES[language]
+        commands = [spec.get("compile"), spec["run"]]
+        for command in filter(None, commands):
+            binary = command.split()[0]
+            if not binary.startswith("./") and shutil.which(binary) is None:
+                return False
+        return True
+
+    async def start(self):
+        for language in LANGUAGES:
+            if not self._toolchain_available(language):
+                continue
+            pool = WorkerPool(
+                language,
+                size=settings.EXECUTOR_POOL_SIZE,
+                max_queued=settings.EXECUTOR_MAX_QUEUED_JOBS,
+            )
+            try:
+                await pool.start()
+            except Exception as e:
+                logger.warning("sandbox_pool_disabled", language=language, error=str(e))
+                await pool.shutdown()
+                continue
+            self.pools[language] = pool
+
+    async def shutdown(self):
+        for pool in self.pools.values():
+            await pool.shutdown()
+        self.pools.clear()
+
+    def available_languages(self) -> list:
+        return sorted(self.pools)
+
+    def _get_pool(self, language: str) -> WorkerPool:
+        pool = self.pools.get(language)
+        if pool is None:
+            raise LanguageUnavailable(language)
+        return pool
+
+    def ensure_capacity(self, language: str):
+        """Fail fast, before a response starts streaming, if a run cannot be queued"""
+        self._get_pool(language).ensure_capacity()
+
+    async def execute(self, language: str, code: str, stdin: str = "") -> AsyncIterator[dict]:
+        """
+        Run code on a warm worker and yield `stdout`/`stderr` frames as they
+        are produced, followed by a single `done` frame with the result.
+        """
+        pool = self._get_pool(language)
+        worker = await pool.acquire()
+        healthy = False
+        try:
+            job = {
+                "code": code,
+                "stdin": stdin,
+                "time_limit": settings.EXECUTOR_TIME_LIMIT_SECONDS,
+                "memory_mb": settings.EXECUTOR_MEMORY_LIMIT_MB,
+                "max_output_bytes": settings.EXECUTOR_MAX_OUTPUT_BYTES,
+            }
+            async for frame in worker.run(job):
+                if frame["type"] == "done":
+                    healthy = frame["status"] != "internal_error"
+                yield frame
+        finally:
+            # A worker abandoned mid-job (client disconnect, backstop timeout)
+            # still has a child running, so it is replaced rather than reused.
+            pool.release(worker, healthy)
+
+
+# Global code executor instance
+executor = CodeExecutor()
@@ -0,0 +1,172 @@
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+import json
+import random
+import sys
+import threading
+import time
+
+from app.config import settings
+from app.tracing import traced
+
+
+class BackgroundQueue:
+    """
+    Bounded hand-off from the event loop to one daemon writer thread.
+    `put` never blocks and takes no lock: when the queue is full the item is
+    dropped and counted. Every `flush_interval` seconds the writer drains
+    whatever is queued and passes it to `handler` as one batch.
+    """
+    def __init__(self, name: str, handler: Callable[[list], None],
+                 max_items: int, flush_interval: float):
+        self.name = name
+        self.handler = handler
+        self.max_items = max_items
+        self.flush_interval = flush_interval
+        self.items: deque = deque()
+        self.dropped = 0
+        self._closing = False
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def put(self, item) -> bool:
+        if len(self.items) >= self.max_items:
+            self.dropped += 1
+            return False
+        self.items.append(item)
+        if self._thread is None:
+            self._start()
+        return True
+
+    def close(self, timeout: float = 5.0):
+        """Flush what is queued and stop the writer"""
+        self._closing = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._closing = False
+        self._wake.clear()
+
+    def _start(self):
+        # Started on first use, so importing the module spawns nothing
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            batch = [self.items.popleft() for _ in range(len(self.items))]
+            if batch:
+                try:
+                    self.handler(batch)
+                except Exception as e:
+                    # Nowhere better to report a broken sink
+                    sys.stderr.write(f"{self.name} handler failed: {e!r}\n")
+            if self._closing and not self.items:
+                return
+
+
+class StructuredLogger:
+    """
+    JSON-lines logger that never does I/O on the calling thread. Callers
+    only build a dict and append it to a queue; timestamps are formatted,
+    records are serialized and written by a background thread.
+
+    `sampled` is for high-volume events: it keeps a fraction of them
+    (LOG_SAMPLE_RATES per event, else LOG_SAMPLE_RATE) and tags each kept
+    record with its sample rate. Records dropped because the queue was full
+    are counted and reported in the stream as a `log_dropped` record.
+    """
+    def __init__(self, path: Optional[str] = None, max_queued: int = 10_000,
+                 flush_interval: float = 0.2, sample_rate: float = 1.0,
+                 sample_rates: Optional[Dict[str, float]] = None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.sample_rates = sample_rates or {}
+        self.sampled_out: Dict[str, int] = {}
+        self.queue = BackgroundQueue("log-writer", self._write_batch,
+                                     max_items=max_queued, flush_interval=flush_interval)
+        self._reported_dropped = 0
+        self._file = None
+
+    @traced("logger")
+    def log(self, level: str, event: str, **fields):
+        record = {"ts": time.time(), "level": level, "event": event}
+        record.update(fields)
+        self.queue.put(record)
+
+    def info(self, event: str, **fields):
+        self.log("info", event, **fields)
+
+    def warning(self, event: str, **fields):
+        self.log("warning", event, **fields)
+
+    def error(self, event: str, **fields):
+        self.log("error", event, **fields)
+
+    def sampled(self, event: str, sample_key: Optional[str] = None, **fields):
+        """Log an info record, keeping only the configured fraction"""
+        key = sample_key or event
+        rate = self.sample_rates.get(key, self.sample_rate)
+        if rate < 1.0:
+            if random.random() >= rate:
+                self.sampled_out[key] = self.sampled_out.get(key, 0) + 1
+                return
+            fields["sample_rate"] = rate
+        self.log("info", event, **fields)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self.queue.items),
+            "dropped": self.queue.dropped,
+            "sampled_out": dict(self.sampled_out),
+        }
+
+    def close(self):
+        self.queue.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_batch(self, records: List[dict]):
+        lines = []
+        dropped = self.queue.dropped
+        if dropped > self._reported_dropped:
+            lines.append(json.dumps({
+                "ts": _iso(time.time()), "level": "warning", "event": "log_dropped",
+                "count": dropped - self._reported_dropped, "total": dropped
+            }))
+            self._reported_dropped = dropped
+        for record in records:
+            record["ts"] = _iso(record["ts"])
+            lines.append(json.dumps(record, default=str))
+
+        stream = self._stream()
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+
+    def _stream(self):
+        if self.path is None:
+            return sys.stdout
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+# Global structured logger
+logger = StructuredLogger(
+    path=settings.LOG_FILE,
+    max_queued=settings.LOG_QUEUE_MAX_RECORDS,
+    flush_interval=settings.LOG_FLUSH_INTERVAL_SECONDS,
+    sample_rate=settings.LOG_SAMPLE_RATE,
+    sample_rates=settings.LOG_SAMPLE_RATES,
+)
@@ -1,26 +1,57 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, status
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import timedelta
-import httpx
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from datetime import datetime, timedelta
+import asyncio
+import json
+import math
+import threading
 import time
-from typing import List
+import uuid
+from typing import List, Optional
 
 from app.config import settings
 from app.models import (
     UserCreate, UserLogin, Token, User, RoomCreate, Room,
-    RoomJoin, LiveblocksAuthRequest, DailyRoomRequest,
-    KickUserRequest, ReportUserRequest, AnalyticsEvent
+    RoomJoin, RoomJoinByCode, RoomEnterResponse, ProgrammingLanguage, LiveblocksAuthRequest, DailyRoomRequest,
+    KickUserRequest, ReportUserRequest, AnalyticsEvent, RunCodeRequest,
+    ChatMessageCreate, ChatMessage, ChatHistoryPage,
+    CodeSnapshotCreate, CodeSnapshotInfo, CodeSnapshot,
+    ClusterNodesUpdate, ClusterMembership, ClusterUserLookup
 )
 from app.auth import (
-    get_password_hash, authenticate_user, create_access_token,
-    get_current_user
+    get_password_hash, authenticate_user, create_user_token,
+    get_current_user, get_admin_user
 )
 from app.database import db
-from app.moderation import moderation
+from app.moderation import moderation, report_triage
 from app.bigquery_logger import bq_logger
+from app.logger import logger
+from app.chat_history import chat_history
+from app.snapshots import snapshots
+from app.executor import executor, ExecutorBusy, LanguageUnavailable
+from app.upstream import upstream, UpstreamError
+from app.rate_limit import RateLimitMiddleware, check_account_limit, rate_limit_buckets, lag_monitor
+from app.persistence import state_store
+from app.traffic import TrafficRecorderMiddleware, traffic_recorder
+from app.tracing import SlowRequestMiddleware, slow_requests
+from app.profiler import profiler, ProfilerBusy
+from app.cluster import ClusterPeerMiddleware, ClusterRouterMiddleware, cluster, verify_cluster_peer
 
 app = FastAPI(title="BinarySearch API", version="1.0.0")
 
+# Room-affinity routing between nodes (innermost, so requests are rate limited
+# where they enter the cluster)
+if cluster.enabled:
+    app.add_middleware(ClusterRouterMiddleware, cluster=cluster)
+
+# Rate limiting (added first so CORS headers are still set on 429/503 responses)
+app.add_middleware(RateLimitMiddleware, buckets=rate_limit_buckets, lag_monitor=lag_monitor)
+
+# Recognises signed node-to-node requests for the rate limiter and router
+if cluster.enabled:
+    app.add_middleware(ClusterPeerMiddleware, cluster=cluster)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +61,83 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in anonymised traffic recording (outermost, so rejected requests are recorded too)
+if traffic_recorder is not None:
+    app.add_middleware(TrafficRecorderMiddleware, recorder=traffic_recorder, routes=app.routes)
+
+# Span breakdown of slow requests (outermost, so queueing in the other middlewares counts)
+app.add_middleware(SlowRequestMiddleware, log=slow_requests)
+
+
+async def run_maintenance():
+    """
+    Evict long-empty rooms with their chat and snapshots, expire kicks and
+    invite codes, and log report cases that have gone quiet
+    """
+    while True:
+        await asyncio.sleep(settings.MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            for room in db.evict_idle_rooms(settings.ROOM_IDLE_EVICTION_MINUTES * 60):
+                chat_history.remove_room(room.room_id)
+                snapshots.remove_room(room.room_id)
+                bq_logger.log_room_session(
+                    room_id=room.room_id,
+                    room_title=room.title,
+                    created_by=room.created_by,
+                    started_at=room.created_at,
+                    ended_at=datetime.utcnow()
+                )
+            moderation.cleanup_expired_kicks()
+            db.release_expired_invite_codes()
+            for case in report_triage.close_quiet_cases():
+                bq_logger.log_report(case)
+        except Exception as e:
+            logger.error("maintenance_failed", error=str(e))
+
+
+async def run_state_snapshots():
+    """Snapshot users, rooms and kicks so the change log stays short"""
+    while True:
+        await asyncio.sleep(settings.STATE_SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            await state_store.save()
+        except OSError as e:
+            logger.error("state_snapshot_failed", error=str(e))
+
+
+@app.on_event("startup")
+async def startup():
+    if settings.STATE_DIR:
+        restored = state_store.restore()
+        logger.info("state_restored", **restored)
+        app.state.state_snapshot_task = asyncio.create_task(run_state_snapshots())
+    if cluster.enabled:
+        # Restored state may include rooms that other nodes own by now
+        cluster.schedule_rebalance()
+    await executor.start()
+    app.state.maintenance_task = asyncio.create_task(run_maintenance())
+    app.state.lag_monitor_task = asyncio.create_task(lag_monitor.run())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.maintenance_task.cancel()
+    app.state.lag_monitor_task.cancel()
+    if settings.STATE_DIR:
+        app.state.state_snapshot_task.cancel()
+        await state_store.save()
+        await asyncio.to_thread(state_store.close)
+    await executor.shutdown()
+    await upstream.close()
+    await cluster.close()
+    for case in report_triage.close_all():
+        bq_logger.log_report(case)
+    await asyncio.to_thread(bq_logger.close)
+    await asyncio.to_thread(chat_history.close)
+    if traffic_recorder is not None:
+        traffic_recorder.close()
+    logger.close()
+
 
 # Health check
 @app.get("/health")
@@ -42,6 +150,8 @@ async def health_check():
 @app.post("/auth/signup", response_model=Token, status_code=status.HTTP_201_CREATED)
 async def signup(user_data: UserCreate):
     """Register a new user"""
+    check_account_limit("signup", user_data.email)
+
     # Check if user already exists
     existing_user = db.get_user_by_email(user_data.email)
     if existing_user:
@@ -59,7 +169,7 @@ async def signup(user_data: UserCreate):
     )
 
     # Create access token
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_user_token(user)
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -67,6 +177,7 @@ async def signup(user_data: UserCreate):
 @app.post("/auth/login", response_model=Token)
 async def login(credentials: UserLogin):
     """Login with email and password"""
+    check_account_limit("login", credentials.email)
     user = authenticate_user(credentials.email, credentials.password)
     if not user:
         raise HTTPException(
@@ -75,7 +186,7 @@ async def login(credentials: UserLogin):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -114,9 +225,20 @@ async def create_room(
 
 
 @app.get("/rooms", response_model=List[Room])
-async def list_rooms(current_user: User = Depends(get_current_user)):
-    """List all public rooms"""
-    rooms = db.get_public_rooms()
+async def list_rooms(
+    language: Optional[ProgrammingLanguage] = None,
+    has_slots: bool = False,
+    q: Optional[str] = Query(default=None, max_length=100),
+    limit: int = Query(default=100, ge=1, le=500),
+    current_user: User = Depends(get_current_user)
+):
+    """List public rooms, newest first, optionally filtered by language, free slots and title"""
+    rooms = db.search_public_rooms(
+        language=language.value if language else None,
+        has_slots=has_slots,
+        query=q,
+        limit=limit
+    )
     return rooms
 
 
@@ -133,6 +255,14 @@ async def get_room(room_id: str, current_user: User = Depends(get_current_user))
     return room
 
 
+def _invite_code_opens(invite_code: Optional[str], room_id: str) -> bool:
+    """Whether a live, unexpired invite code belongs to this room"""
+    if not invite_code:
+        return False
+    room = db.get_room_by_invite_code(invite_code)
+    return room is not None and room.room_id == room_id
+
+
 @app.post("/rooms/{room_id}/join")
 async def join_room(
     room_id: str,
@@ -163,7 +293,7 @@ async def join_room(
 
     # For private rooms, check invite code
     if not room.is_public:
-        if not join_data.invite_code or join_data.invite_code != room.invite_code:
+        if not _invite_code_opens(join_data.invite_code, room_id):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Invalid invite code"
@@ -183,6 +313,100 @@ async def join_room(
     return {"success": True, "room": room}
 
 
+@app.post("/rooms/join-by-code")
+async def join_room_by_code(
+    join_data: RoomJoinByCode,
+    current_user: User = Depends(get_current_user)
+):
+    """Join a private room knowing only its invite code"""
+    room = db.get_room_by_invite_code(join_data.invite_code)
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Invalid or expired invite code"
+        )
+
+    return await join_room(room.room_id, RoomJoin(invite_code=join_data.invite_code),
+                           current_user)
+
+
+@app.post("/rooms/{room_id}/enter", response_model=RoomEnterResponse)
+async def enter_room(
+    room_id: str,
+    join_data: RoomJoin,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Join a room and get everything needed to start in one round trip:
+    the room, a Liveblocks token and, if Daily.co is reachable, a voice token.
+    """
+    room = db.get_room(room_id)
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Room not found"
+        )
+
+    # Check if user is kicked
+    if moderation.is_user_kicked(room_id, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You have been temporarily banned from this room"
+        )
+
+    # Re-entering (reload, quick join) does not need a free slot
+    already_joined = current_user.id in db.get_room_participants(room_id)
+    if not already_joined and db.is_room_full(room_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Room is full"
+        )
+
+    # For private rooms, check invite code (the creator and members may re-enter)
+    if not room.is_public and not already_joined and room.created_by != current_user.id:
+        if not _invite_code_opens(join_data.invite_code, room_id):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Invalid invite code"
+            )
+
+    # Take the seat before awaiting the upstreams, so concurrent entries
+    # cannot all pass the capacity check; it is given back if they fail
+    if not already_joined:
+        db.add_participant(room_id, current_user.id)
+    try:
+        liveblocks_result, voice_result = await asyncio.gather(
+            upstream.mint_liveblocks_token(room_id, current_user),
+            upstream.mint_daily_token(room, current_user),
+            return_exceptions=True
+        )
+        if isinstance(liveblocks_result, UpstreamError):
+            raise upstream_http_exception(liveblocks_result)
+        if isinstance(liveblocks_result, BaseException):
+            raise liveblocks_result
+    except BaseException:
+        if not already_joined:
+            db.remove_participant(room_id, current_user.id)
+        raise
+
+    # Voice is optional: the room works without it
+    voice = None
+    if isinstance(voice_result, BaseException):
+        logger.warning("voice_token_unavailable", room_id=room_id, error=str(voice_result))
+    else:
+        voice = voice_result
+
+    if not already_joined:
+        bq_logger.log_event(
+            event_type="room_join",
+            user_id=current_user.id,
+            room_id=room_id,
+            metadata={"display_name": current_user.display_name}
+        )
+
+    return {"room": room, "liveblocks": liveblocks_result, "voice": voice}
+
+
 @app.post("/rooms/{room_id}/leave")
 async def leave_room(
     room_id: str,
@@ -253,8 +477,235 @@ async def quick_join(current_user: User = Depends(get_current_user)):
         return {"room": new_room, "created": True}
 
 
+# ==================== CHAT ENDPOINTS ====================
+
+@app.post("/rooms/{room_id}/messages", response_model=ChatMessage,
+          status_code=status.HTTP_201_CREATED)
+async def post_message(
+    room_id: str,
+    message: ChatMessageCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Store a chat message so late joiners can load it"""
+    room = db.get_room(room_id)
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Room not found"
+        )
+
+    # Check if user is kicked
+    if moderation.is_user_kicked(room_id, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are banned from this room"
+        )
+
+    record = chat_history.add_message(
+        room_id=room_id,
+        user_id=current_user.id,
+        user_name=current_user.display_name,
+        text=message.text
+    )
+
+    bq_logger.log_event(
+        event_type="message_sent",
+        user_id=current_user.id,
+        room_id=room_id
+    )
+
+    return record.to_message(room_id)
+
+
+@app.get("/rooms/{room_id}/messages", response_model=ChatHistoryPage)
+async def get_messages(
+    room_id: str,
+    before: Optional[int] = Query(default=None, ge=1),
+    limit: int = Query(default=settings.CHAT_HISTORY_PAGE_SIZE, ge=1, le=200),
+    current_user: User = Depends(get_current_user)
+):
+    """Get a page of chat history, newest page first; oldest message first within a page"""
+    room = db.get_room(room_id)
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Room not found"
+        )
+
+    records = await chat_history.get_messages(room_id, before=before, limit=limit)
+    next_before = records[0].seq if records and records[0].seq > 1 else None
+
+    return {
+        "messages": [record.to_message(room_id) for record in records],
+        "next_before": next_before
+    }
+
+
+# ==================== CODE SNAPSHOT ENDPOINTS ====================
+
+@app.post("/rooms/{room_id}/snapshots", response_model=CodeSnapshotInfo,
+          status_code=status.HTTP_201_CREATED)
+async def save_snapshot(
+    room_id: str,
+    snapshot: CodeSnapshotCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Save the editor contents (no new version if unchanged)"""
+    room = db.get_room(room_id)
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Room not found"
+        )
+
+    # Check if user is kicked
+    if moderation.is_user_kicked(room_id, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are banned from this room"
+        )
+
+    entry = snapshots.save(room_id, snapshot.code)
+    return entry.to_info()
+
+
+@app.get("/rooms/{room_id}/snapshots", response_model=List[CodeSnapshotInfo])
+async def list_snapshots(room_id: str, current_user: User = Depends(get_current_user)):
+    """List stored versions of the room's code, oldest first"""
+    room = db.get_room(room_id)
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Room not found"
+        )
+
+    return [entry.to_info() for entry in snapshots.list_versions(room_id)]
+
+
+@app.get("/rooms/{room_id}/snapshots/latest", response_model=CodeSnapshot)
+async def get_latest_snapshot(room_id: str, current_user: User = Depends(get_current_user)):
+    """Get the most recent version of the room's code"""
+    result = snapshots.get_latest(room_id) if db.get_room(room_id) else None
+    if not result:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Snapshot not found"
+        )
+
+    entry, code = result
+    return {**entry.to_info().model_dump(), "code": code}
+
+
+@app.get("/rooms/{room_id}/snapshots/{version}", response_model=CodeSnapshot)
+async def get_snapshot(
+    room_id: str,
+    version: int,
+    current_user: User = Depends(get_current_user)
+):
+    """Reconstruct any stored version of the room's code"""
+    result = snapshots.get_version(room_id, version) if db.get_room(room_id) else None
+    if not result:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Snapshot not found"
+        )
+
+    entry, code = result
+    return {**entry.to_info().model_dump(), "code": code}
+
+
+# ==================== CODE EXECUTION ENDPOINTS ====================
+
+@app.post("/rooms/{room_id}/run")
+async def run_code(
+    room_id: str,
+    run_request: RunCodeRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Run code in a sandbox and stream the output back as NDJSON frames:
+    `stdout`/`stderr` chunks while it runs, then one `done` frame.
+    """
+    room = db.get_room(room_id)
+    if not room:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Room not found"
+        )
+
+    # Check if user is kicked
+    if moderation.is_user_kicked(room_id, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are banned from this room"
+        )
+
+    language = run_request.language.value if run_request.language else room.language
+
+    try:
+        executor.ensure_capacity(language)
+    except LanguageUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Running {language} code is not supported on this server"
+        )
+    except ExecutorBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many runs in progress, try again shortly",
+            headers={"Retry-After": "1"}
+        )
+
+    submitted_at = datetime.utcnow()
+
+    async def stream_output():
+        output = []
+        result = {"type": "done", "status": "internal_error", "exit_code": -1,
+                  "execution_time_ms": 0}
+        try:
+            async for frame in executor.execute(language, run_request.code, run_request.stdin):
+                if frame["type"] == "done":
+                    result = frame
+                else:
+                    output.append(frame["data"])
+                    yield json.dumps(frame) + "\n"
+        except ExecutorBusy:
+            result["status"] = "rejected"
+        except Exception as e:
+            logger.error("code_execution_failed", room_id=room_id, error=str(e))
+        yield json.dumps(result) + "\n"
+
+        bq_logger.log_submission(
+            submission_id=str(uuid.uuid4()),
+            user_id=current_user.id,
+            room_id=room_id,
+            language=language,
+            code=run_request.code,
+            output="".join(output)[:settings.EXECUTOR_MAX_OUTPUT_BYTES],
+            status=result["status"],
+            submitted_at=submitted_at,
+            execution_time_ms=result["execution_time_ms"]
+        )
+
+    return StreamingResponse(stream_output(), media_type="application/x-ndjson")
+
+
 # ==================== LIVEBLOCKS ENDPOINTS ====================
 
+def upstream_http_exception(error: UpstreamError) -> HTTPException:
+    """503 with Retry-After while a circuit is open, 500 otherwise"""
+    if error.retry_after is not None:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(error),
+            headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+        )
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail=str(error)
+    )
+
+
 @app.post("/liveblocks/auth")
 async def liveblocks_auth(
     auth_request: LiveblocksAuthRequest,
@@ -283,36 +734,9 @@ async def liveblocks_auth(
 
     # Create Liveblocks token
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.liveblocks.io/v2/rooms/{}/authorize".format(room_id),
-                headers={
-                    "Authorization": f"Bearer {settings.LIVEBLOCKS_SECRET_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "userId": current_user.id,
-                    "userInfo": {
-                        "name": current_user.display_name,
-                        "email": current_user.email
-                    }
-                },
-                timeout=10.0
-            )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to generate Liveblocks token"
-                )
-
-            return response.json()
-
-    except httpx.RequestError as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Liveblocks API error: {str(e)}"
-        )
+        return await upstream.mint_liveblocks_token(room_id, current_user)
+    except UpstreamError as e:
+        raise upstream_http_exception(e)
 
 
 # ==================== DAILY.CO ENDPOINTS ====================
@@ -343,78 +767,19 @@ async def get_daily_token(
             detail="You are banned from this room"
         )
 
-    daily_room_name = f"binarysearch-{room_id}"
-
     try:
-        async with httpx.AsyncClient() as client:
-            # Create or get Daily room
-            room_response = await client.post(
-                "https://api.daily.co/v1/rooms",
-                headers={
-                    "Authorization": f"Bearer {settings.DAILY_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "name": daily_room_name,
-                    "properties": {
-                        "max_participants": room.max_users,
-                        "enable_chat": False,
-                        "enable_screenshare": True,
-                        "start_video_off": True,
-                        "start_audio_off": False
-                    }
-                },
-                timeout=10.0
-            )
-
-            # Room might already exist (409), which is fine
-            if room_response.status_code not in [200, 409]:
-                print(f"Daily room creation failed: {room_response.text}")
-
-            # Create meeting token
-            token_response = await client.post(
-                "https://api.daily.co/v1/meeting-tokens",
-                headers={
-                    "Authorization": f"Bearer {settings.DAILY_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "properties": {
-                        "room_name": daily_room_name,
-                        "user_name": current_user.display_name,
-                        "enable_screenshare": True,
-                        "start_video_off": True,
-                        "start_audio_off": False
-                    }
-                },
-                timeout=10.0
-            )
-
-            if token_response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to generate Daily token"
-                )
+        voice = await upstream.mint_daily_token(room, current_user)
+    except UpstreamError as e:
+        raise upstream_http_exception(e)
 
-            token_data = token_response.json()
-
-            # Log voice join
-            bq_logger.log_event(
-                event_type="voice_join",
-                user_id=current_user.id,
-                room_id=room_id
-            )
-
-            return {
-                "token": token_data["token"],
-                "room_url": f"https://{settings.DAILY_DOMAIN}/{daily_room_name}"
-            }
+    # Log voice join
+    bq_logger.log_event(
+        event_type="voice_join",
+        user_id=current_user.id,
+        room_id=room_id
+    )
 
-    except httpx.RequestError as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Daily API error: {str(e)}"
-        )
+    return voice
 
 
 # ==================== MODERATION ENDPOINTS ====================
@@ -459,7 +824,11 @@ async def report_user(
     request: ReportUserRequest,
     current_user: User = Depends(get_current_user)
 ):
-    """Report a user for inappropriate behavior"""
+    """
+    Report a user for inappropriate behavior. Reports go through triage:
+    repeats are ignored, and enough distinct reporters in a short window
+    kick the user from the room automatically.
+    """
     room = db.get_room(request.room_id)
     if not room:
         raise HTTPException(
@@ -467,23 +836,36 @@ async def report_user(
             detail="Room not found"
         )
 
-    # Log report
-    bq_logger.log_report(
+    if request.reported_user_id == current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You cannot report yourself"
+        )
+
+    # Only people in the room can report, so outsiders cannot trigger kicks
+    if current_user.id not in db.get_room_participants(request.room_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only room participants can report users"
+        )
+
+    case, _ = report_triage.report(
         reporter_id=current_user.id,
         reported_user_id=request.reported_user_id,
         room_id=request.room_id,
-        reason=request.reason
+        reason=request.reason,
+        can_kick=request.reported_user_id != room.created_by
     )
 
-    bq_logger.log_event(
-        event_type="user_reported",
-        user_id=request.reported_user_id,
-        room_id=request.room_id,
-        metadata={
-            "reporter_id": current_user.id,
-            "reason": request.reason
-        }
-    )
+    if case.status == "auto_kicked":
+        db.remove_participant(request.room_id, request.reported_user_id)
+        bq_logger.log_event(
+            event_type="user_kicked",
+            user_id=request.reported_user_id,
+            room_id=request.room_id,
+            metadata={"auto": True, "reports": len(case.reporters)}
+        )
+        bq_logger.log_report(case)
 
     return {"success": True, "message": "Report submitted"}
 
@@ -513,6 +895,119 @@ async def log_event(
     return {"success": True}
 
 
+# ==================== ADMIN ENDPOINTS ====================
+
+@app.post("/admin/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10, gt=0, le=settings.PROFILER_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    all_threads: bool = False,
+    admin: User = Depends(get_admin_user)
+):
+    """
+    Sample stacks for `seconds` and return them as collapsed stacks, ready
+    for flamegraph.pl or speedscope. Samples the event loop thread unless
+    `all_threads` is set.
+    """
+    thread_id = None if all_threads else threading.get_ident()
+    try:
+        stacks = await profiler.profile(seconds, interval_ms / 1000, thread_id)
+    except ProfilerBusy:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A profile is already running"
+        )
+    logger.info("profile_taken", admin_id=admin.id, seconds=seconds, all_threads=all_threads)
+    return stacks
+
+
+@app.get("/admin/slow-requests")
+async def get_slow_requests(
+    limit: int = Query(50, ge=1, le=settings.SLOW_REQUEST_LOG_SIZE),
+    admin: User = Depends(get_admin_user)
+):
+    """Most recent requests above SLOW_REQUEST_THRESHOLD_MS with their span breakdown, newest first"""
+    return {
+        "threshold_ms": slow_requests.threshold_ms,
+        "total_slow": slow_requests.total_slow,
+        "requests": slow_requests.recent(limit),
+    }
+
+
+# ==================== CLUSTER ENDPOINTS ====================
+
+@app.get("/cluster")
+async def get_cluster(admin: User = Depends(get_admin_user)):
+    """This node's view of the cluster"""
+    return {
+        "enabled": cluster.enabled,
+        "self": cluster.self_url,
+        "nodes": cluster.ring.nodes,
+        "rooms": len(db.rooms),
+        "users": len(db.users),
+    }
+
+
+@app.put("/cluster/nodes")
+async def update_cluster_nodes(
+    update: ClusterNodesUpdate,
+    admin: User = Depends(get_admin_user)
+):
+    """
+    Change cluster membership, e.g. after starting a new node. Every old and
+    new node switches to the new list and moves the rooms it no longer owns.
+    Update CLUSTER_NODES on every node too, so restarts keep the new list.
+    """
+    if not cluster.enabled:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Clustering is not enabled on this node"
+        )
+    disallowed = cluster.disallowed_nodes(update.nodes)
+    if disallowed:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Not in CLUSTER_NODES or CLUSTER_ALLOWED_NODES: {', '.join(disallowed)}"
+        )
+    results = await cluster.broadcast_nodes(update.nodes)
+    logger.info("cluster_nodes_updated", admin_id=admin.id, nodes=update.nodes)
+    return {"nodes": cluster.ring.nodes, "notified": results}
+
+
+@app.post("/cluster/membership", dependencies=[Depends(verify_cluster_peer)])
+async def cluster_membership(membership: ClusterMembership):
+    """Internal: a peer announces a new node list"""
+    disallowed = cluster.disallowed_nodes(membership.nodes)
+    if disallowed:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Not in CLUSTER_NODES or CLUSTER_ALLOWED_NODES: {', '.join(disallowed)}"
+        )
+    cluster.apply_nodes(membership.nodes)
+    return {"success": True}
+
+
+@app.post("/cluster/import", dependencies=[Depends(verify_cluster_peer)])
+async def cluster_import(bundle: dict):
+    """Internal: a peer hands over rooms this node now owns"""
+    return cluster.import_bundle(bundle)
+
+
+@app.post("/cluster/users/lookup", response_model=User, dependencies=[Depends(verify_cluster_peer)])
+async def cluster_user_lookup(lookup: ClusterUserLookup):
+    """Internal: the profile of a user whose home is this node, by id or email"""
+    if lookup.user_id:
+        user = db.get_user_by_id(lookup.user_id)
+    else:
+        user = db.get_user_by_email(lookup.email or "")
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    return user
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
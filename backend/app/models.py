@@ -60,12 +60,69 @@ class Room(BaseModel):
     created_at: datetime
     active_count: int = 0
     invite_code: Optional[str] = None
+    invite_expires_at: Optional[datetime] = None
 
 
 class RoomJoin(BaseModel):
     invite_code: Optional[str] = None
 
 
+class RoomJoinByCode(BaseModel):
+    invite_code: str = Field(..., min_length=1, max_length=32)
+
+
+class VoiceToken(BaseModel):
+    token: str
+    room_url: str
+
+
+class RoomEnterResponse(BaseModel):
+    room: Room
+    liveblocks: dict  # Liveblocks authorize response, passed to the client SDK
+    voice: Optional[VoiceToken] = None  # None when Daily.co is unavailable
+
+
+class RunCodeRequest(BaseModel):
+    code: str = Field(..., max_length=100_000)
+    stdin: str = Field(default="", max_length=100_000)
+    language: Optional[ProgrammingLanguage] = None  # defaults to the room's language
+
+
+# Chat Models
+class ChatMessageCreate(BaseModel):
+    text: str = Field(..., min_length=1, max_length=2000)
+
+
+class ChatMessage(BaseModel):
+    id: int
+    room_id: str
+    user_id: str
+    user_name: str
+    text: str
+    timestamp: datetime
+
+
+class ChatHistoryPage(BaseModel):
+    messages: List[ChatMessage]
+    next_before: Optional[int] = None  # pass as `before` to fetch older messages
+
+
+# Code Snapshot Models
+class CodeSnapshotCreate(BaseModel):
+    code: str = Field(..., max_length=500_000)
+
+
+class CodeSnapshotInfo(BaseModel):
+    version: int
+    created_at: datetime
+    size: int
+    is_keyframe: bool
+
+
+class CodeSnapshot(CodeSnapshotInfo):
+    code: str
+
+
 # Liveblocks Models
 class LiveblocksAuthRequest(BaseModel):
     room: str
@@ -104,3 +161,17 @@ class AnalyticsEvent(BaseModel):
     user_id: str
     room_id: str
     metadata: Optional[dict] = None
+
+
+# Cluster Models
+class ClusterNodesUpdate(BaseModel):
+    nodes: List[str] = Field(..., min_length=1)  # base URLs of every node
+
+
+class ClusterMembership(BaseModel):
+    nodes: List[str]
+
+
+class ClusterUserLookup(BaseModel):
+    user_id: Optional[str] = None
+    email: Optional[str] = None
@@ -1,5 +1,9 @@
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from typing import Dict, Set
+from typing import Dict, List, Tuple
+import time
+
+from app.config import settings
 
 
 class ModerationManager:
@@ -10,14 +14,18 @@ class ModerationManager:
     def __init__(self):
         # room_id -> set of kicked user_ids with expiry
         self.kicked_users: Dict[str, Dict[str, datetime]] = {}
+        # Set by the state store (app.persistence) to journal changes
+        self.change_log = None
 
     def kick_user(self, room_id: str, user_id: str, duration_minutes: int = 10):
         """Kick a user from a room for a specified duration"""
-        if room_id not in self.kicked_users:
-            self.kicked_users[room_id] = {}
+        self.add_kick(room_id, user_id, datetime.utcnow() + timedelta(minutes=duration_minutes))
 
-        expiry = datetime.utcnow() + timedelta(minutes=duration_minutes)
-        self.kicked_users[room_id][user_id] = expiry
+    def add_kick(self, room_id: str, user_id: str, expiry: datetime):
+        """Ban a user from a room until `expiry`"""
+        self.kicked_users.setdefault(room_id, {})[user_id] = expiry
+        if self.change_log is not None:
+            self.change_log.append("kick", room_id, user_id, expiry)
 
     def is_user_kicked(self, room_id: str, user_id: str) -> bool:
         """Check if a user is currently kicked from a room"""
@@ -35,6 +43,10 @@ class ModerationManager:
 
         return True
 
+    def remove_room(self, room_id: str):
+        """Forget a room's kicks (the room moved to another node)"""
+        self.kicked_users.pop(room_id, None)
+
     def cleanup_expired_kicks(self):
         """Remove expired kicks (call periodically)"""
         current_time = datetime.utcnow()
@@ -48,5 +60,100 @@ class ModerationManager:
                 del self.kicked_users[room_id]
 
 
+class ReportCase:
+    """Reports about one user in one room, open until it escalates or goes quiet"""
+    __slots__ = ("reported_user_id", "room_id", "reporters", "recent", "duplicates",
+                 "reasons", "first_reported_at", "last_reported_at", "last_counted", "status")
+
+    def __init__(self, reported_user_id: str, room_id: str):
+        self.reported_user_id = reported_user_id
+        self.room_id = room_id
+        self.reporters: List[str] = []
+        self.recent: deque = deque()  # monotonic times of counted reports in the window
+        self.duplicates = 0
+        self.reasons: List[str] = []
+        self.first_reported_at = self.last_reported_at = datetime.utcnow()
+        self.last_counted = time.monotonic()
+        self.status = "pending"
+
+
+class ReportTriage:
+    """
+    In-memory triage of user reports. Reports are grouped into one case per
+    (reported user, room), and a reporter counts once per case. When
+    `threshold` distinct reporters land within `window_seconds`, the user is
+    kicked from the room. A case closes when it escalates or after a quiet
+    window; closed cases are what gets logged, one row each.
+    """
+    MAX_REASONS = 5
+
+    def __init__(self, moderation: ModerationManager, window_seconds: float,
+                 threshold: int, kick_minutes: int, max_open_cases: int = 100_000):
+        self.moderation = moderation
+        self.window_seconds = window_seconds
+        self.threshold = threshold
+        self.kick_minutes = kick_minutes
+        self.max_open_cases = max_open_cases
+        # (reported_user_id, room_id) -> case, least recently counted first
+        self.cases: "OrderedDict[Tuple[str, str], ReportCase]" = OrderedDict()
+
+    def report(self, reporter_id: str, reported_user_id: str, room_id: str,
+               reason: str, can_kick: bool = True) -> Tuple[ReportCase, bool]:
+        """
+        Record a report. Returns the case and whether the report counted
+        (False for a repeat by the same reporter). A case whose status is
+        "auto_kicked" has just escalated and is closed.
+        """
+        key = (reported_user_id, room_id)
+        case = self.cases.get(key)
+        if case is None:
+            case = self.cases[key] = ReportCase(reported_user_id, room_id)
+        elif reporter_id in case.reporters:
+            case.duplicates += 1
+            return case, False
+
+        now = time.monotonic()
+        case.reporters.append(reporter_id)
+        case.recent.append(now)
+        while case.recent[0] <= now - self.window_seconds:
+            case.recent.popleft()
+        if reason not in case.reasons and len(case.reasons) < self.MAX_REASONS:
+            case.reasons.append(reason)
+        case.last_reported_at = datetime.utcnow()
+        case.last_counted = now
+        self.cases.move_to_end(key)
+
+        if can_kick and self.threshold and len(case.recent) >= self.threshold:
+            self.moderation.kick_user(room_id, reported_user_id, self.kick_minutes)
+            case.status = "auto_kicked"
+            del self.cases[key]
+        return case, True
+
+    def close_quiet_cases(self) -> List[ReportCase]:
+        """Close cases with no counted report for a whole window (call periodically)"""
+        cutoff = time.monotonic() - self.window_seconds
+        closed = []
+        while self.cases:
+            case = next(iter(self.cases.values()))
+            if case.last_counted > cutoff and len(self.cases) <= self.max_open_cases:
+                break
+            closed.append(self.cases.popitem(last=False)[1])
+        return closed
+
+    def close_all(self) -> List[ReportCase]:
+        """Close every open case, e.g. on shutdown"""
+        closed = list(self.cases.values())
+        self.cases.clear()
+        return closed
+
+
 # Global moderation manager
 moderation = ModerationManager()
+
+# Global report triage
+report_triage = ReportTriage(
+    moderation,
+    window_seconds=settings.REPORT_WINDOW_MINUTES * 60,
+    threshold=settings.REPORT_AUTO_KICK_THRESHOLD,
+    kick_minutes=settings.REPORT_AUTO_KICK_MINUTES,
+)
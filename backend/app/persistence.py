@@ -0,0 +1,429 @@
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate, chain, repeat
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import gc
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+from pydantic import BaseModel
+
+from app.config import settings
+from app.database import Database, db
+from app.logger import BackgroundQueue, logger
+from app.models import Room, UserInDB
+from app.moderation import ModerationManager, moderation
+
+
+# Snapshot file layout: a header, then columns in a fixed order. Each column
+# is a (count, byte length) pair followed by the data, padded to 8 bytes so
+# numeric columns can be cast in place. String columns are two columns: the
+# character length of every value, then all values as one UTF-8 blob.
+MAGIC = b"BSSTATE2"
+READABLE_MAGIC = {b"BSSTATE1": 1, MAGIC: 2}  # version 2 added invite code expiry
+_HEADER = struct.Struct("<8sc7xQ")  # magic, byte order, first generation not included
+_COLUMN = struct.Struct("<QQ")
+_BYTE_ORDER = b"l" if sys.byteorder == "little" else b"b"
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_micros(value: datetime) -> int:
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+def _from_micros(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+class _ColumnWriter:
+    def __init__(self, f):
+        self.f = f
+
+    def _blob(self, count: int, data: bytes):
+        self.f.write(_COLUMN.pack(count, len(data)))
+        self.f.write(data)
+        self.f.write(b"\0" * (-len(data) % 8))
+
+    def strings(self, values: List[str]):
+        # Lengths in characters, so the decoded text can be sliced directly
+        self._blob(len(values), array("I", map(len, values)).tobytes())
+        self._blob(len(values), "".join(values).encode("utf-8", "surrogatepass"))
+
+    def numbers(self, typecode: str, values):
+        data = array(typecode, values).tobytes()
+        self._blob(len(data) // array(typecode).itemsize, data)
+
+
+class _ColumnReader:
+    """Reads columns straight out of the mapped file, without copying it first."""
+    def __init__(self, view: memoryview, offset: int):
+        self.view = view
+        self.offset = offset
+
+    def _blob(self) -> memoryview:
+        _, length = _COLUMN.unpack_from(self.view, self.offset)
+        start = self.offset + _COLUMN.size
+        self.offset = start + length + (-length % 8)
+        return self.view[start:start + length]
+
+    def strings(self) -> List[str]:
+        lengths = self._blob().cast("I")
+        text = str(self._blob(), "utf-8", "surrogatepass")
+        ends = list(accumulate(lengths))
+        lengths.release()
+        return [text[start:end] for start, end in zip(chain((0,), ends), ends)]
+
+    def numbers(self, typecode: str) -> list:
+        view = self._blob().cast(typecode)
+        values = view.tolist()
+        view.release()
+        return values
+
+
+def _construct(model, fields_set: set, values: dict):
+    """
+    What `model.model_construct(**values)` does for a complete set of
+    fields, minus its per-call field introspection (over half of load time).
+    """
+    instance = model.__new__(model)
+    object.__setattr__(instance, "__dict__", values)
+    object.__setattr__(instance, "__pydantic_fields_set__", fields_set.copy())
+    object.__setattr__(instance, "__pydantic_extra__", None)
+    object.__setattr__(instance, "__pydantic_private__", None)
+    return instance
+
+
+_USER_FIELDS = set(UserInDB.model_fields)
+_ROOM_FIELDS = set(Room.model_fields)
+
+
+def _json_default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot journal {type(value).__name__}")
+
+
+class ChangeLog:
+    """
+    Append-only journal of state changes, one JSON array per line. A new
+    generation (file) starts whenever a snapshot is taken, so each snapshot
+    only needs the generations from its own onwards.
+
+    `append` only serializes the change and queues it; a writer thread
+    appends queued lines to their generation's file and flushes them to the
+    OS every `flush_interval` seconds. A process crash loses at most that
+    much, a host crash more. If the disk stalls until the queue is full,
+    changes are dropped and logged; the next snapshot covers them.
+    """
+    def __init__(self, directory: Optional[str], max_queued: int = 100_000,
+                 flush_interval: float = 0.05):
+        self.directory = directory
+        self.generation = 0
+        # Generations below this are covered by a snapshot and deleted
+        self.compacted = 0
+        self.queue = BackgroundQueue("change-log-writer", self._write_batch,
+                                     max_items=max_queued, flush_interval=flush_interval)
+        self._reported_dropped = 0
+        # Used by the writer thread only
+        self._file = None
+        self._file_generation = None
+
+    def path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"changes.{generation:08d}.log")
+
+    def generations(self) -> List[int]:
+        found = []
+        for name in os.listdir(self.directory):
+            prefix, _, rest = name.partition(".")
+            number, _, suffix = rest.partition(".")
+            if prefix == "changes" and suffix == "log" and number.isdigit():
+                found.append(int(number))
+        return sorted(found)
+
+    def open(self, generation: int):
+        """Send later changes to `generation`; queued ones keep their own"""
+        self.generation = generation
+
+    def append(self, op: str, *args):
+        # Serialized now: records may be changed in place after the call
+        line = json.dumps([op, *args], default=_json_default) + "\n"
+        if not self.queue.put((self.generation, line)) and \
+                self.queue.dropped > self._reported_dropped:
+            self._reported_dropped = self.queue.dropped
+            logger.error("change_log_dropped", dropped=self.queue.dropped)
+
+    def close(self):
+        """Write out what is queued and close the file"""
+        self.queue.close()
+        self._close_file()
+
+    def _write_batch(self, batch: List[Tuple[int, str]]):
+        for generation, line in batch:
+            if generation < self.compacted:
+                continue
+            if generation != self._file_generation:
+                self._close_file()
+                self._file = open(self.path(generation), "a", encoding="utf-8")
+                self._file_generation = generation
+            self._file.write(line)
+        if self._file is not None:
+            self._file.flush()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_generation = None
+
+
+class StateStore:
+    """
+    Persists users, rooms, participants and kicks across restarts.
+
+    A snapshot is a compact columnar binary file, written in a worker thread
+    to a temp file, fsynced and renamed over the previous one. Changes made
+    after it are journaled in the change log and replayed on startup.
+    """
+    def __init__(self, directory: Optional[str], database: Database,
+                 moderation_manager: ModerationManager):
+        self.directory = directory
+        self.database = database
+        self.moderation = moderation_manager
+        self.change_log = ChangeLog(directory, settings.CHANGE_LOG_MAX_QUEUED,
+                                    settings.CHANGE_LOG_FLUSH_INTERVAL_SECONDS)
+        self._save_lock = asyncio.Lock()
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, "state.snapshot")
+
+    def restore(self) -> Dict[str, float]:
+        """Load the snapshot and replay the journal, then start journaling"""
+        started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Millions of new container objects would otherwise trigger repeated
+        # full collections that find nothing to free
+        gc.disable()
+        try:
+            generation = 0
+            if os.path.exists(self.snapshot_path):
+                generation = self._load_snapshot()
+            replayed = 0
+            generations = self.change_log.generations()
+            for number in generations:
+                if number >= generation:
+                    replayed += self._replay(self.change_log.path(number))
+        finally:
+            gc.enable()
+        # Restored records live for the whole process: keep them out of
+        # future collections
+        gc.freeze()
+
+        # Never append after a possibly torn last line
+        self.change_log.open(max([generation] + [n + 1 for n in generations]))
+        self.database.change_log = self.change_log
+        self.moderation.change_log = self.change_log
+        return {
+            "users": len(self.database.users),
+            "rooms": len(self.database.rooms),
+            "replayed_changes": replayed,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    async def save(self):
+        """Take a snapshot; serialization and I/O run off the event loop"""
+        async with self._save_lock:
+            generation, state = self._capture()
+            await asyncio.to_thread(self._write_snapshot, generation, state)
+
+    def close(self):
+        self.database.change_log = None
+        self.moderation.change_log = None
+        self.change_log.close()
+
+    # Snapshot writing
+
+    def _capture(self) -> Tuple[int, tuple]:
+        """
+        Copy the containers (not the records) and switch to a new journal
+        generation in one step, so every change lands either in the snapshot
+        or in a journal replayed after it. Rooms are kept in creation order.
+        """
+        state = (
+            list(self.database.users.values()),
+            list(self.database.rooms.values()),
+            [(room_id, list(participants))
+             for room_id, participants in self.database.room_participants.items()
+             if participants],
+            [(room_id, user_id, expiry)
+             for room_id, kicks in self.moderation.kicked_users.items()
+             for user_id, expiry in kicks.items()],
+        )
+        self.change_log.open(self.change_log.generation + 1)
+        return self.change_log.generation, state
+
+    def _write_snapshot(self, generation: int, state: tuple):
+        users, rooms, participants, kicks = state
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "wb", buffering=1 << 20) as f:
+            f.write(_HEADER.pack(MAGIC, _BYTE_ORDER, generation))
+            columns = _ColumnWriter(f)
+
+            columns.strings([u.id for u in users])
+            columns.strings([u.email for u in users])
+            columns.strings([u.display_name for u in users])
+            columns.strings([u.hashed_password for u in users])
+            columns.numbers("q", [_to_micros(u.created_at) for u in users])
+
+            columns.strings([r.room_id for r in rooms])
+            columns.strings([r.title for r in rooms])
+            columns.strings([r.language for r in rooms])
+            columns.strings([r.created_by for r in rooms])
+            columns.strings([r.created_by_name for r in rooms])
+            columns.strings([r.invite_code or "" for r in rooms])
+            columns.numbers("B", [r.is_public for r in rooms])
+            columns.numbers("I", [r.max_users for r in rooms])
+            columns.numbers("q", [_to_micros(r.created_at) for r in rooms])
+            columns.numbers("q", [_to_micros(r.invite_expires_at) if r.invite_expires_at else 0
+                                  for r in rooms])
+
+            pairs = [(room_id, user_id) for room_id, user_ids in participants
+                     for user_id in user_ids]
+            columns.strings([room_id for room_id, _ in pairs])
+            columns.strings([user_id for _, user_id in pairs])
+
+            columns.strings([room_id for room_id, _, _ in kicks])
+            columns.strings([user_id for _, user_id, _ in kicks])
+            columns.numbers("q", [_to_micros(expiry) for _, _, expiry in kicks])
+
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        # Make the rename itself durable before dropping the old journals
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+        self.change_log.compacted = generation
+        for number in self.change_log.generations():
+            if number < generation:
+                os.remove(self.change_log.path(number))
+
+    # Snapshot loading
+
+    def _load_snapshot(self) -> int:
+        with open(self.snapshot_path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return self._read_snapshot(mapped)
+        finally:
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # a view is still referenced; the mapping goes when it does
+
+    def _read_snapshot(self, mapped: mmap.mmap) -> int:
+        magic, byte_order, generation = _HEADER.unpack_from(mapped, 0)
+        version = READABLE_MAGIC.get(magic)
+        if version is None or byte_order != _BYTE_ORDER:
+            raise ValueError(f"{self.snapshot_path} is not a state snapshot for this platform")
+
+        with memoryview(mapped) as view:
+            columns = _ColumnReader(view, _HEADER.size)
+
+            user_ids, emails, display_names, hashed_passwords = (
+                columns.strings() for _ in range(4))
+            self.database.insert_users([
+                _construct(UserInDB, _USER_FIELDS, {
+                    "id": user_id,
+                    "email": email,
+                    "display_name": display_name,
+                    "created_at": _from_micros(created),
+                    "hashed_password": hashed_password,
+                })
+                for user_id, email, display_name, hashed_password, created in zip(
+                    user_ids, emails, display_names, hashed_passwords, columns.numbers("q"))
+            ])
+
+            room_columns = [columns.strings() for _ in range(6)]
+            is_public = columns.numbers("B")
+            max_users = columns.numbers("I")
+            room_created = columns.numbers("q")
+            invite_expiry = columns.numbers("q") if version >= 2 else repeat(0)
+            participant_rooms = columns.strings()
+            participant_users = columns.strings()
+            participants: Dict[str, set] = {}
+            for room_id, user_id in zip(participant_rooms, participant_users):
+                participants.setdefault(room_id, set()).add(user_id)
+
+            for (room_id, title, language, created_by, created_by_name, invite_code,
+                 public, capacity, created, invite_expires) in zip(
+                    *room_columns, is_public, max_users, room_created, invite_expiry):
+                room = _construct(Room, _ROOM_FIELDS, {
+                    "room_id": room_id,
+                    "title": title,
+                    "language": language,
+                    "is_public": bool(public),
+                    "max_users": capacity,
+                    "created_by": created_by,
+                    "created_by_name": created_by_name,
+                    "created_at": _from_micros(created),
+                    "active_count": 0,
+                    "invite_code": invite_code or None,
+                    "invite_expires_at": _from_micros(invite_expires) if invite_expires else None,
+                })
+                self.database.insert_room(room, participants.get(room_id))
+
+            kick_rooms = columns.strings()
+            kick_users = columns.strings()
+            kick_expiry = columns.numbers("q")
+            for room_id, user_id, expiry in zip(kick_rooms, kick_users, kick_expiry):
+                self.moderation.kicked_users.setdefault(room_id, {})[user_id] = \
+                    _from_micros(expiry)
+        return generation
+
+    # Journal replay
+
+    def _replay(self, path: str) -> int:
+        applied = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op, *args = json.loads(line)
+                except ValueError:
+                    break  # torn write at the end of a crashed process's journal
+                self._apply(op, args)
+                applied += 1
+        return applied
+
+    def _apply(self, op: str, args: list):
+        if op == "user":
+            self.database.insert_user(UserInDB.model_validate(args[0]))
+        elif op == "room":
+            self.database.insert_room(Room.model_validate(args[0]))
+        elif op == "join":
+            self.database.add_participant(*args)
+        elif op == "leave":
+            self.database.remove_participant(*args)
+        elif op == "evict":
+            self.database.evict_room(*args)
+        elif op == "kick":
+            room_id, user_id, expiry = args
+            self.moderation.kicked_users.setdefault(room_id, {})[user_id] = \
+                datetime.fromisoformat(expiry)
+
+
+# Global state store; only used when STATE_DIR is set
+state_store = StateStore(settings.STATE_DIR, db, moderation)
@@ -0,0 +1,82 @@
+from collections import Counter
+from typing import Dict, Optional
+import asyncio
+import os
+import sys
+import sysconfig
+import threading
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another is running"""
+
+
+class SamplingProfiler:
+    """
+    Samples Python stacks from a background thread at a fixed interval and
+    aggregates them as collapsed stacks, one `frame;frame;frame count` line
+    per distinct stack (the input format of flamegraph.pl and speedscope).
+    Nothing is hooked into the profiled code, so overhead is one
+    `sys._current_frames()` walk per sample, and zero when not profiling.
+    """
+    def __init__(self):
+        self.running = False
+        self._labels: Dict[object, str] = {}
+        self._base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self._stdlib = sysconfig.get_paths()["stdlib"]
+
+    async def profile(self, seconds: float, interval: float,
+                      thread_id: Optional[int] = None) -> str:
+        """Sample for `seconds`; only `thread_id` if given, else every thread"""
+        if self.running:
+            raise ProfilerBusy()
+        self.running = True
+        counts: Counter = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, name="sampling-profiler",
+                                   args=(counts, stop, interval, thread_id), daemon=True)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self.running = False
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+    def _sample(self, counts: Counter, stop: threading.Event, interval: float,
+                thread_id: Optional[int]):
+        own_id = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while not stop.wait(interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_id or (thread_id is not None and ident != thread_id):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                if thread_id is None:
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack.append(f"thread {names.get(ident, ident)}")
+                stack.reverse()
+                counts[";".join(stack)] += 1
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            path = code.co_filename
+            if path.startswith(self._base):
+                path = os.path.relpath(path, self._base)
+            elif "site-packages" in path:
+                path = path.split("site-packages" + os.sep, 1)[1]
+            elif path.startswith(self._stdlib):
+                path = os.path.relpath(path, self._stdlib)
+            label = f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+
+# Global profiler
+profiler = SamplingProfiler()
@@ -0,0 +1,195 @@
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+import asyncio
+import math
+import re
+import time
+
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+
+from app.auth import user_id_from_token
+from app.cluster import is_peer_request
+from app.config import settings
+
+
+class BucketRule:
+    """Refill `rate` tokens per second up to `burst`; one request costs one token."""
+    __slots__ = ("name", "rate", "burst")
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+
+
+# (method, path pattern, rule). First match wins; everything else uses DEFAULT_RULE.
+ROUTE_RULES: List[Tuple[str, "re.Pattern", BucketRule]] = [
+    ("POST", re.compile(r"^/auth/login$"),
+     BucketRule("login", rate=settings.LOGIN_RATE_PER_IP, burst=settings.LOGIN_BURST_PER_IP)),
+    ("POST", re.compile(r"^/auth/signup$"),
+     BucketRule("signup", rate=settings.SIGNUP_RATE_PER_IP, burst=settings.SIGNUP_BURST_PER_IP)),
+    ("POST", re.compile(r"^/liveblocks/auth$"), BucketRule("liveblocks", rate=0.5, burst=10)),
+    ("POST", re.compile(r"^/daily/token$"), BucketRule("daily", rate=0.2, burst=5)),
+    # Mints both a Liveblocks and a Daily token, so no looser than either
+    ("POST", re.compile(r"^/rooms/[^/]+/enter$"), BucketRule("enter", rate=0.2, burst=5)),
+    ("POST", re.compile(r"^/events/log$"), BucketRule("events", rate=5, burst=20)),
+    ("POST", re.compile(r"^/rooms/join-by-code$"), BucketRule("invite", rate=0.2, burst=10)),
+    ("POST", re.compile(r"^/rooms/[^/]+/run$"), BucketRule("run", rate=0.5, burst=5)),
+    ("POST", re.compile(r"^/rooms/[^/]+/messages$"), BucketRule("chat", rate=2, burst=10)),
+]
+DEFAULT_RULE = BucketRule("default", rate=20, burst=60)
+
+# Checked by the endpoints themselves, keyed by the email in the request body
+ACCOUNT_RULES: Dict[str, BucketRule] = {
+    "login": BucketRule("login-account", rate=settings.LOGIN_RATE_PER_ACCOUNT,
+                        burst=settings.LOGIN_BURST_PER_ACCOUNT),
+    "signup": BucketRule("signup-account", rate=settings.SIGNUP_RATE_PER_ACCOUNT,
+                         burst=settings.SIGNUP_BURST_PER_ACCOUNT),
+}
+
+# Never limited or shed
+EXEMPT_PATHS = {"/health"}
+# Limited but never shed, so operators can still act while the loop lags
+UNSHED_PREFIXES = ("/admin/",)
+
+
+class TokenBuckets:
+    """
+    Token buckets keyed by (rule, client). Each bucket is a two-item list
+    [tokens, last_update]. Keys are kept in LRU order and the least recently
+    used are dropped beyond `max_keys`; a bucket idle long enough to have
+    refilled is indistinguishable from a new one, so eviction is harmless.
+    """
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[Tuple[str, str], list]" = OrderedDict()
+
+    def take(self, rule: BucketRule, client: str, rate_scale: float = 1.0) -> float:
+        """Take one token. Returns 0 if allowed, else seconds until a token is available."""
+        key = (rule.name, client)
+        now = time.monotonic()
+        rate = rule.rate * rate_scale
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = [float(rule.burst), now]
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(rule.burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+
+class EventLoopLagMonitor:
+    """Measures how late the event loop wakes a periodic timer."""
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lag_ms = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, (loop.time() - expected) * 1000)
+            # Rise immediately, decay smoothly
+            self.lag_ms = lag if lag > self.lag_ms else 0.8 * self.lag_ms + 0.2 * lag
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying per-route token buckets keyed by user id (from a
+    valid bearer token) or client IP.
+
+    Load shedding when the event loop lags:
+    - above LOAD_SHED_LAG_MS, refill rates are halved, so heavy clients hit
+      429 first while light clients keep getting through;
+    - above LOAD_SHED_CRITICAL_LAG_MS, every non-exempt request gets 503.
+    Admin routes keep their normal buckets and are never shed.
+    Rejections carry a Retry-After header.
+    """
+    def __init__(self, app, buckets: TokenBuckets, lag_monitor: EventLoopLagMonitor):
+        self.app = app
+        self.buckets = buckets
+        self.lag_monitor = lag_monitor
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not settings.RATE_LIMIT_ENABLED
+                or scope["method"] == "OPTIONS" or scope["path"] in EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+        # Requests from another node were limited where they entered the cluster
+        if is_peer_request(scope):
+            await self.app(scope, receive, send)
+            return
+
+        lag_ms = 0.0 if scope["path"].startswith(UNSHED_PREFIXES) else self.lag_monitor.lag_ms
+        if lag_ms > settings.LOAD_SHED_CRITICAL_LAG_MS:
+            response = JSONResponse(
+                {"detail": "Server is overloaded, try again shortly"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        rule = self._match_rule(scope["method"], scope["path"])
+        rate_scale = 0.5 if lag_ms > settings.LOAD_SHED_LAG_MS else 1.0
+        retry_after = self.buckets.take(rule, self._client_key(scope), rate_scale)
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Too many requests"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _match_rule(method: str, path: str) -> BucketRule:
+        for rule_method, pattern, rule in ROUTE_RULES:
+            if method == rule_method and pattern.match(path):
+                return rule
+        return DEFAULT_RULE
+
+    @staticmethod
+    def _client_key(scope) -> str:
+        headers: Dict[bytes, bytes] = dict(scope["headers"])
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        if authorization.startswith("Bearer "):
+            # Verified, so forged tokens cannot mint fresh buckets
+            user_id = user_id_from_token(authorization[7:])
+            if user_id:
+                return "user:" + user_id
+
+        if settings.TRUST_FORWARDED_FOR and b"x-forwarded-for" in headers:
+            return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+
+def check_account_limit(action: str, email: str):
+    """Per-account limit for login and signup, on top of the per-IP route rule"""
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    retry_after = rate_limit_buckets.take(ACCOUNT_RULES[action], "email:" + email.strip().lower())
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts for this account, try again later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+# Global rate limiting state
+rate_limit_buckets = TokenBuckets(max_keys=settings.RATE_LIMIT_MAX_KEYS)
+lag_monitor = EventLoopLagMonitor()
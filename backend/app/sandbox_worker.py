@@ -0,0 +1,446 @@
+"""
+Pre-warmed sandbox worker process.
+
+Started by the executor as `python -m app.sandbox_worker <language>` and kept
+alive between runs. Each job arrives as one JSON line on stdin; the worker
+forks a fresh child with CPU, memory, file-size and wall-clock limits, streams
+the child's output back as JSON lines on stdout and finishes with a `done`
+frame. Python jobs run inside the forked interpreter itself, so a run costs a
+fork() instead of an interpreter start-up.
+
+Isolation: the worker is started with a minimal environment and moves
+itself into a network namespace with no interfaces. When started as root,
+every child drops to SANDBOX_USER (with RLIMIT_NPROC capping that user's
+processes) before running anything, so it cannot read the server's files or
+/proc/<pid>/environ. Each run is the init of its own PID namespace and its
+process group is killed afterwards, so nothing it starts outlives it.
+
+This module must not import the rest of the app (settings, db, ...): it runs
+in a separate, minimal process.
+"""
+import ctypes
+import json
+import mmap
+import os
+import pwd
+import resource
+import selectors
+import shlex
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+# language -> how to build and run a single source file
+LANGUAGES = {
+    "python": {"file": "main.py", "run": None},
+    "javascript": {
+        "file": "main.js",
+        "run": "node --max-old-space-size={memory_mb} main.js",
+        "limit_address_space": False,  # V8 reserves far more address space than it uses
+    },
+    "java": {
+        "file": "Main.java",
+        "compile": "javac Main.java",
+        "run": "java -Xmx{memory_mb}m -Xss64m Main",
+        "limit_address_space": False,
+    },
+    "cpp": {
+        "file": "main.cpp",
+        "compile": "g++ -O2 -std=c++17 -o main main.cpp",
+        "run": "./main",
+    },
+    "go": {
+        "file": "main.go",
+        "compile": "go build -o main main.go",
+        "run": "./main",
+        "limit_address_space": False,
+    },
+    "rust": {
+        "file": "main.rs",
+        "compile": "rustc -O -o main main.rs",
+        "run": "./main",
+    },
+}
+
+COMPILE_TIME_LIMIT_SECONDS = 30
+READ_CHUNK_BYTES = 4096
+EXIT_POLL_SECONDS = 0.05
+
+# The only variables the worker inherits from the server
+WORKER_ENV_KEYS = ("PATH", "LANG", "GOROOT", "JAVA_HOME", "RUSTUP_HOME", "CARGO_HOME",
+                   "SANDBOX_USER", "SANDBOX_MAX_PROCESSES")
+
+# Imported once by the Python worker so runs get them for free, even when
+# the sandbox user cannot read the interpreter's library directory
+PRELOADED_MODULES = ("bisect", "collections", "dataclasses", "decimal", "fractions", "functools",
+                     "heapq", "itertools", "json", "math", "random", "re", "statistics",
+                     "string", "typing")
+
+CLONE_NEWPID = 0x20000000
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+PR_SET_PDEATHSIG = 1
+PR_SET_NO_NEW_PRIVS = 38
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def send(frame: dict):
+    sys.stdout.write(json.dumps(frame) + "\n")
+    sys.stdout.flush()
+
+
+def worker_env(environ) -> dict:
+    """Environment for starting a worker: toolchain paths, never app secrets"""
+    env = {key: environ[key] for key in WORKER_ENV_KEYS if key in environ}
+    env.setdefault("PATH", "/usr/bin:/bin")
+    env.setdefault("LANG", "C.UTF-8")
+    # Resolved here because the worker has no HOME
+    env.setdefault("RUSTUP_HOME", os.path.expanduser("~/.rustup"))
+    return env
+
+
+def isolate_worker() -> bool:
+    """
+    Strip the environment and leave the network, once per worker; forked
+    children inherit both. Returns whether the network namespace was created.
+    """
+    for key in list(os.environ):
+        if key not in WORKER_ENV_KEYS:
+            del os.environ[key]
+
+    if os.geteuid() == 0:
+        return _libc.unshare(CLONE_NEWNET) == 0
+
+    # Unprivileged: a user namespace grants the right to create the network
+    # namespace; map our own ids so files stay creatable
+    uid, gid = os.getuid(), os.getgid()
+    if _libc.unshare(CLONE_NEWUSER | CLONE_NEWNET) != 0:
+        return False
+    for name, content in (("setgroups", "deny"), ("uid_map", f"{uid} {uid} 1"),
+                          ("gid_map", f"{gid} {gid} 1")):
+        with open(f"/proc/self/{name}", "w") as f:
+            f.write(content)
+    return True
+
+
+def sandbox_identity(user: str):
+    """(uid, gid) children switch to, or None when not root or disabled"""
+    if not user or os.geteuid() != 0:
+        return None
+    entry = pwd.getpwnam(user)
+    return entry.pw_uid, entry.pw_gid
+
+
+def enter_pid_namespace():
+    """
+    Continue in a new PID namespace as its init, so everything the run
+    starts, even what escapes the process group, dies with it. The process
+    left behind only waits and passes on the exit status. No-op when
+    namespaces are unavailable.
+    """
+    if _libc.unshare(CLONE_NEWPID) != 0:
+        return
+    pid = os.fork()
+    if pid == 0:
+        return
+    _libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL, 0, 0, 0)
+    _, wait_status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(wait_status):
+        sig = os.WTERMSIG(wait_status)
+        if sig not in (signal.SIGKILL, signal.SIGSTOP):
+            signal.signal(sig, signal.SIG_DFL)
+        os.kill(os.getpid(), sig)
+    os._exit(os.WEXITSTATUS(wait_status))
+
+
+def confine(sandbox, max_processes: int):
+    """Called in the child before running anything: no privilege regain, drop to the sandbox user"""
+    _libc.prctl(PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0)
+    if sandbox is not None:
+        uid, gid = sandbox
+        resource.setrlimit(resource.RLIMIT_NPROC, (max_processes, max_processes))
+        os.setgroups([])
+        os.setgid(gid)
+        os.setuid(uid)
+    # Die with the worker (set last: changing uid clears it). Without a
+    # dedicated uid RLIMIT_NPROC is skipped, as it would count the server's
+    # own processes.
+    _libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL, 0, 0, 0)
+
+
+def apply_limits(time_limit: float, memory_mb: int, limit_address_space: bool):
+    """Resource limits for the forked child (called after fork, before exec)"""
+    cpu = max(1, int(time_limit + 0.999))
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (10 * 1024 * 1024, 10 * 1024 * 1024))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    if limit_address_space:
+        memory = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+
+def spawn(workdir: str, argv, stdin_data: str, sandbox, max_processes: int,
+          limits=None, python_code=None):
+    """
+    Fork a child with stdout/stderr pipes. The child either execs `argv` or,
+    for Python, runs `python_code` in the already-warm interpreter.
+    Returns (pid, stdout fd, stderr fd, out-of-memory flag); the flag is a
+    one-byte shared mapping the Python child sets on MemoryError.
+    """
+    stdin_r, stdin_w = os.pipe()
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    memory_flag = mmap.mmap(-1, 1)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            os.chdir(workdir)
+            os.dup2(stdin_r, 0)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            for fd in (stdin_r, stdin_w, out_r, out_w, err_r, err_w):
+                os.close(fd)
+            if limits:
+                apply_limits(*limits)
+            enter_pid_namespace()
+            confine(sandbox, max_processes)
+
+            if python_code is None:
+                os.execvpe(argv[0], argv, child_env(workdir))
+
+            sys.stdin = open(0, "r", closefd=False)
+            sys.stdout = open(1, "w", buffering=1, closefd=False)
+            sys.stderr = open(2, "w", buffering=1, closefd=False)
+            sys.argv = ["main.py"]
+            namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+            exit_code = 0
+            try:
+                exec(compile(python_code, "main.py", "exec"), namespace)
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except MemoryError:
+                sys.stderr.write("MemoryError\n")
+                memory_flag[0] = 1
+                exit_code = 1
+            except BaseException:
+                # Drop the worker's own frame so the traceback starts in main.py
+                etype, value, tb = sys.exc_info()
+                traceback.print_exception(etype, value, tb.tb_next)
+                exit_code = 1
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+        except BaseException:
+            os._exit(127)
+
+    os.close(stdin_r)
+    os.close(out_w)
+    os.close(err_w)
+    # Never block on a child that does not read its input: whatever does not
+    # fit in the pipe buffer is dropped.
+    os.set_blocking(stdin_w, False)
+    try:
+        if stdin_data:
+            os.write(stdin_w, stdin_data.encode())
+    except OSError:
+        pass
+    os.close(stdin_w)
+    return pid, out_r, err_r, memory_flag
+
+
+def child_env(workdir: str) -> dict:
+    env = {
+        "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+        "HOME": workdir,
+        "TMPDIR": workdir,
+        "LANG": "C.UTF-8",
+    }
+    for key in ("GOROOT", "JAVA_HOME", "RUSTUP_HOME", "CARGO_HOME"):
+        if key in os.environ:
+            env[key] = os.environ[key]
+    # HOME points at the scratch dir, so rustup needs its real home spelled out
+    env.setdefault("RUSTUP_HOME", os.path.expanduser("~/.rustup"))
+    env["GOCACHE"] = os.path.join(workdir, ".gocache")
+    return env
+
+
+def kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def reap(pid: int, deadline: float):
+    """Wait for the child until the deadline, then kill it. Returns (wait status, killed)."""
+    while time.monotonic() < deadline:
+        waited, wait_status = os.waitpid(pid, os.WNOHANG)
+        if waited:
+            return wait_status, False
+        time.sleep(0.005)
+    kill_group(pid)
+    return os.waitpid(pid, 0)[1], True
+
+
+def supervise(pid: int, out_r: int, err_r: int, memory_flag: mmap.mmap, time_limit: float,
+              max_output_bytes: int, stream: bool):
+    """
+    Pump the child's output until it exits or a limit is hit, then kill
+    anything it left running. Returns (status, exit_code, stderr_text).
+    """
+    selector = selectors.DefaultSelector()
+    selector.register(out_r, selectors.EVENT_READ, "stdout")
+    selector.register(err_r, selectors.EVENT_READ, "stderr")
+    deadline = time.monotonic() + time_limit
+    output_bytes = 0
+    stderr_chunks = []
+    status = None
+
+    wait_status = None
+
+    while selector.get_map():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            if wait_status is None:
+                status = "timeout"
+            break
+        # Wake up now and then: something the child started may hold the
+        # pipes open after the child itself has exited
+        for key, _ in selector.select(timeout=min(remaining, EXIT_POLL_SECONDS)):
+            data = os.read(key.fd, READ_CHUNK_BYTES)
+            if not data:
+                selector.unregister(key.fd)
+                continue
+            output_bytes += len(data)
+            if key.data == "stderr" and not stream:
+                stderr_chunks.append(data)
+            elif stream:
+                send({"type": key.data, "data": data.decode(errors="replace")})
+            if output_bytes > max_output_bytes:
+                status = "output_limit"
+                break
+        if status:
+            break
+        if wait_status is None:
+            waited, child_status = os.waitpid(pid, os.WNOHANG)
+            if waited:
+                wait_status = child_status
+                # Its leftovers go too, which closes the pipes
+                kill_group(pid)
+
+    # Background processes outlive the child otherwise; the group id stays
+    # reserved while any member is alive, so this cannot hit another run
+    kill_group(pid)
+    selector.close()
+    os.close(out_r)
+    os.close(err_r)
+
+    if wait_status is None:
+        # The child closed its output without exiting
+        wait_status, killed = reap(pid, deadline)
+        if killed and status is None:
+            status = "timeout"
+
+    if os.WIFSIGNALED(wait_status):
+        exit_code = -os.WTERMSIG(wait_status)
+        if status is None:
+            status = "timeout" if os.WTERMSIG(wait_status) == signal.SIGXCPU else "runtime_error"
+    else:
+        exit_code = os.WEXITSTATUS(wait_status)
+        if status is None and memory_flag[0]:
+            status = "memory_limit"
+        elif status is None:
+            status = "ok" if exit_code == 0 else "runtime_error"
+    memory_flag.close()
+
+    return status, exit_code, b"".join(stderr_chunks).decode(errors="replace")
+
+
+def run_job(language: str, job: dict, sandbox, max_processes: int):
+    spec = LANGUAGES[language]
+    time_limit = float(job["time_limit"])
+    memory_mb = int(job["memory_mb"])
+    max_output_bytes = int(job["max_output_bytes"])
+    limits = (time_limit, memory_mb, spec.get("limit_address_space", True))
+
+    workdir = tempfile.mkdtemp(prefix="bs-run-")
+    if sandbox:
+        os.chown(workdir, *sandbox)
+    started = time.monotonic()
+    try:
+        with open(os.path.join(workdir, spec["file"]), "w") as f:
+            f.write(job["code"])
+
+        if spec.get("compile"):
+            pid, out_r, err_r, memory_flag = spawn(
+                workdir, shlex.split(spec["compile"]), "", sandbox, max_processes
+            )
+            status, exit_code, stderr = supervise(
+                pid, out_r, err_r, memory_flag, COMPILE_TIME_LIMIT_SECONDS, max_output_bytes,
+                stream=False,
+            )
+            if status != "ok":
+                send({"type": "stderr", "data": stderr})
+                send({
+                    "type": "done",
+                    "status": "compile_error",
+                    "exit_code": exit_code,
+                    "execution_time_ms": int((time.monotonic() - started) * 1000),
+                })
+                return
+
+        run_started = time.monotonic()
+        if spec["run"] is None:
+            pid, out_r, err_r, memory_flag = spawn(
+                workdir, None, job.get("stdin", ""), sandbox, max_processes, limits,
+                python_code=job["code"],
+            )
+        else:
+            argv = shlex.split(spec["run"].format(memory_mb=memory_mb))
+            pid, out_r, err_r, memory_flag = spawn(
+                workdir, argv, job.get("stdin", ""), sandbox, max_processes, limits
+            )
+        status, exit_code, _ = supervise(pid, out_r, err_r, memory_flag, time_limit,
+                                         max_output_bytes, stream=True)
+        send({
+            "type": "done",
+            "status": status,
+            "exit_code": exit_code,
+            "execution_time_ms": int((time.monotonic() - run_started) * 1000),
+        })
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    language = sys.argv[1]
+    if language not in LANGUAGES:
+        sys.exit(f"Unsupported language: {language}")
+
+    if language == "python":
+        for module in PRELOADED_MODULES:
+            __import__(module)
+    network_isolated = isolate_worker()
+    sandbox = sandbox_identity(os.environ.get("SANDBOX_USER", ""))
+    max_processes = int(os.environ.get("SANDBOX_MAX_PROCESSES", "512"))
+
+    send({"type": "ready", "language": language,
+          "network_isolated": network_isolated, "sandbox_user": sandbox is not None})
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            run_job(language, json.loads(line), sandbox, max_processes)
+        except Exception as e:
+            send({"type": "done", "status": "internal_error", "exit_code": -1,
+                  "execution_time_ms": 0, "error": str(e)})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional
+import base64
+import hashlib
+import json
+import time
+import zlib
+
+from app.config import settings
+from app.models import CodeSnapshotInfo
+
+# Diffing runs on the event loop and SequenceMatcher is worse than quadratic
+# on repetitive lines, so a delta is only attempted within these bounds;
+# beyond them the version is stored as a keyframe instead.
+MAX_DIFF_LINE_PAIRS = 200_000  # pairs of equal lines between the changed regions
+DIFF_TIME_BUDGET_SECONDS = 0.05
+
+
+class SnapshotEntry:
+    """One stored version: a compressed keyframe (full text) or a compressed delta."""
+    __slots__ = ("version", "created_at", "is_keyframe", "payload", "size")
+
+    def __init__(self, version: int, created_at: float, is_keyframe: bool,
+                 payload: bytes, size: int):
+        self.version = version
+        self.created_at = created_at
+        self.is_keyframe = is_keyframe
+        self.payload = payload
+        self.size = size  # uncompressed document length
+
+    def to_info(self) -> CodeSnapshotInfo:
+        return CodeSnapshotInfo(
+            version=self.version,
+            created_at=datetime.fromtimestamp(self.created_at, tz=timezone.utc),
+            size=self.size,
+            is_keyframe=self.is_keyframe
+        )
+
+
+class DiffBudgetExceeded(Exception):
+    """Raised by BudgetedMatcher past its deadline"""
+
+
+class BudgetedMatcher(SequenceMatcher):
+    """SequenceMatcher that gives up once `deadline` (time.monotonic) has passed"""
+    def __init__(self, a: list, b: list, deadline: float):
+        self.deadline = deadline
+        super().__init__(None, a, b, autojunk=False)
+
+    def find_longest_match(self, *args):
+        if time.monotonic() > self.deadline:
+            raise DiffBudgetExceeded()
+        return super().find_longest_match(*args)
+
+
+def encode_delta(old: str, new: str,
+                 time_budget: float = DIFF_TIME_BUDGET_SECONDS) -> Optional[bytes]:
+    """
+    Line-based delta from `old` to `new`. Ops are: a positive int copies that
+    many lines from `old`, a negative int skips lines in `old`, and a list of
+    strings inserts those lines. Returns None when the diff would be too
+    expensive.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+
+    # Unchanged head and tail are copied without diffing
+    limit = min(len(old_lines), len(new_lines))
+    prefix = 0
+    while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+        suffix += 1
+    old_middle = old_lines[prefix:len(old_lines) - suffix]
+    new_middle = new_lines[prefix:len(new_lines) - suffix]
+
+    new_counts = Counter(new_middle)
+    if sum(new_counts[line] for line in old_middle) > MAX_DIFF_LINE_PAIRS:
+        return None
+    try:
+        opcodes = BudgetedMatcher(old_middle, new_middle,
+                                  time.monotonic() + time_budget).get_opcodes()
+    except DiffBudgetExceeded:
+        return None
+
+    ops: list = [prefix] if prefix else []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(new_middle[j1:j2])
+    if suffix:
+        ops.append(suffix)
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode())
+
+
+def apply_delta(old: str, delta: bytes) -> str:
+    old_lines = old.splitlines(keepends=True)
+    position = 0
+    parts = []
+    for op in json.loads(zlib.decompress(delta)):
+        if isinstance(op, list):
+            parts.extend(op)
+        elif op > 0:
+            parts.extend(old_lines[position:position + op])
+            position += op
+        else:
+            position -= op
+    return "".join(parts)
+
+
+class RoomSnapshots:
+    """
+    Version history of one room's code document. Every `keyframe_interval`-th
+    version is a keyframe, as is any version too expensive to diff and the
+    oldest one kept, so rebuilding any version applies at most
+    `keyframe_interval - 1` deltas. The latest text is kept decompressed.
+    """
+    __slots__ = ("entries", "latest_text", "latest_digest", "next_version", "stored_bytes")
+
+    def __init__(self, next_version: int = 1):
+        self.entries: List[SnapshotEntry] = []
+        self.latest_text = ""
+        self.latest_digest = b""
+        self.next_version = next_version
+        self.stored_bytes = 0  # compressed payloads
+
+
+class SnapshotStore:
+    """
+    Periodic server-side snapshots of each room's shared editor contents.
+    Identical consecutive snapshots are not stored, so idle rooms do not
+    grow. History is bounded per room (versions and bytes) and across all
+    rooms (bytes): the oldest versions are dropped first and the new oldest
+    is rebuilt as a keyframe. Past the global cap, the least recently saved
+    room loses its oldest versions first, down to none. Version numbers are
+    never reused within a room.
+    """
+    def __init__(self, keyframe_interval: int, max_versions_per_room: int,
+                 max_bytes_per_room: int, max_total_bytes: int):
+        self.keyframe_interval = keyframe_interval
+        self.max_versions_per_room = max_versions_per_room
+        self.max_bytes_per_room = max_bytes_per_room
+        self.max_total_bytes = max_total_bytes
+        self.rooms: "OrderedDict[str, RoomSnapshots]" = OrderedDict()  # LRU order
+        self.emptied: Dict[str, int] = {}  # next version of rooms evicted down to nothing
+        self.total_bytes = 0
+
+    def save(self, room_id: str, code: str) -> SnapshotEntry:
+        """Store a new version, or return the latest one if nothing changed"""
+        history = self.rooms.get(room_id)
+        if history is None:
+            history = RoomSnapshots(self.emptied.pop(room_id, 1))
+            self.rooms[room_id] = history
+        else:
+            self.rooms.move_to_end(room_id)
+
+        digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+        if history.entries and digest == history.latest_digest:
+            return history.entries[-1]
+
+        version = history.next_version
+        delta = None
+        if history.entries and (version - 1) % self.keyframe_interval:
+            delta = encode_delta(history.latest_text, code)
+        if delta is None:
+            entry = SnapshotEntry(version, time.time(), True,
+                                  zlib.compress(code.encode()), len(code))
+        else:
+            entry = SnapshotEntry(version, time.time(), False, delta, len(code))
+
+        history.entries.append(entry)
+        history.next_version += 1
+        history.latest_text = code
+        history.latest_digest = digest
+        self._add_bytes(history, len(entry.payload))
+        self._enforce_limits(room_id, history)
+        return entry
+
+    def get_latest(self, room_id: str) -> Optional[tuple]:
+        """(entry, text) for the newest version, without decompressing anything"""
+        history = self.rooms.get(room_id)
+        if history is None or not history.entries:
+            return None
+        return history.entries[-1], history.latest_text
+
+    def get_version(self, room_id: str, version: int) -> Optional[tuple]:
+        """(entry, text) for any stored version, rebuilt from its keyframe"""
+        history = self.rooms.get(room_id)
+        if history is None or not history.entries:
+            return None
+        index = version - history.entries[0].version
+        if not 0 <= index < len(history.entries):
+            return None
+        if index == len(history.entries) - 1:
+            return self.get_latest(room_id)
+
+        return history.entries[index], self._rebuild(history, index)
+
+    def _rebuild(self, history: RoomSnapshots, index: int) -> str:
+        keyframe = index
+        while not history.entries[keyframe].is_keyframe:
+            keyframe -= 1
+        text = zlib.decompress(history.entries[keyframe].payload).decode()
+        for entry in history.entries[keyframe + 1:index + 1]:
+            text = apply_delta(text, entry.payload)
+        return text
+
+    # Retention
+
+    def _add_bytes(self, history: RoomSnapshots, size: int):
+        history.stored_bytes += size
+        self.total_bytes += size
+
+    def _drop_oldest(self, history: RoomSnapshots):
+        """Drop the oldest version, re-basing the next one on a keyframe"""
+        entries = history.entries
+        if len(entries) > 1 and not entries[1].is_keyframe:
+            delta = entries[1]
+            keyframe = SnapshotEntry(delta.version, delta.created_at, True,
+                                     zlib.compress(self._rebuild(history, 1).encode()),
+                                     delta.size)
+            entries[1] = keyframe
+            self._add_bytes(history, len(keyframe.payload) - len(delta.payload))
+        self._add_bytes(history, -len(entries.pop(0).payload))
+
+    def _enforce_limits(self, room_id: str, history: RoomSnapshots):
+        # The latest version is always kept, however large
+        while len(history.entries) > 1 and (
+                len(history.entries) > self.max_versions_per_room
+                or history.stored_bytes > self.max_bytes_per_room):
+            self._drop_oldest(history)
+
+        while self.total_bytes > self.max_total_bytes:
+            oldest_id, oldest = next(iter(self.rooms.items()))
+            if oldest_id == room_id and len(oldest.entries) <= 1:
+                break  # only the version just stored is left
+            self._drop_oldest(oldest)
+            if not oldest.entries:
+                del self.rooms[oldest_id]
+                self.emptied[oldest_id] = oldest.next_version
+
+    def list_versions(self, room_id: str) -> List[SnapshotEntry]:
+        history = self.rooms.get(room_id)
+        return list(history.entries) if history else []
+
+    def stored_bytes(self, room_id: str) -> int:
+        history = self.rooms.get(room_id)
+        return history.stored_bytes if history else 0
+
+    def export_room(self, room_id: str) -> list:
+        """A room's stored versions as JSON-safe rows, to move it to another node"""
+        history = self.rooms.get(room_id)
+        if history is None:
+            return []
+        return [[e.version, e.created_at, e.is_keyframe, base64.b64encode(e.payload).decode(), e.size]
+                for e in history.entries]
+
+    def import_room(self, room_id: str, rows: list):
+        """Replace a room's history with an `export_room` result"""
+        self.remove_room(room_id)
+        if not rows:
+            return
+        entries = [SnapshotEntry(version, created_at, is_keyframe,
+                                 base64.b64decode(payload), size)
+                   for version, created_at, is_keyframe, payload, size in rows]
+        history = RoomSnapshots(entries[-1].version + 1)
+        history.entries = entries
+        history.latest_text = self._rebuild(history, len(entries) - 1)
+        history.latest_digest = hashlib.blake2b(history.latest_text.encode(),
+                                                digest_size=16).digest()
+        self.rooms[room_id] = history
+        self._add_bytes(history, sum(len(e.payload) for e in entries))
+        self._enforce_limits(room_id, history)
+
+    def remove_room(self, room_id: str):
+        self.emptied.pop(room_id, None)
+        history = self.rooms.pop(room_id, None)
+        if history is not None:
+            self.total_bytes -= history.stored_bytes
+
+
+# Global snapshot store instance
+snapshots = SnapshotStore(
+    keyframe_interval=settings.SNAPSHOT_KEYFRAME_INTERVAL,
+    max_versions_per_room=settings.SNAPSHOT_MAX_VERSIONS_PER_ROOM,
+    max_bytes_per_room=settings.SNAPSHOT_MAX_BYTES_PER_ROOM,
+    max_total_bytes=settings.SNAPSHOT_MAX_TOTAL_BYTES,
+)
@@ -0,0 +1,138 @@
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import functools
+import inspect
+import time
+
+from app.config import settings
+
+
+class RequestTrace:
+    """Time spent per named span during one request, as name -> [count, seconds]."""
+    __slots__ = ("spans",)
+
+    def __init__(self):
+        self.spans: Dict[str, list] = {}
+
+    def add(self, name: str, seconds: float):
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+class span:
+    """
+    Times a named part of the current request. Spans with the same name are
+    summed; outside a request this does nothing.
+
+        with span("db.search_public_rooms"):
+            ...
+    """
+    __slots__ = ("name", "trace", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current_trace.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def traced(name: str):
+    """Decorator form of `span`, for sync and async functions"""
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class SlowRequestLog:
+    """The most recent requests slower than the threshold, with their span breakdown."""
+    def __init__(self, threshold_ms: float, size: int):
+        self.threshold_ms = threshold_ms
+        self.entries: deque = deque(maxlen=size)
+        self.total_slow = 0
+
+    def record(self, method: str, path: str, status: int, started_at: float,
+               duration_ms: float, trace: RequestTrace):
+        spans = {name: {"count": count, "ms": round(seconds * 1000, 3)}
+                 for name, (count, seconds) in sorted(trace.spans.items(),
+                                                      key=lambda item: -item[1][1])}
+        self.total_slow += 1
+        self.entries.append({
+            "method": method,
+            "path": path,
+            "status": status,
+            "started_at": datetime.fromtimestamp(started_at, tz=timezone.utc).isoformat(),
+            "duration_ms": round(duration_ms, 3),
+            "spans": spans,
+            # Concurrent spans (e.g. gathered upstream calls) can make this negative
+            "unaccounted_ms": round(duration_ms - sum(s["ms"] for s in spans.values()), 3),
+        })
+
+    def recent(self, limit: int) -> List[dict]:
+        return list(self.entries)[-limit:][::-1]
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware that traces every request and keeps the slow ones."""
+    def __init__(self, app, log: SlowRequestLog):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        started_at = time.time()
+        started = time.perf_counter()
+        status = {"code": 0}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_trace.reset(token)
+            duration_ms = (time.perf_counter() - started) * 1000
+            if duration_ms >= self.log.threshold_ms:
+                self.log.record(scope["method"], scope["path"], status["code"],
+                                started_at, duration_ms, trace)
+
+
+# Global slow request log
+slow_requests = SlowRequestLog(
+    threshold_ms=settings.SLOW_REQUEST_THRESHOLD_MS,
+    size=settings.SLOW_REQUEST_LOG_SIZE,
+)
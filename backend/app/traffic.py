@@ -0,0 +1,284 @@
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+import json
+import os
+import time
+
+from starlette.routing import Match
+
+from app.auth import user_id_from_token
+from app.config import settings
+from app.database import normalize_invite_code
+from app.logger import BackgroundQueue
+
+# Keys whose string values are identities: recorded as stable aliases
+# ("r12" for a room, "u3" for a user, "i2" for an invite code)
+ID_KEYS = {
+    "room_id": "r",
+    "room": "r",  # /liveblocks/auth; room objects in responses are dicts and recursed into
+    "user_id": "u",
+    "reported_user_id": "u",
+    "created_by": "u",
+    "id": "u",
+    "invite_code": "i",
+}
+# Applied before aliasing, so spellings the app treats as the same id share an alias
+ID_NORMALIZERS = {"i": normalize_invite_code}
+# Keys whose string values are not personal and shape behaviour; kept verbatim.
+# Every other string is recorded as its length only.
+KEPT_STRING_KEYS = {"language", "event_type", "has_slots"}
+
+# Request and response bodies larger than this are not inspected
+MAX_CAPTURED_BODY = 64 * 1024
+
+EXEMPT_PATHS = {"/health"}
+
+
+class Anonymizer:
+    """Maps real ids to per-recording aliases; the same id always gets the same alias."""
+    def __init__(self):
+        self.aliases: Dict[str, str] = {}
+        self.counts: Dict[str, int] = {}
+
+    def alias(self, kind: str, value: str) -> str:
+        key = self._key(kind, value)
+        alias = self.aliases.get(key)
+        if alias is None:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            alias = self.aliases[key] = f"{kind}{self.counts[kind]}"
+        return alias
+
+    def is_known(self, kind: str, value: str) -> bool:
+        return self._key(kind, value) in self.aliases
+
+    @staticmethod
+    def _key(kind: str, value: str) -> str:
+        normalize = ID_NORMALIZERS.get(kind)
+        return kind + (normalize(value) if normalize else value)
+
+    def shape(self, value, key: Optional[str] = None):
+        """
+        A JSON value with identities replaced by {"$id": alias} and other
+        strings by {"$str": length}. Numbers, booleans and nulls are kept.
+        """
+        if isinstance(value, dict):
+            return {k: self.shape(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.shape(v, key) for v in value]
+        if isinstance(value, str):
+            if key in ID_KEYS:
+                return {"$id": self.alias(ID_KEYS[key], value)}
+            if key in KEPT_STRING_KEYS:
+                return value
+            return {"$str": len(value)}
+        return value
+
+    def shape_params(self, params: Dict[str, str]) -> Dict:
+        """Like `shape`, for path or query parameters: numeric strings are kept as ints"""
+        return {key: int(value) if value.isdigit() else self.shape(value, key)
+                for key, value in params.items()}
+
+    def new_bindings(self, value, path: tuple = ()) -> List[list]:
+        """
+        [json path, alias] for every identity in a response that this
+        recording has not seen before, so a replay can learn the real value
+        the replayed app assigns at the same place.
+        """
+        found = []
+        if isinstance(value, dict):
+            for k, v in value.items():
+                if isinstance(v, str) and k in ID_KEYS:
+                    if not self.is_known(ID_KEYS[k], v):
+                        found.append([list(path + (k,)), self.alias(ID_KEYS[k], v)])
+                elif isinstance(v, (dict, list)):
+                    found.extend(self.new_bindings(v, path + (k,)))
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                found.extend(self.new_bindings(item, path + (index,)))
+        return found
+
+
+class RotatingFile:
+    """Appends lines to `path`, rotating to path.1 .. path.N past `max_bytes`."""
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+
+    def write_lines(self, lines: List[str]):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(lines))
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class TrafficRecorder:
+    """
+    Records an anonymised trace of API traffic, one JSON object per request:
+
+        {"t": 12.5, "method": "POST", "route": "/rooms/{room_id}/join",
+         "params": {"room_id": {"$id": "r4"}}, "user": "u2", "query": {},
+         "body": {"invite_code": null}, "status": 200, "ms": 2.1, "bind": []}
+
+    `t` is seconds since recording started. No tokens, emails, names or
+    free text are stored: see Anonymizer.shape. Lines are written by a
+    background thread to a size-rotated file. scripts/replay_traffic.py
+    replays a trace.
+    """
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.anonymizer = Anonymizer()
+        self.file = RotatingFile(path, max_bytes, backups)
+        self.queue = BackgroundQueue("traffic-recorder", self._write_batch,
+                                     max_items=10_000, flush_interval=0.5)
+        self.started = time.monotonic()
+
+    def record(self, entry: dict):
+        self.queue.put(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def close(self):
+        self.queue.close()
+        self.file.close()
+
+    def _write_batch(self, lines: List[str]):
+        self.file.write_lines(lines)
+
+
+class TrafficRecorderMiddleware:
+    """ASGI middleware feeding a TrafficRecorder. Responses are passed through untouched."""
+    def __init__(self, app, recorder: TrafficRecorder, routes: list):
+        self.app = app
+        self.recorder = recorder
+        self.routes = routes  # the app's route list; it fills up after the middleware is added
+        self._templates: Optional[Dict] = None
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] == "OPTIONS"
+                or scope["path"] in EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        request_body = bytearray()
+        response_body = bytearray()
+        response = {"status": 0, "json": False}
+        sizes = {"request": 0}
+
+        async def receive_and_capture():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                sizes["request"] += len(chunk)
+                if sizes["request"] <= MAX_CAPTURED_BODY:
+                    request_body.extend(chunk)
+            return message
+
+        async def send_and_capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                response["json"] = content_type.startswith(b"application/json")
+            elif (message["type"] == "http.response.body" and response["json"]
+                    and len(response_body) <= MAX_CAPTURED_BODY):
+                response_body.extend(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_capture, send_and_capture)
+        finally:
+            self._record(scope, started, bytes(request_body), sizes,
+                         bytes(response_body), response["status"])
+
+    def _record(self, scope, started: float, request_body: bytes, sizes: Dict[str, int],
+                response_body: bytes, status: int):
+        anonymizer = self.recorder.anonymizer
+        route = self._route_template(scope)
+
+        user = None
+        headers = dict(scope["headers"])
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        if authorization.startswith("Bearer "):
+            user_id = user_id_from_token(authorization[7:])
+            if user_id:
+                user = anonymizer.alias("u", user_id)
+
+        entry = {
+            "t": round(started - self.recorder.started, 4),
+            "method": scope["method"],
+            "route": route,
+            "params": anonymizer.shape_params(scope.get("path_params", {})) if route else {},
+            "user": user,
+            "query": anonymizer.shape_params(
+                dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))),
+            "body": _shape_json(anonymizer, request_body, sizes["request"]),
+            "status": status,
+            "ms": round((time.monotonic() - started) * 1000, 2),
+            "bind": [],
+        }
+        if response_body and len(response_body) <= MAX_CAPTURED_BODY:
+            try:
+                data = json.loads(response_body)
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and isinstance(data.get("access_token"), str):
+                # Signup and login: the trace identifies the user by the token's subject
+                user_id = user_id_from_token(data["access_token"])
+                if user_id:
+                    if not anonymizer.is_known("u", user_id):
+                        entry["bind"].append([["access_token"], anonymizer.alias("u", user_id)])
+                    entry["user"] = anonymizer.alias("u", user_id)
+            elif data is not None:
+                entry["bind"] = anonymizer.new_bindings(data)
+        self.recorder.record(entry)
+
+    def _route_template(self, scope) -> Optional[str]:
+        # None for unmatched paths, whose raw text could carry identities
+        if self._templates is None:
+            self._templates = {getattr(r, "endpoint", None): r.path for r in self.routes}
+        if "endpoint" in scope:
+            return self._templates.get(scope["endpoint"])
+        # Rejected before routing (e.g. rate limited): match it here
+        for route in self.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                scope.update(child_scope)
+                return self._templates.get(child_scope.get("endpoint"))
+        return None
+
+
+def _shape_json(anonymizer: Anonymizer, body: bytes, size: int):
+    if not size:
+        return None
+    if size > MAX_CAPTURED_BODY:
+        return {"$bytes": size}
+    try:
+        return anonymizer.shape(json.loads(body))
+    except ValueError:
+        return {"$bytes": size}
+
+
+# Global traffic recorder; only used when TRAFFIC_RECORD_PATH is set
+traffic_recorder = (
+    TrafficRecorder(settings.TRAFFIC_RECORD_PATH,
+                    max_bytes=settings.TRAFFIC_RECORD_MAX_BYTES,
+                    backups=settings.TRAFFIC_RECORD_BACKUPS)
+    if settings.TRAFFIC_RECORD_PATH else None
+)
@@ -0,0 +1,311 @@
+from typing import List, Optional, Set
+import asyncio
+import time
+
+import httpx
+
+from app.config import settings
+from app.logger import logger
+from app.models import Room, User
+from app.tracing import span
+
+
+class UpstreamError(Exception):
+    """Raised when Liveblocks or Daily.co cannot issue a token"""
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after  # set when the circuit is open
+
+
+class LatencyWindow:
+    """The most recent successful call latencies, in seconds."""
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.size = size
+        self.min_samples = min_samples
+        self.samples: List[float] = []
+        self.next_index = 0
+        self._sorted: Optional[List[float]] = None
+
+    def record(self, seconds: float):
+        if len(self.samples) < self.size:
+            self.samples.append(seconds)
+        else:
+            self.samples[self.next_index] = seconds
+            self.next_index = (self.next_index + 1) % self.size
+        self._sorted = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """None until there are enough samples to trust"""
+        if len(self.samples) < self.min_samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self.samples)
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_seconds`; then lets a single probe through (half-open) and closes
+    again if it succeeds.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+        return True
+
+    def release_probe(self):
+        self.probe_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class UpstreamService:
+    """
+    Calls to one upstream API, guarded by a circuit breaker. The timeout
+    adapts to observed latency (a multiple of p99, clamped), and idempotent
+    calls can be hedged: if the first attempt is slower than p95, a second
+    one is sent and whichever succeeds first wins.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.UPSTREAM_CIRCUIT_FAILURE_THRESHOLD,
+            reset_seconds=settings.UPSTREAM_CIRCUIT_RESET_SECONDS
+        )
+        self.latency = LatencyWindow()
+
+    def timeout(self) -> float:
+        p99 = self.latency.percentile(0.99)
+        if p99 is None:
+            return settings.UPSTREAM_MAX_TIMEOUT_SECONDS
+        return min(settings.UPSTREAM_MAX_TIMEOUT_SECONDS,
+                   max(settings.UPSTREAM_MIN_TIMEOUT_SECONDS,
+                       p99 * settings.UPSTREAM_TIMEOUT_P99_MULTIPLIER))
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str,
+                      idempotent: bool = False, **kwargs) -> httpx.Response:
+        """
+        Send a request. Raises UpstreamError when the circuit is open, and
+        httpx.RequestError for transport failures. 5xx responses and
+        transport failures count against the breaker.
+        """
+        if not self.breaker.allow():
+            raise UpstreamError(f"{self.name} is temporarily unavailable",
+                                retry_after=self.breaker.retry_after())
+
+        timeout = self.timeout()
+        hedge_delay = self.latency.percentile(0.95)
+
+        async def attempt() -> httpx.Response:
+            started = time.monotonic()
+            response = await client.request(method, url, timeout=timeout, **kwargs)
+            if response.status_code < 500:
+                self.latency.record(time.monotonic() - started)
+            return response
+
+        try:
+            with span(f"upstream.{self.name.lower()}"):
+                if idempotent and settings.UPSTREAM_HEDGING_ENABLED and hedge_delay is not None:
+                    response = await self._hedged(attempt, hedge_delay)
+                else:
+                    response = await attempt()
+        except asyncio.CancelledError:
+            # The caller went away; that says nothing about the upstream
+            self.breaker.release_probe()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    @staticmethod
+    async def _hedged(attempt, hedge_delay: float) -> httpx.Response:
+        first = asyncio.ensure_future(attempt())
+        try:
+            done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        if done:
+            return first.result()
+
+        pending = {first, asyncio.ensure_future(attempt())}
+        result: Optional[httpx.Response] = None
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif task.result().status_code < 500:
+                        return task.result()
+                    else:
+                        result = task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if result is not None:
+            return result
+        raise error
+
+
+class UpstreamClient:
+    """
+    Token minting against Liveblocks and Daily.co over one shared HTTP client,
+    so connections (and TLS sessions) are reused across requests.
+    """
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        # Daily rooms this process has already created
+        self._daily_rooms: Set[str] = set()
+        self.liveblocks = UpstreamService("Liveblocks")
+        self.daily = UpstreamService("Daily")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=settings.UPSTREAM_MAX_TIMEOUT_SECONDS)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def mint_liveblocks_token(self, room_id: str, user: User) -> dict:
+        try:
+            # Authorizing again just issues another token, so it is safe to hedge
+            response = await self.liveblocks.request(
+                self.client, "POST",
+                "{}/v2/rooms/{}/authorize".format(settings.LIVEBLOCKS_API_URL, room_id),
+                idempotent=True,
+                headers={
+                    "Authorization": f"Bearer {settings.LIVEBLOCKS_SECRET_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "userId": user.id,
+                    "userInfo": {
+                        "name": user.display_name,
+                        "email": user.email
+                    }
+                }
+            )
+        except httpx.RequestError as e:
+            raise UpstreamError(f"Liveblocks API error: {str(e)}")
+
+        if response.status_code != 200:
+            raise UpstreamError("Failed to generate Liveblocks token")
+        return response.json()
+
+    async def mint_daily_token(self, room: Room, user: User) -> dict:
+        """
+        Ensure the Daily room exists and create a meeting token for it.
+        Both calls run concurrently: a meeting token only names the room.
+        """
+        daily_room_name = f"binarysearch-{room.room_id}"
+        headers = {
+            "Authorization": f"Bearer {settings.DAILY_API_KEY}",
+            "Content-Type": "application/json"
+        }
+
+        async def create_room():
+            if daily_room_name in self._daily_rooms:
+                return
+            # Creating an existing room returns 409, so this is safe to hedge
+            room_response = await self.daily.request(
+                self.client, "POST",
+                f"{settings.DAILY_API_URL}/v1/rooms",
+                idempotent=True,
+                headers=headers,
+                json={
+                    "name": daily_room_name,
+                    "properties": {
+                        "max_participants": room.max_users,
+                        "enable_chat": False,
+                        "enable_screenshare": True,
+                        "start_video_off": True,
+                        "start_audio_off": False
+                    }
+                }
+            )
+            # Room might already exist (409), which is fine
+            if room_response.status_code not in (200, 409):
+                logger.warning("daily_room_creation_failed", room=daily_room_name,
+                               status=room_response.status_code, body=room_response.text[:500])
+                # A token for a room that does not exist cannot join anything
+                raise UpstreamError("Failed to create Daily room")
+            self._daily_rooms.add(daily_room_name)
+
+        async def create_token():
+            return await self.daily.request(
+                self.client, "POST",
+                f"{settings.DAILY_API_URL}/v1/meeting-tokens",
+                idempotent=True,
+                headers=headers,
+                json={
+                    "properties": {
+                        "room_name": daily_room_name,
+                        "user_name": user.display_name,
+                        "enable_screenshare": True,
+                        "start_video_off": True,
+                        "start_audio_off": False
+                    }
+                }
+            )
+
+        try:
+            _, token_response = await asyncio.gather(create_room(), create_token())
+        except httpx.RequestError as e:
+            raise UpstreamError(f"Daily API error: {str(e)}")
+
+        if token_response.status_code != 200:
+            raise UpstreamError("Failed to generate Daily token")
+
+        return {
+            "token": token_response.json()["token"],
+            "room_url": f"https://{settings.DAILY_DOMAIN}/{daily_room_name}"
+        }
+
+
+# Global upstream client
+upstream = UpstreamClient()
@@ -0,0 +1,255 @@
+"""
+Run a local cluster of backend nodes and measure room-scoped throughput
+as nodes are added, then check that adding a node rebalances rooms.
+
+    python scripts/bench_cluster.py --nodes 1 2 4 --seconds 10
+    python scripts/bench_cluster.py --nodes 3 --rebalance
+
+For each cluster size, N uvicorn processes are started on consecutive
+ports with CLUSTER_NODES pointing at each other. Users sign up and create
+rooms through every node, then load processes hammer room-scoped
+endpoints (room details, chat history, join) for --seconds, in two modes:
+
+  entry   requests go to a random node, which forwards them to the owner
+  direct  the client hashes the room id itself and calls the owner
+
+With --rebalance, one more node is started and announced with
+PUT /cluster/nodes; the script waits until every room is reachable again
+and reports how many rooms moved. Needs the usual backend .env values
+(SECRET_KEY etc.) in the environment. Upstreams are never called.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import secrets
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx  # noqa: E402
+
+ADMIN_EMAIL = "admin@bench.example.com"
+ADMIN_TOKEN = secrets.token_hex(16)
+PASSWORD = "bench-password"
+
+
+def node_env(nodes: List[str], self_url: str, secret: str, allowed: List[str]) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "CLUSTER_NODES": json.dumps(nodes),
+        "CLUSTER_ALLOWED_NODES": json.dumps(allowed),
+        "CLUSTER_SELF_URL": self_url,
+        "CLUSTER_SECRET": secret,
+        "ADMIN_TOKEN": ADMIN_TOKEN,
+        "RATE_LIMIT_ENABLED": "false",
+        "EXECUTOR_POOL_SIZE": "0",
+        "STATE_DIR": "",
+        "TRAFFIC_RECORD_PATH": "",
+        "LOG_FILE": os.devnull,
+        "PYTHONPATH": BACKEND_DIR,
+    })
+    return env
+
+
+def start_node(nodes: List[str], url: str, secret: str,
+               allowed: List[str]) -> subprocess.Popen:
+    port = url.rsplit(":", 1)[1]
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", port,
+         "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=node_env(nodes, url, secret, allowed),
+    )
+
+
+async def wait_healthy(client: httpx.AsyncClient, nodes: List[str], timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    for node in nodes:
+        while True:
+            try:
+                if (await client.get(node + "/health")).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{node} did not start")
+            await asyncio.sleep(0.2)
+
+
+async def signup(client: httpx.AsyncClient, node: str, email: str) -> str:
+    response = await client.post(node + "/auth/signup", json={
+        "email": email, "password": PASSWORD, "display_name": email.split("@")[0]})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def populate(client: httpx.AsyncClient, nodes: List[str], users: int,
+                   rooms_per_user: int) -> tuple:
+    """Sign users up and create rooms through every node in turn"""
+    tokens = await asyncio.gather(*(
+        signup(client, nodes[i % len(nodes)], f"user{i}-{secrets.token_hex(3)}@bench.example.com")
+        for i in range(users)))
+    room_ids = []
+    for i, token in enumerate(tokens):
+        for j in range(rooms_per_user):
+            node = nodes[(i * rooms_per_user + j) % len(nodes)]
+            response = await client.post(node + "/rooms", json={"title": f"bench room {i}-{j}"},
+                                         headers={"Authorization": f"Bearer {token}"})
+            response.raise_for_status()
+            room_ids.append(response.json()["room_id"])
+    return list(tokens), room_ids
+
+
+async def _load(nodes: List[str], tokens: List[str], room_ids: List[str], mode: str,
+                seconds: float, concurrency: int) -> Dict[str, int]:
+    from app.cluster import HashRing
+    ring = HashRing(nodes, int(os.environ.get("CLUSTER_VIRTUAL_NODES", "128")))
+    counts = {"ok": 0, "error": 0}
+    deadline = time.monotonic() + seconds
+    limits = httpx.Limits(max_connections=concurrency * len(nodes))
+
+    async with httpx.AsyncClient(limits=limits, timeout=10.0) as client:
+        async def worker():
+            while time.monotonic() < deadline:
+                room_id = random.choice(room_ids)
+                headers = {"Authorization": f"Bearer {random.choice(tokens)}"}
+                node = ring.owner("room:" + room_id) if mode == "direct" else random.choice(nodes)
+                kind = random.random()
+                try:
+                    if kind < 0.4:
+                        response = await client.get(f"{node}/rooms/{room_id}", headers=headers)
+                    elif kind < 0.8:
+                        response = await client.get(f"{node}/rooms/{room_id}/messages",
+                                                    headers=headers)
+                    else:
+                        response = await client.post(f"{node}/rooms/{room_id}/join", json={},
+                                                     headers=headers)
+                    counts["ok" if response.status_code < 400 else "error"] += 1
+                except httpx.HTTPError:
+                    counts["error"] += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return counts
+
+
+def _load_process(args) -> Dict[str, int]:
+    return asyncio.run(_load(*args))
+
+
+def run_load(nodes, tokens, room_ids, mode: str, seconds: float,
+             processes: int, concurrency: int) -> float:
+    job = (nodes, tokens, room_ids, mode, seconds, concurrency)
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(_load_process, [job] * processes)
+    ok = sum(r["ok"] for r in results)
+    errors = sum(r["error"] for r in results)
+    if errors:
+        print(f"    {errors} failed requests")
+    return ok / seconds
+
+
+def admin_headers(admin: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {admin}", "X-Admin-Token": ADMIN_TOKEN}
+
+
+async def room_counts(client: httpx.AsyncClient, nodes: List[str], admin: str) -> Dict[str, int]:
+    counts = {}
+    for node in nodes:
+        response = await client.get(node + "/cluster", headers=admin_headers(admin))
+        counts[node] = response.json()["rooms"]
+    return counts
+
+
+async def check_rebalance(client: httpx.AsyncClient, nodes: List[str], secret: str,
+                          base_port: int, room_ids: List[str], admin: str) -> subprocess.Popen:
+    new_node = f"http://127.0.0.1:{base_port + len(nodes)}"
+    new_nodes = nodes + [new_node]
+    before = await room_counts(client, nodes, admin)
+    print(f"  rooms per node before: {list(before.values())}")
+
+    process = start_node(new_nodes, new_node, secret, new_nodes)
+    await wait_healthy(client, [new_node])
+    started = time.monotonic()
+    response = await client.put(nodes[0] + "/cluster/nodes", json={"nodes": new_nodes},
+                                headers=admin_headers(admin))
+    response.raise_for_status()
+
+    headers = {"Authorization": f"Bearer {admin}"}
+    while True:
+        after = await room_counts(client, new_nodes, admin)
+        if sum(after.values()) == len(room_ids) and after[new_node] > 0:
+            break
+        if time.monotonic() - started > 60:
+            raise RuntimeError(f"rebalance did not settle: {after}")
+        await asyncio.sleep(0.1)
+    elapsed = time.monotonic() - started
+
+    missing = 0
+    for room_id in room_ids:
+        response = await client.get(f"{random.choice(new_nodes)}/rooms/{room_id}", headers=headers)
+        missing += response.status_code != 200
+    print(f"  rooms per node after:  {list(after.values())} "
+          f"({after[new_node] / len(room_ids):.0%} moved in {elapsed:.2f}s, "
+          f"{missing} unreachable)")
+    return process
+
+
+async def bench(size: int, args) -> Dict[str, float]:
+    nodes = [f"http://127.0.0.1:{args.base_port + i}" for i in range(size)]
+    # The node --rebalance adds
+    allowed = nodes + [f"http://127.0.0.1:{args.base_port + size}"]
+    secret = secrets.token_hex(16)
+    processes = [start_node(nodes, url, secret, allowed) for url in nodes]
+    try:
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            await wait_healthy(client, nodes)
+            admin = await signup(client, nodes[0], ADMIN_EMAIL)
+            tokens, room_ids = await populate(client, nodes, args.users, args.rooms_per_user)
+
+            results = {}
+            for mode in ("entry", "direct"):
+                results[mode] = run_load(nodes, tokens, room_ids, mode, args.seconds,
+                                         args.load_processes, args.concurrency)
+                print(f"  {size} node(s), {mode:6}: {results[mode]:8.0f} req/s")
+
+            if args.rebalance:
+                processes.append(await check_rebalance(
+                    client, nodes, secret, args.base_port, room_ids, admin))
+            return results
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 2, 4],
+                        help="cluster sizes to measure")
+    parser.add_argument("--seconds", type=float, default=10.0, help="load duration per mode")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--rooms-per-user", type=int, default=25)
+    parser.add_argument("--load-processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight per load process")
+    parser.add_argument("--base-port", type=int, default=8100)
+    parser.add_argument("--rebalance", action="store_true",
+                        help="after the load, add a node and check rooms move to it")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU(s); nodes and load processes share them")
+    baseline = None
+    for size in args.nodes:
+        results = await bench(size, args)
+        baseline = baseline or results["direct"]
+        print(f"  scaling vs first size (direct): {results['direct'] / baseline:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
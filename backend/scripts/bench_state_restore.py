@@ -0,0 +1,118 @@
+"""
+Measure state snapshot and restart-to-ready time for a large in-memory state.
+
+    python scripts/bench_state_restore.py --users 1000000 --rooms 50000
+
+Builds a Database and ModerationManager, snapshots them into a temp
+directory and journals a batch of later changes, then restores everything in
+a fresh process the way startup does.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.database import Database  # noqa: E402
+from app.moderation import ModerationManager  # noqa: E402
+from app.persistence import StateStore  # noqa: E402
+
+# A bcrypt hash is 60 characters; the contents do not matter here
+FAKE_HASH = "$2b$12$" + "x" * 53
+
+
+def populate(database: Database, moderation: ModerationManager, users: int, rooms: int):
+    user_ids = []
+    for i in range(users):
+        user = database.create_user(f"user{i}@example.com", f"User {i}", FAKE_HASH)
+        user_ids.append(user.id)
+    for i in range(rooms):
+        creator = user_ids[i % len(user_ids)]
+        room = database.create_room(f"Practice room {i}", "python", i % 4 != 0, 5,
+                                    creator, f"User {i}")
+        for j in range(i % 5):
+            database.add_participant(room.room_id, user_ids[(i + j) % len(user_ids)])
+        if i % 100 == 0:
+            moderation.kick_user(room.room_id, user_ids[(i + 7) % len(user_ids)])
+
+
+async def main(args):
+    directory = tempfile.mkdtemp(prefix="state-bench-")
+    database, moderation = Database(), ModerationManager()
+
+    started = time.perf_counter()
+    populate(database, moderation, args.users, args.rooms)
+    print(f"populated {args.users} users, {args.rooms} rooms "
+          f"in {time.perf_counter() - started:.2f}s")
+
+    store = StateStore(directory, database, moderation)
+    store.restore()  # empty directory: just starts journaling
+    started = time.perf_counter()
+    await store.save()
+    size = os.path.getsize(store.snapshot_path)
+    print(f"snapshot written in {time.perf_counter() - started:.2f}s, "
+          f"{size / 1e6:.1f} MB")
+
+    for i in range(args.changes):
+        database.create_user(f"late{i}-{uuid.uuid4().hex[:6]}@example.com",
+                             f"Late {i}", FAKE_HASH)
+    store.close()
+
+    sample = next(iter(database.users.values()))
+    expected = {
+        "users": len(database.users),
+        "rooms": len(database.rooms),
+        "kicks": sum(map(len, moderation.kicked_users.values())),
+        "newest_public_room": database.get_public_rooms()[0].room_id,
+        "sample": sample.model_dump(mode="json"),
+    }
+    del database, moderation
+
+    # A fresh process, as after a deploy
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, __file__, "--restore", directory],
+        check=True, capture_output=True, text=True
+    ).stdout
+    print(f"restart-to-ready {time.perf_counter() - started:.2f}s "
+          f"(interpreter start and imports included)")
+    restored = json.loads(output)
+    print(f"restored {restored['stats']}")
+    for key, value in expected.items():
+        assert restored[key] == value, key
+
+
+def restore(directory: str):
+    database, moderation = Database(), ModerationManager()
+    stats = StateStore(directory, database, moderation).restore()
+    sample = next(iter(database.users.values()))
+    assert isinstance(database.get_user_by_email(sample.email).created_at, datetime)
+    print(json.dumps({
+        "stats": stats,
+        "users": len(database.users),
+        "rooms": len(database.rooms),
+        "kicks": sum(map(len, moderation.kicked_users.values())),
+        "newest_public_room": database.get_public_rooms()[0].room_id,
+        "sample": sample.model_dump(mode="json"),
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--rooms", type=int, default=50_000)
+    parser.add_argument("--changes", type=int, default=1_000,
+                        help="users created after the snapshot, replayed from the journal")
+    parser.add_argument("--restore", metavar="DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.restore:
+        restore(args.restore)
+    else:
+        asyncio.run(main(args))
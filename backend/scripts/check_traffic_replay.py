@@ -0,0 +1,116 @@
+"""
+Record a scripted session with the traffic recorder, replay it and check
+that every request resolves its ids and gets the recorded status.
+
+    python scripts/check_traffic_replay.py
+
+The session covers the routes whose ids are easiest to lose between
+recording and replay: /liveblocks/auth (the room id is in the `room` body
+field) and /rooms/join-by-code (invite codes typed in another case or with
+spaces). Exits non-zero on any mismatch. Needs the usual backend .env
+values (SECRET_KEY etc.) in the environment. Upstreams are stubbed.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+# Must be set before the app reads its settings
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+
+from replay_traffic import Replayer, fake_upstream, load_trace  # noqa: E402
+
+
+async def record_session(client: httpx.AsyncClient):
+    """The scripted session; every request is recorded"""
+    async def signup(name: str) -> dict:
+        response = await client.post("/auth/signup", json={
+            "email": f"{name}@check.example.com", "password": "check-password",
+            "display_name": name})
+        return {"Authorization": "Bearer " + response.json()["access_token"]}
+
+    owner = await signup("owner")
+    guest = await signup("guest")
+    room = (await client.post("/rooms", headers=owner, json={
+        "title": "Replay check", "language": "python", "is_public": False})).json()
+    await client.post("/liveblocks/auth", headers=owner, json={"room": room["room_id"]})
+
+    # The same code as typed by hand; the app normalizes it
+    code = room["invite_code"]
+    await client.post("/rooms/join-by-code", headers=guest,
+                      json={"invite_code": f"  {code.lower()} "})
+    await client.post("/liveblocks/auth", headers=guest, json={"room": room["room_id"]})
+    await client.post("/rooms/join-by-code", headers=guest, json={"invite_code": "NOSUCHCODE"})
+    await client.post("/liveblocks/auth", headers=guest, json={"room": "no-such-room"})
+
+
+def check_trace(records: list) -> list:
+    """Aliases the trace must share for the replay to address the same room"""
+    problems = []
+    by_route = {}
+    for record in records:
+        by_route.setdefault(record["route"], []).append(record)
+    created = {tuple(path): alias for path, alias in by_route["/rooms"][0]["bind"]}
+    room = created.get(("room_id",))
+    invite = created.get(("invite_code",))
+
+    joined = by_route["/rooms/join-by-code"][0]["body"]["invite_code"]
+    if joined != {"$id": invite}:
+        problems.append(f"join-by-code sent {joined}, expected the created code {invite}")
+    for record in by_route["/liveblocks/auth"][:2]:
+        if record["body"]["room"] != {"$id": room}:
+            problems.append(f"/liveblocks/auth sent {record['body']['room']}, expected {room}")
+    return problems
+
+
+async def main():
+    from app.bigquery_logger import bq_logger
+    from app.main import app
+    from app.traffic import TrafficRecorder, TrafficRecorderMiddleware
+    from app.upstream import upstream
+
+    bq_logger.enabled = False
+
+    async def stub(request):
+        return await fake_upstream(request, 0)
+
+    upstream._client = httpx.AsyncClient(transport=httpx.MockTransport(stub))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "traffic.jsonl")
+        recorder = TrafficRecorder(path, max_bytes=1 << 30, backups=0)
+        recording = TrafficRecorderMiddleware(app, recorder, app.routes)
+        await app.router.startup()
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=recording),
+                                         base_url="http://record") as client:
+                await record_session(client)
+            recorder.close()
+            records = load_trace([path], scale=1)
+
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                         base_url="http://replay") as client:
+                replayer = Replayer(client, records, speed=0)
+                duration = await replayer.run()
+        finally:
+            await app.router.shutdown()
+
+    replayer.report(duration)
+    problems = check_trace(records)
+    if replayer.unresolved or replayer.errors:
+        problems.append(f"{replayer.unresolved} unresolved, {len(replayer.errors)} errors")
+    for route, recorded_status, status, _, _ in replayer.results:
+        if recorded_status != status:
+            problems.append(f"{route}: recorded {recorded_status}, replayed {status}")
+    if problems:
+        print("FAILED:\n  " + "\n  ".join(problems))
+        sys.exit(1)
+    print("OK: the replay matched the recording")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
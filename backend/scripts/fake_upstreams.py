@@ -0,0 +1,102 @@
+"""
+Local stand-in for the Liveblocks and Daily.co APIs with fault injection,
+for exercising the backend's timeouts, hedging and circuit breakers.
+
+Run it and point the backend at it:
+
+    python scripts/fake_upstreams.py --port 9000
+    LIVEBLOCKS_API_URL=http://localhost:9000 DAILY_API_URL=http://localhost:9000 \\
+        uvicorn app.main:app --port 8000
+
+Faults can be changed while it runs, per service ("liveblocks" or "daily"):
+
+    curl -X POST localhost:9000/_faults/daily \\
+        -H 'Content-Type: application/json' \\
+        -d '{"latency_ms": 50, "slow_rate": 0.1, "slow_latency_ms": 3000, "error_rate": 0.2}'
+"""
+import argparse
+import asyncio
+import random
+import uuid
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+class Faults(BaseModel):
+    latency_ms: float = 20  # every request
+    slow_rate: float = 0.0  # fraction of requests delayed by slow_latency_ms instead
+    slow_latency_ms: float = 5000
+    error_rate: float = 0.0  # fraction answered with HTTP 500
+    hang_rate: float = 0.0  # fraction that never answer
+
+
+faults = {"liveblocks": Faults(), "daily": Faults()}
+counters = {"liveblocks": 0, "daily": 0}
+daily_rooms = set()
+
+app = FastAPI(title="Fake upstreams")
+
+
+async def inject(service: str):
+    """Apply the configured faults; returns an error response or None"""
+    counters[service] += 1
+    config = faults[service]
+    if random.random() < config.hang_rate:
+        await asyncio.Event().wait()
+    slow = random.random() < config.slow_rate
+    await asyncio.sleep((config.slow_latency_ms if slow else config.latency_ms) / 1000)
+    if random.random() < config.error_rate:
+        return JSONResponse({"error": "injected failure"}, status_code=500)
+    return None
+
+
+@app.post("/_faults/{service}")
+async def set_faults(service: str, config: Faults):
+    if service not in faults:
+        raise HTTPException(status_code=404, detail="Unknown service")
+    faults[service] = config
+    return {"service": service, "faults": config}
+
+
+@app.get("/_stats")
+async def stats():
+    return {"requests": counters, "faults": faults}
+
+
+@app.post("/v2/rooms/{room_id}/authorize")
+async def liveblocks_authorize(room_id: str):
+    error = await inject("liveblocks")
+    if error:
+        return error
+    return {"token": f"fake-liveblocks-{room_id}-{uuid.uuid4().hex[:8]}"}
+
+
+@app.post("/v1/rooms")
+async def daily_create_room(body: dict):
+    error = await inject("daily")
+    if error:
+        return error
+    name = body.get("name")
+    if name in daily_rooms:
+        return JSONResponse({"error": "room already exists"}, status_code=409)
+    daily_rooms.add(name)
+    return {"name": name}
+
+
+@app.post("/v1/meeting-tokens")
+async def daily_meeting_token():
+    error = await inject("daily")
+    if error:
+        return error
+    return {"token": f"fake-daily-{uuid.uuid4().hex}"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
@@ -0,0 +1,345 @@
+"""
+Replay a recorded traffic trace against the app in-process.
+
+Record with TRAFFIC_RECORD_PATH set on the server, then:
+
+    python scripts/replay_traffic.py traffic.jsonl.2 traffic.jsonl.1 traffic.jsonl
+    python scripts/replay_traffic.py traffic.jsonl --speed 10 --scale 20
+
+Requests go through httpx's ASGI transport, so no server or network is
+involved. Liveblocks and Daily.co are stubbed, BigQuery and state
+persistence are off, and rate limiting is off unless --rate-limit is given.
+
+Each recorded user and room becomes a replay user and room. Users are
+signed up on first use. Rooms are created by the replayed requests that
+created them in the recording, or on first use if they existed before the
+recording started. Requests of one user run in recorded order; everything
+else follows the recorded timing divided by --speed. --scale N replays N
+copies of the trace with separate users and rooms, interleaved.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+# Must be set before the app reads its settings
+os.environ["STATE_DIR"] = ""
+os.environ["TRAFFIC_RECORD_PATH"] = ""
+os.environ.setdefault("LOG_FILE", os.devnull)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+from jose import jwt  # noqa: E402
+
+PASSWORD = "replay-password"
+FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit "
+
+
+def load_trace(paths: List[str], scale: int) -> List[dict]:
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    if scale > 1:
+        copies = []
+        for copy in range(scale):
+            suffix = f"~{copy}" if copy else ""
+            for record in records:
+                cloned = _rename_aliases(record, suffix)
+                cloned["t"] = record["t"] + copy * 0.001  # deterministic interleaving
+                copies.append(cloned)
+        records = copies
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+def _rename_aliases(value, suffix: str):
+    if not suffix:
+        return json.loads(json.dumps(value))
+    if isinstance(value, dict):
+        if set(value) == {"$id"}:
+            return {"$id": value["$id"] + suffix}
+        renamed = {k: _rename_aliases(v, suffix) for k, v in value.items()}
+        if isinstance(value.get("user"), str):
+            renamed["user"] = value["user"] + suffix
+        if "bind" in value:
+            renamed["bind"] = [[path, alias + suffix] for path, alias in value["bind"]]
+        return renamed
+    if isinstance(value, list):
+        return [_rename_aliases(v, suffix) for v in value]
+    return value
+
+
+async def fake_upstream(request: httpx.Request, latency: float) -> httpx.Response:
+    await asyncio.sleep(latency)
+    path = request.url.path
+    if path.endswith("/authorize"):
+        return httpx.Response(200, json={"token": "replay-liveblocks-token"})
+    if path == "/v1/rooms":
+        return httpx.Response(200, json={"name": json.loads(request.content)["name"]})
+    if path == "/v1/meeting-tokens":
+        return httpx.Response(200, json={"token": "replay-daily-token"})
+    return httpx.Response(404, json={"error": "not stubbed"})
+
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, records: List[dict], speed: float):
+        self.client = client
+        self.records = records
+        self.speed = speed
+        self.values: Dict[str, str] = {}  # alias -> real value in this replay
+        self.bound: Dict[str, asyncio.Event] = {}
+        self.tokens: Dict[str, str] = {}  # user alias -> access token
+        self.user_setup: Dict[str, asyncio.Lock] = {}
+        self.last_task_of_user: Dict[str, asyncio.Task] = {}
+        self.results: List[tuple] = []  # (route, recorded status, status, recorded ms, ms)
+        self.unresolved = 0
+        self.errors: List[BaseException] = []
+
+        # Which record first binds each alias; earlier uses mean it pre-dates the recording
+        self.binder_index: Dict[str, int] = {}
+        # Aliases some request succeeded with; the others never existed
+        self.existing: set = set()
+        for index, record in enumerate(records):
+            for _, alias in record.get("bind", []):
+                self.binder_index.setdefault(alias, index)
+            if record["status"] < 400:
+                for part in ("params", "query", "body"):
+                    self.existing.update(_aliases(record[part]))
+
+    async def run(self):
+        started = time.monotonic()
+        tasks = []
+        for index, record in enumerate(self.records):
+            if self.speed > 0:
+                delay = started + record["t"] / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            user = record.get("user")
+            previous = self.last_task_of_user.get(user) if user else None
+            task = asyncio.ensure_future(self._replay(index, record, previous))
+            if user:
+                self.last_task_of_user[user] = task
+            tasks.append(task)
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        self.errors = [o for o in outcomes if isinstance(o, BaseException)]
+        return time.monotonic() - started
+
+    async def _replay(self, index: int, record: dict, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait({previous})
+        route = record["route"]
+        if route is None:
+            return
+
+        if route in ("/auth/signup", "/auth/login"):
+            if record.get("user") and record["status"] < 300:
+                await self._replay_auth(route, record["user"], record)
+            return
+
+        headers = {}
+        if record.get("user"):
+            headers["Authorization"] = "Bearer " + await self._token(record["user"])
+        try:
+            params = {k: await self._value(v, index, k) for k, v in record["params"].items()}
+            query = {k: await self._value(v, index, k) for k, v in record["query"].items()}
+            body = await self._value(record["body"], index) if record["body"] is not None else None
+        except LookupError:
+            self.unresolved += 1
+            return
+
+        path = route.format(**params)
+        started = time.monotonic()
+        response = await self.client.request(
+            record["method"], path, params=query or None, headers=headers,
+            json=body if not (isinstance(body, dict) and "$bytes" in body) else None
+        )
+        self._finish(record, response, started)
+
+    async def _replay_auth(self, route: str, alias: str, record: dict):
+        async with self.user_setup.setdefault(alias, asyncio.Lock()):
+            if route == "/auth/login" and alias not in self.tokens:
+                await self._signup(alias)
+            started = time.monotonic()
+            if route == "/auth/signup" and alias not in self.tokens:
+                response = await self.client.post("/auth/signup", json=self._credentials(alias))
+            else:
+                response = await self.client.post("/auth/login", json={
+                    "email": self._credentials(alias)["email"], "password": PASSWORD})
+            self._finish(record, response, started)
+            if response.status_code < 300:
+                self._store_token(alias, response.json()["access_token"])
+
+    def _finish(self, record: dict, response: httpx.Response, started: float):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        self.results.append((record["method"] + " " + record["route"], record["status"],
+                             response.status_code, record["ms"], elapsed_ms))
+        if record.get("bind") and response.headers.get("content-type", "").startswith(
+                "application/json"):
+            data = response.json()
+            for path, alias in record["bind"]:
+                value = _at_path(data, path)
+                if isinstance(value, str) and path != ["access_token"]:
+                    self._bind(alias, value)
+
+    def _bind(self, alias: str, value: str):
+        self.values.setdefault(alias, value)
+        self.bound.setdefault(alias, asyncio.Event()).set()
+
+    # Identities
+
+    @staticmethod
+    def _credentials(alias: str) -> dict:
+        return {"email": f"{alias.replace('~', '-')}@replay.example.com",
+                "password": PASSWORD, "display_name": f"Replay {alias}"}
+
+    async def _signup(self, alias: str):
+        response = await self.client.post("/auth/signup", json=self._credentials(alias))
+        if response.status_code >= 300:
+            response = await self.client.post("/auth/login", json={
+                "email": self._credentials(alias)["email"], "password": PASSWORD})
+        self._store_token(alias, response.json()["access_token"])
+
+    def _store_token(self, alias: str, token: str):
+        self.tokens[alias] = token
+        self._bind(alias, jwt.get_unverified_claims(token)["sub"])
+
+    async def _token(self, alias: str) -> str:
+        async with self.user_setup.setdefault(alias, asyncio.Lock()):
+            if alias not in self.tokens:
+                await self._signup(alias)
+        return self.tokens[alias]
+
+    async def _resolve(self, alias: str, index: int) -> str:
+        if alias in self.values:
+            return self.values[alias]
+        binder = self.binder_index.get(alias)
+        if binder is not None and binder < index:
+            # Created by an earlier replayed request that may still be in flight
+            try:
+                await asyncio.wait_for(self.bound.setdefault(alias, asyncio.Event()).wait(), 30)
+            except asyncio.TimeoutError:
+                raise LookupError(alias)
+            return self.values[alias]
+
+        # Existed before the recording started
+        kind = alias[0]
+        if kind == "u":
+            await self._token(alias)
+        elif kind == "r" and alias in self.existing:
+            async with self.user_setup.setdefault(alias, asyncio.Lock()):
+                if alias not in self.values:
+                    owner = "u0" + alias[alias.find("~"):] if "~" in alias else "u0"
+                    response = await self.client.post(
+                        "/rooms", headers={"Authorization": "Bearer " + await self._token(owner)},
+                        json={"title": f"Replay room {alias}", "language": "python",
+                              "is_public": True, "max_users": 10})
+                    self._bind(alias, response.json()["room_id"])
+        else:
+            # A room that was never found, or an invite code never issued during
+            # the recording: replay it as a wrong one
+            return f"unknown-{alias}"
+        return self.values[alias]
+
+    async def _value(self, shaped, index: int, key: Optional[str] = None):
+        if isinstance(shaped, dict):
+            if set(shaped) == {"$id"}:
+                return await self._resolve(shaped["$id"], index)
+            if set(shaped) == {"$str"}:
+                return (FILLER * (shaped["$str"] // len(FILLER) + 1))[:shaped["$str"]]
+            return {k: await self._value(v, index, k) for k, v in shaped.items()}
+        if isinstance(shaped, list):
+            return [await self._value(v, index, key) for v in shaped]
+        return shaped
+
+    # Report
+
+    def report(self, duration: float):
+        by_route: Dict[str, list] = {}
+        for route, recorded_status, status, recorded_ms, ms in self.results:
+            by_route.setdefault(route, []).append((recorded_status, status, recorded_ms, ms))
+
+        print(f"{len(self.results)} requests in {duration:.2f}s "
+              f"({len(self.results) / max(duration, 1e-9):.0f}/s), "
+              f"{self.unresolved} skipped with unresolvable ids, {len(self.errors)} errors")
+        for error in self.errors[:5]:
+            print(f"  {type(error).__name__}: {error}")
+        print(f"{'route':<42} {'count':>6} {'status≠':>8} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'rec p50':>8} {'rec p99':>8}")
+        for route, rows in sorted(by_route.items(), key=lambda item: -len(item[1])):
+            mismatched = sum(1 for recorded, status, _, _ in rows if recorded != status)
+            print(f"{route:<42} {len(rows):>6} {mismatched:>8} "
+                  f"{_percentile([r[3] for r in rows], 0.5):>8.2f} "
+                  f"{_percentile([r[3] for r in rows], 0.99):>8.2f} "
+                  f"{_percentile([r[2] for r in rows], 0.5):>8.2f} "
+                  f"{_percentile([r[2] for r in rows], 0.99):>8.2f}")
+
+
+def _aliases(shaped):
+    if isinstance(shaped, dict):
+        if set(shaped) == {"$id"}:
+            yield shaped["$id"]
+        else:
+            for value in shaped.values():
+                yield from _aliases(value)
+    elif isinstance(shaped, list):
+        for value in shaped:
+            yield from _aliases(value)
+
+
+def _at_path(data, path: list):
+    for step in path:
+        try:
+            data = data[step]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return data
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def main(args):
+    from app.main import app
+    from app.bigquery_logger import bq_logger
+    from app.upstream import upstream
+
+    bq_logger.enabled = False
+
+    async def stub(request):
+        return await fake_upstream(request, args.upstream_latency_ms / 1000)
+
+    upstream._client = httpx.AsyncClient(transport=httpx.MockTransport(stub))
+
+    records = load_trace(args.trace, args.scale)
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay") as client:
+            replayer = Replayer(client, records, args.speed)
+            duration = await replayer.run()
+    finally:
+        await app.router.shutdown()
+    replayer.report(duration)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("trace", nargs="+", help="trace files, oldest first")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time compression; 0 sends everything as fast as possible")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="replay this many copies of the trace with distinct users")
+    parser.add_argument("--upstream-latency-ms", type=float, default=20.0)
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep per-route rate limits on")
+    args = parser.parse_args()
+    if not args.rate_limit:
+        os.environ["RATE_LIMIT_ENABLED"] = "false"
+    asyncio.run(main(args))
@@ -45,8 +45,9 @@ OPTIONS (
 );
 
 -- Table 3: Reports
--- User reports for moderation
-CREATE OR REPLACE TABLE `your-project-id.binarysearch.reports` (
+-- User reports for moderation, one row per report. No longer written since
+-- reports are triaged into cases (Table 5); kept for existing history
+CREATE TABLE IF NOT EXISTS `your-project-id.binarysearch.reports` (
   report_id STRING NOT NULL,
   reporter_id STRING NOT NULL,
   reported_user_id STRING NOT NULL,
@@ -82,6 +83,30 @@ OPTIONS (
   labels = [("app", "binarysearch")]
 );
 
+-- Table 5: Report Cases
+-- User reports for moderation, one row per triaged case: all reports about
+-- one user in one room until the case is auto-kicked or goes quiet.
+-- A new table rather than a change to `reports`, so creating it on an
+-- existing dataset keeps the report history
+CREATE TABLE IF NOT EXISTS `your-project-id.binarysearch.report_cases` (
+  report_id STRING NOT NULL,
+  reported_user_id STRING NOT NULL,
+  room_id STRING NOT NULL,
+  reporter_ids STRING NOT NULL,  -- JSON array of distinct reporters
+  report_count INT64 NOT NULL,  -- distinct reporters
+  duplicate_count INT64 NOT NULL,  -- repeat reports by the same reporter
+  reasons STRING NOT NULL,  -- JSON array of the first distinct reasons
+  first_reported_at TIMESTAMP NOT NULL,
+  timestamp TIMESTAMP NOT NULL,  -- last counted report
+  status STRING NOT NULL  -- pending | auto_kicked
+)
+PARTITION BY DATE(timestamp)
+CLUSTER BY reported_user_id, status
+OPTIONS (
+  description = "Triaged user report cases for moderation",
+  labels = [("app", "binarysearch")]
+);
+
 -- ========================================
 -- Example Queries
 -- ========================================
@@ -121,14 +146,19 @@ OPTIONS (
 -- GROUP BY date
 -- ORDER BY date DESC;
 
--- Query 4: Pending reports for moderation
+-- Query 4: Report cases awaiting review (not auto-kicked), most reported first
 -- SELECT
 --   report_id,
 --   reported_user_id,
 --   room_id,
---   reason,
---   timestamp,
+--   report_count,
+--   duplicate_count,
+--   reporter_ids,
+--   reasons,
+--   first_reported_at,
+--   timestamp AS last_reported_at,
 --   status
--- FROM `your-project-id.binarysearch.reports`
+-- FROM `your-project-id.binarysearch.report_cases`
 -- WHERE status = 'pending'
--- ORDER BY timestamp DESC;
+--   AND DATE(timestamp) >= DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
+-- ORDER BY report_count DESC, timestamp DESC;
@@ -1,10 +1,14 @@
+import { lazy, Suspense } from 'react';
 import { BrowserRouter, Routes, Route, Navigate } from 'react-router-dom';
 import { AuthProvider, useAuth } from '@/lib/AuthContext';
 import { Toaster } from '@/components/ui/toaster';
 import Login from '@/pages/Login';
 import Signup from '@/pages/Signup';
 import Lobby from '@/pages/Lobby';
-import Room from '@/pages/Room';
+import { loadRoomPage } from '@/lib/prefetch';
+
+// Kept out of the main bundle with Liveblocks and the editor
+const Room = lazy(loadRoomPage);
 
 function PrivateRoute({ children }) {
   const { user, loading } = useAuth();
@@ -67,7 +71,15 @@ function App() {
             path="/room/:roomId"
             element={
               <PrivateRoute>
-                <Room />
+                <Suspense
+                  fallback={
+                    <div className="h-screen flex items-center justify-center">
+                      <p className="text-muted-foreground">Loading room...</p>
+                    </div>
+                  }
+                >
+                  <Room />
+                </Suspense>
               </PrivateRoute>
             }
           />
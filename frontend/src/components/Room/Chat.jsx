@@ -1,23 +1,53 @@
 import { useState, useEffect, useRef } from 'react';
 import { useRoom } from '@/lib/liveblocks';
+import { api } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { ScrollArea } from '@/components/ui/scroll-area';
 import { Send } from 'lucide-react';
 import { formatDistanceToNow } from 'date-fns';
 
-export default function Chat({ currentUser }) {
+const toChatMessage = (message) => ({
+  id: message.id,
+  text: message.text,
+  userId: message.user_id,
+  userName: message.user_name,
+  timestamp: message.timestamp,
+});
+
+// Merge messages by id, keeping them in server order
+const mergeMessages = (current, incoming) => {
+  const byId = new Map(current.map((msg) => [msg.id, msg]));
+  incoming.forEach((msg) => byId.set(msg.id, msg));
+  return [...byId.values()].sort((a, b) => a.id - b.id);
+};
+
+export default function Chat({ roomId, currentUser }) {
   const room = useRoom();
   const [messages, setMessages] = useState([]);
+  const [nextBefore, setNextBefore] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [inputMessage, setInputMessage] = useState('');
   const scrollRef = useRef(null);
+  const stickToBottomRef = useRef(true);
+
+  useEffect(() => {
+    // Load recent history so late joiners see the conversation
+    api.getMessages(roomId)
+      .then((page) => {
+        setMessages((prev) => mergeMessages(prev, page.messages.map(toChatMessage)));
+        setNextBefore(page.next_before);
+      })
+      .catch((error) => console.error('Failed to load chat history:', error));
+  }, [roomId]);
 
   useEffect(() => {
     if (!room) return;
 
     // Subscribe to broadcast events for chat messages
     const unsubscribe = room.subscribe('chat-message', (message) => {
-      setMessages((prev) => [...prev, message]);
+      stickToBottomRef.current = true;
+      setMessages((prev) => mergeMessages(prev, [message]));
     });
 
     return unsubscribe;
@@ -25,26 +55,40 @@ export default function Chat({ currentUser }) {
 
   useEffect(() => {
     // Auto-scroll to bottom when new messages arrive
-    if (scrollRef.current) {
+    if (scrollRef.current && stickToBottomRef.current) {
       scrollRef.current.scrollTop = scrollRef.current.scrollHeight;
     }
   }, [messages]);
 
-  const sendMessage = (e) => {
+  const loadOlderMessages = async () => {
+    setLoadingOlder(true);
+    try {
+      const page = await api.getMessages(roomId, nextBefore);
+      stickToBottomRef.current = false;
+      setMessages((prev) => mergeMessages(prev, page.messages.map(toChatMessage)));
+      setNextBefore(page.next_before);
+    } catch (error) {
+      console.error('Failed to load older messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
+  const sendMessage = async (e) => {
     e.preventDefault();
     if (!inputMessage.trim()) return;
 
-    const message = {
-      id: Date.now().toString(),
-      text: inputMessage,
-      userId: currentUser.id,
-      userName: currentUser.display_name,
-      timestamp: new Date().toISOString(),
-    };
-
-    room.broadcastEvent({ type: 'chat-message', ...message });
-    setMessages((prev) => [...prev, message]);
+    const text = inputMessage;
     setInputMessage('');
+    try {
+      const message = toChatMessage(await api.postMessage(roomId, text));
+      room.broadcastEvent({ type: 'chat-message', ...message });
+      stickToBottomRef.current = true;
+      setMessages((prev) => mergeMessages(prev, [message]));
+    } catch (error) {
+      console.error('Failed to send message:', error);
+      setInputMessage(text);
+    }
   };
 
   return (
@@ -54,6 +98,17 @@ export default function Chat({ currentUser }) {
       </div>
 
       <div ref={scrollRef} className="flex-1 overflow-y-auto p-4 space-y-3">
+        {nextBefore && (
+          <Button
+            variant="ghost"
+            size="sm"
+            className="w-full"
+            onClick={loadOlderMessages}
+            disabled={loadingOlder}
+          >
+            {loadingOlder ? 'Loading...' : 'Load earlier messages'}
+          </Button>
+        )}
         {messages.length === 0 ? (
           <p className="text-sm text-muted-foreground text-center py-8">
             No messages yet. Start the conversation!
@@ -1,10 +1,31 @@
 import { useEffect, useRef } from 'react';
 import Editor from '@monaco-editor/react';
 import { useStorage, useMutation } from '@/lib/liveblocks';
+import { api } from '@/lib/api';
 
-export default function CodeEditor({ language }) {
+const SNAPSHOT_INTERVAL_MS = 30000;
+
+export default function CodeEditor({ roomId, language }) {
   const editorRef = useRef(null);
   const code = useStorage((root) => root.code) || '';
+  const codeRef = useRef(code);
+  const lastSnapshotRef = useRef(null);
+  codeRef.current = code;
+
+  useEffect(() => {
+    // Periodically save a server-side copy; unchanged code is skipped here
+    // and deduplicated on the server if another participant already saved it
+    const interval = setInterval(() => {
+      if (codeRef.current === lastSnapshotRef.current) return;
+      const snapshot = codeRef.current;
+      api.saveSnapshot(roomId, snapshot)
+        .then(() => {
+          lastSnapshotRef.current = snapshot;
+        })
+        .catch((error) => console.error('Failed to save snapshot:', error));
+    }, SNAPSHOT_INTERVAL_MS);
+    return () => clearInterval(interval);
+  }, [roomId]);
 
   const updateCode = useMutation(({ storage }, newCode) => {
     storage.set('code', newCode);
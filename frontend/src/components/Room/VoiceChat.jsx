@@ -1,25 +1,22 @@
 import { useState, useEffect, useRef } from 'react';
 import { api } from '@/lib/api';
+import { loadDaily } from '@/lib/prefetch';
 import { Button } from '@/components/ui/button';
 import { useToast } from '@/components/ui/use-toast';
 import { Mic, MicOff, Phone, PhoneOff } from 'lucide-react';
 
-export default function VoiceChat({ roomId, currentUser }) {
+export default function VoiceChat({ roomId, prefetchedToken, currentUser }) {
   const [inVoice, setInVoice] = useState(false);
   const [muted, setMuted] = useState(false);
   const [loading, setLoading] = useState(false);
   const callFrameRef = useRef(null);
   const containerRef = useRef(null);
+  const prefetchedTokenRef = useRef(prefetchedToken);
   const { toast } = useToast();
 
   useEffect(() => {
-    // Load Daily.co script
-    if (!window.DailyIframe) {
-      const script = document.createElement('script');
-      script.src = 'https://unpkg.com/@daily-co/daily-js';
-      script.async = true;
-      document.body.appendChild(script);
-    }
+    // Load Daily.co script (already loading if the lobby prefetched it)
+    loadDaily().catch(() => {});
 
     return () => {
       if (callFrameRef.current) {
@@ -31,15 +28,19 @@ export default function VoiceChat({ roomId, currentUser }) {
   const joinVoice = async () => {
     setLoading(true);
     try {
-      const { token, room_url } = await api.getDailyToken(roomId);
-
-      // Wait for Daily script to load
-      while (!window.DailyIframe) {
-        await new Promise(resolve => setTimeout(resolve, 100));
+      // Use the token minted on room entry once, then ask for fresh ones
+      const prefetched = prefetchedTokenRef.current;
+      prefetchedTokenRef.current = null;
+      const { token, room_url } = prefetched || await api.getDailyToken(roomId);
+      if (prefetched) {
+        // /daily/token logs this itself
+        api.logEvent('voice_join', currentUser.id, roomId).catch(() => {});
       }
 
+      const DailyIframe = await loadDaily();
+
       // Create call frame
-      callFrameRef.current = window.DailyIframe.createFrame(containerRef.current, {
+      callFrameRef.current = DailyIframe.createFrame(containerRef.current, {
         showLeaveButton: false,
         showFullscreenButton: false,
         iframeStyle: {
@@ -67,7 +67,14 @@ export const api = {
       }),
     }),
 
-  listRooms: () => fetchAPI('/rooms'),
+  listRooms: ({ query, language, hasSlots } = {}) => {
+    const params = new URLSearchParams();
+    if (query) params.set('q', query);
+    if (language) params.set('language', language);
+    if (hasSlots) params.set('has_slots', 'true');
+    const search = params.toString();
+    return fetchAPI(`/rooms${search ? `?${search}` : ''}`);
+  },
 
   getRoom: (roomId) => fetchAPI(`/rooms/${roomId}`),
 
@@ -77,6 +84,18 @@ export const api = {
       body: JSON.stringify({ invite_code: inviteCode }),
     }),
 
+  joinRoomByCode: (inviteCode) =>
+    fetchAPI('/rooms/join-by-code', {
+      method: 'POST',
+      body: JSON.stringify({ invite_code: inviteCode }),
+    }),
+
+  enterRoom: (roomId, inviteCode = null) =>
+    fetchAPI(`/rooms/${roomId}/enter`, {
+      method: 'POST',
+      body: JSON.stringify({ invite_code: inviteCode }),
+    }),
+
   leaveRoom: (roomId) =>
     fetchAPI(`/rooms/${roomId}/leave`, {
       method: 'POST',
@@ -84,6 +103,28 @@ export const api = {
 
   quickJoin: () => fetchAPI('/rooms/quick-join/find'),
 
+  // Chat
+  getMessages: (roomId, before = null) =>
+    fetchAPI(`/rooms/${roomId}/messages${before ? `?before=${before}` : ''}`),
+
+  postMessage: (roomId, text) =>
+    fetchAPI(`/rooms/${roomId}/messages`, {
+      method: 'POST',
+      body: JSON.stringify({ text }),
+    }),
+
+  // Code snapshots
+  saveSnapshot: (roomId, code) =>
+    fetchAPI(`/rooms/${roomId}/snapshots`, {
+      method: 'POST',
+      body: JSON.stringify({ code }),
+    }),
+
+  listSnapshots: (roomId) => fetchAPI(`/rooms/${roomId}/snapshots`),
+
+  getSnapshot: (roomId, version = 'latest') =>
+    fetchAPI(`/rooms/${roomId}/snapshots/${version}`),
+
   // Liveblocks
   getLiveblocksToken: (room) =>
     fetchAPI('/liveblocks/auth', {
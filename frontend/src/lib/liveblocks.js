@@ -1,11 +1,25 @@
 import { createClient } from '@liveblocks/client';
 import { createRoomContext } from '@liveblocks/react';
 
+// Tokens already returned by POST /rooms/{id}/enter, used once instead of
+// a separate /liveblocks/auth round trip
+const prefetchedTokens = new Map();
+
+export function primeLiveblocksToken(room, authResponse) {
+  prefetchedTokens.set(room, authResponse);
+}
+
 const client = createClient({
   publicApiKey: import.meta.env.VITE_LIVEBLOCKS_PUBLIC_KEY,
 
   // Optional: Use auth endpoint for better security
   authEndpoint: async (room) => {
+    if (prefetchedTokens.has(room)) {
+      const authResponse = prefetchedTokens.get(room);
+      prefetchedTokens.delete(room);
+      return authResponse;
+    }
+
     const token = localStorage.getItem('token');
     const response = await fetch(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/liveblocks/auth`, {
       method: 'POST',
@@ -0,0 +1,60 @@
+// The room page, Liveblocks and the editor are split out of the main bundle
+// (see vite.config.js), and Monaco and Daily.co load from their CDNs. Each
+// loader runs once and is shared by React.lazy and the lobby's prefetching,
+// so a chunk fetched on hover is not fetched again on navigation.
+
+const DAILY_SCRIPT_URL = 'https://unpkg.com/@daily-co/daily-js';
+
+function once(load) {
+  let promise = null;
+  return () => {
+    if (!promise) {
+      // Forget failures so the next call retries
+      promise = load().catch((error) => {
+        promise = null;
+        throw error;
+      });
+    }
+    return promise;
+  };
+}
+
+export const loadRoomPage = once(() => import('@/pages/Room'));
+
+export const loadCodeEditor = once(() => import('@/components/Room/CodeEditor'));
+
+export const loadMonaco = once(() =>
+  import('@monaco-editor/react').then(({ loader }) => loader.init())
+);
+
+export const loadDaily = once(() => {
+  if (window.DailyIframe) {
+    return Promise.resolve(window.DailyIframe);
+  }
+  return new Promise((resolve, reject) => {
+    const script = document.createElement('script');
+    script.src = DAILY_SCRIPT_URL;
+    script.async = true;
+    script.onload = () => resolve(window.DailyIframe);
+    script.onerror = () => {
+      script.remove();
+      reject(new Error('Failed to load voice chat'));
+    };
+    document.body.appendChild(script);
+  });
+});
+
+const ignore = () => {};
+
+// Pointer over or focus on a way into a room: fetch the JS chunks only
+export function prefetchRoom() {
+  loadRoomPage().catch(ignore);
+  loadCodeEditor().catch(ignore);
+}
+
+// About to navigate into a room: also start Monaco and Daily.co
+export function warmRoom() {
+  prefetchRoom();
+  loadMonaco().catch(ignore);
+  loadDaily().catch(ignore);
+}
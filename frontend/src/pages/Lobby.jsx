@@ -1,7 +1,8 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useAuth } from '@/lib/AuthContext';
 import { api } from '@/lib/api';
+import { prefetchRoom, warmRoom } from '@/lib/prefetch';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardDescription, CardFooter, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogDescription, DialogFooter, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -9,7 +10,7 @@ import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 import { useToast } from '@/components/ui/use-toast';
-import { Users, Clock, Code, Plus, Zap, LogOut } from 'lucide-react';
+import { Users, Clock, Code, Plus, Zap, LogOut, Key } from 'lucide-react';
 import { formatDistanceToNow } from 'date-fns';
 
 export default function Lobby() {
@@ -17,9 +18,14 @@ export default function Lobby() {
   const [loading, setLoading] = useState(true);
   const [createDialogOpen, setCreateDialogOpen] = useState(false);
   const [quickJoining, setQuickJoining] = useState(false);
+  const [inviteCode, setInviteCode] = useState('');
   const { user, logout } = useAuth();
   const navigate = useNavigate();
   const { toast } = useToast();
+  // Start of the lobby-interactive measure: now, not navigation start, so
+  // time spent on the login page is not counted
+  const mountedAt = useRef(performance.now());
+  const measured = useRef(false);
 
   // Create room form
   const [title, setTitle] = useState('');
@@ -27,25 +33,43 @@ export default function Lobby() {
   const [isPublic, setIsPublic] = useState(true);
   const [maxUsers, setMaxUsers] = useState(6);
 
+  // Room filters (applied server-side)
+  const [searchQuery, setSearchQuery] = useState('');
+  const [filterLanguage, setFilterLanguage] = useState('all');
+  const [onlyWithSlots, setOnlyWithSlots] = useState(false);
+
   useEffect(() => {
-    loadRooms();
+    const timeout = setTimeout(loadRooms, 250); // Debounce typing in the search box
     const interval = setInterval(loadRooms, 5000); // Refresh every 5 seconds
-    return () => clearInterval(interval);
-  }, []);
+    return () => {
+      clearTimeout(timeout);
+      clearInterval(interval);
+    };
+  }, [searchQuery, filterLanguage, onlyWithSlots]);
 
   const loadRooms = async () => {
     try {
-      const data = await api.listRooms();
+      const data = await api.listRooms({
+        query: searchQuery.trim(),
+        language: filterLanguage === 'all' ? null : filterLanguage,
+        hasSlots: onlyWithSlots,
+      });
       setRooms(data);
     } catch (error) {
       console.error('Failed to load rooms:', error);
     } finally {
       setLoading(false);
+      // Time from the lobby mounting to a usable lobby, shown in DevTools > Performance
+      if (!measured.current) {
+        measured.current = true;
+        performance.measure('lobby-interactive', { start: mountedAt.current });
+      }
     }
   };
 
   const handleCreateRoom = async (e) => {
     e.preventDefault();
+    warmRoom();
     try {
       const room = await api.createRoom(title, language, isPublic, maxUsers);
       toast({
@@ -65,6 +89,7 @@ export default function Lobby() {
 
   const handleQuickJoin = async () => {
     setQuickJoining(true);
+    warmRoom();
     try {
       const result = await api.quickJoin();
       toast({
@@ -83,19 +108,27 @@ export default function Lobby() {
     }
   };
 
-  const handleJoinRoom = async (roomId) => {
+  const handleJoinByCode = async (e) => {
+    e.preventDefault();
+    warmRoom();
     try {
-      await api.joinRoom(roomId);
-      navigate(`/room/${roomId}`);
+      const result = await api.joinRoomByCode(inviteCode.trim());
+      navigate(`/room/${result.room.room_id}`);
     } catch (error) {
       toast({
-        title: 'Failed to join room',
+        title: 'Could not join room',
         description: error.message,
         variant: 'destructive',
       });
     }
   };
 
+  const handleJoinRoom = (roomId) => {
+    // The room page joins via POST /rooms/{id}/enter
+    warmRoom();
+    navigate(`/room/${roomId}`);
+  };
+
   return (
     <div className="min-h-screen bg-gradient-to-br from-slate-50 to-slate-100">
       {/* Header */}
@@ -121,6 +154,8 @@ export default function Lobby() {
             size="lg"
             className="h-24 text-lg"
             onClick={handleQuickJoin}
+            onPointerEnter={prefetchRoom}
+            onFocus={prefetchRoom}
             disabled={quickJoining}
           >
             <Zap className="w-6 h-6 mr-2" />
@@ -129,7 +164,13 @@ export default function Lobby() {
 
           <Dialog open={createDialogOpen} onOpenChange={setCreateDialogOpen}>
             <DialogTrigger asChild>
-              <Button size="lg" variant="outline" className="h-24 text-lg">
+              <Button
+                size="lg"
+                variant="outline"
+                className="h-24 text-lg"
+                onPointerEnter={prefetchRoom}
+                onFocus={prefetchRoom}
+              >
                 <Plus className="w-6 h-6 mr-2" />
                 Create Room
               </Button>
@@ -205,9 +246,53 @@ export default function Lobby() {
           </Dialog>
         </div>
 
+        {/* Join a private room by invite code */}
+        <form onSubmit={handleJoinByCode} className="flex gap-2 mb-8 md:max-w-md">
+          <Input
+            placeholder="Have an invite code?"
+            value={inviteCode}
+            onChange={(e) => setInviteCode(e.target.value)}
+            className="uppercase"
+            required
+          />
+          <Button type="submit" variant="secondary" onPointerEnter={prefetchRoom} onFocus={prefetchRoom}>
+            <Key className="w-4 h-4 mr-2" />
+            Join
+          </Button>
+        </form>
+
         {/* Rooms List */}
         <div>
           <h2 className="text-2xl font-bold mb-4">Active Public Rooms</h2>
+          <div className="flex flex-col md:flex-row gap-4 mb-4">
+            <Input
+              placeholder="Search rooms by title..."
+              value={searchQuery}
+              onChange={(e) => setSearchQuery(e.target.value)}
+              className="md:max-w-sm"
+            />
+            <Select value={filterLanguage} onValueChange={setFilterLanguage}>
+              <SelectTrigger className="md:w-48">
+                <SelectValue />
+              </SelectTrigger>
+              <SelectContent>
+                <SelectItem value="all">All languages</SelectItem>
+                <SelectItem value="javascript">JavaScript</SelectItem>
+                <SelectItem value="python">Python</SelectItem>
+                <SelectItem value="java">Java</SelectItem>
+                <SelectItem value="cpp">C++</SelectItem>
+                <SelectItem value="go">Go</SelectItem>
+                <SelectItem value="rust">Rust</SelectItem>
+              </SelectContent>
+            </Select>
+            <Button
+              variant={onlyWithSlots ? 'default' : 'outline'}
+              onClick={() => setOnlyWithSlots(!onlyWithSlots)}
+            >
+              <Users className="w-4 h-4 mr-2" />
+              Has free slots
+            </Button>
+          </div>
           {loading ? (
             <p className="text-muted-foreground">Loading rooms...</p>
           ) : rooms.length === 0 ? (
@@ -244,6 +329,8 @@ export default function Lobby() {
                     <Button
                       className="w-full"
                       onClick={() => handleJoinRoom(room.room_id)}
+                      onPointerEnter={prefetchRoom}
+                      onFocus={prefetchRoom}
                       disabled={room.active_count >= room.max_users}
                     >
                       {room.active_count >= room.max_users ? 'Room Full' : 'Join Room'}
@@ -1,8 +1,9 @@
-import { useEffect, useState } from 'react';
-import { useParams, useNavigate } from 'react-router-dom';
-import { RoomProvider } from '@/lib/liveblocks';
+import { lazy, Suspense, useEffect, useState } from 'react';
+import { useParams, useNavigate, useSearchParams } from 'react-router-dom';
+import { RoomProvider, primeLiveblocksToken } from '@/lib/liveblocks';
 import { useAuth } from '@/lib/AuthContext';
 import { api } from '@/lib/api';
+import { loadCodeEditor, loadMonaco } from '@/lib/prefetch';
 import { Button } from '@/components/ui/button';
 import { Card } from '@/components/ui/card';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
@@ -11,12 +12,13 @@ import { Textarea } from '@/components/ui/textarea';
 import { Label } from '@/components/ui/label';
 import { useToast } from '@/components/ui/use-toast';
 import { ArrowLeft, Copy, AlertTriangle } from 'lucide-react';
-import CodeEditor from '@/components/Room/CodeEditor';
 import Chat from '@/components/Room/Chat';
 import Presence from '@/components/Room/Presence';
 import VoiceChat from '@/components/Room/VoiceChat';
 
-function RoomContent({ room, currentUser }) {
+const CodeEditor = lazy(loadCodeEditor);
+
+function RoomContent({ room, voiceToken, currentUser }) {
   const navigate = useNavigate();
   const { toast } = useToast();
   const [reportDialogOpen, setReportDialogOpen] = useState(false);
@@ -97,7 +99,15 @@ function RoomContent({ room, currentUser }) {
         {/* Editor Section */}
         <div className="flex-1 flex flex-col">
           <div className="flex-1 overflow-hidden">
-            <CodeEditor language={room.language} />
+            <Suspense
+              fallback={
+                <div className="h-full flex items-center justify-center">
+                  <p className="text-sm text-muted-foreground">Loading editor...</p>
+                </div>
+              }
+            >
+              <CodeEditor roomId={room.room_id} language={room.language} />
+            </Suspense>
           </div>
         </div>
 
@@ -109,10 +119,10 @@ function RoomContent({ room, currentUser }) {
               <TabsTrigger value="voice" className="flex-1">Voice</TabsTrigger>
             </TabsList>
             <TabsContent value="chat" className="flex-1 m-0 overflow-hidden">
-              <Chat currentUser={currentUser} />
+              <Chat roomId={room.room_id} currentUser={currentUser} />
             </TabsContent>
             <TabsContent value="voice" className="flex-1 m-0 p-4">
-              <VoiceChat roomId={room.room_id} currentUser={currentUser} />
+              <VoiceChat roomId={room.room_id} prefetchedToken={voiceToken} currentUser={currentUser} />
             </TabsContent>
           </Tabs>
 
@@ -171,24 +181,37 @@ function RoomContent({ room, currentUser }) {
 
 export default function Room() {
   const { roomId } = useParams();
+  const [searchParams] = useSearchParams();
   const { user } = useAuth();
   const navigate = useNavigate();
   const [room, setRoom] = useState(null);
+  const [voiceToken, setVoiceToken] = useState(null);
   const [loading, setLoading] = useState(true);
   const { toast } = useToast();
 
   useEffect(() => {
+    // Fetch the editor while the room is being entered (no-op if the lobby did)
+    loadCodeEditor().catch(() => {});
+    loadMonaco().catch(() => {});
     loadRoom();
   }, [roomId]);
 
   const loadRoom = async () => {
     try {
-      const roomData = await api.getRoom(roomId);
+      // One round trip: admission, Liveblocks token and voice token
+      const { room: roomData, liveblocks, voice } = await api.enterRoom(
+        roomId,
+        searchParams.get('invite'),
+      );
+      primeLiveblocksToken(roomId, liveblocks);
+      setVoiceToken(voice);
       setRoom(roomData);
     } catch (error) {
       toast({
-        title: 'Room not found',
-        description: 'This room may not exist or you may not have access',
+        title: error.status === 404 ? 'Room not found' : 'Could not enter room',
+        description: error.status === 404
+          ? 'This room may not exist or you may not have access'
+          : error.message,
         variant: 'destructive',
       });
       navigate('/');
@@ -217,7 +240,7 @@ export default function Room() {
         code: '// Start coding here!\n',
       }}
     >
-      <RoomContent room={room} currentUser={user} />
+      <RoomContent room={room} voiceToken={voiceToken} currentUser={user} />
     </RoomProvider>
   );
 }
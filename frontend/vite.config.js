@@ -1,14 +1,80 @@
 import { defineConfig } from 'vite'
 import react from '@vitejs/plugin-react'
 import path from 'path'
+import { gzipSync } from 'zlib'
+
+// Gzipped kB. `initial` is what the first page needs: the entry chunk plus
+// everything it imports statically. Raise deliberately, not by accident.
+const BUNDLE_BUDGET = {
+  initial: 200,
+  chunk: 150,
+}
+
+// BUNDLE_BUDGET_WARN_ONLY=1 reports overruns without failing the build, e.g.
+// while a new budget is checked against CI's output
+const BUNDLE_BUDGET_WARN_ONLY = process.env.BUNDLE_BUDGET_WARN_ONLY === '1'
+
+const gzipKb = (chunk) => gzipSync(chunk.code).length / 1024
+
+// Fails `vite build` when the initial JS or any single chunk is over budget
+function bundleBudget(budget, warnOnly) {
+  return {
+    name: 'bundle-budget',
+    apply: 'build',
+    generateBundle(_, bundle) {
+      const chunks = Object.values(bundle).filter((file) => file.type === 'chunk')
+      const sizes = new Map(chunks.map((chunk) => [chunk.fileName, gzipKb(chunk)]))
+      const errors = []
+
+      for (const entry of chunks.filter((chunk) => chunk.isEntry)) {
+        const seen = new Set()
+        const visit = (fileName) => {
+          if (seen.has(fileName)) return
+          seen.add(fileName)
+          bundle[fileName].imports.forEach(visit)
+        }
+        visit(entry.fileName)
+        const initial = [...seen].reduce((total, fileName) => total + sizes.get(fileName), 0)
+        this.info(`${entry.fileName}: initial JS ${initial.toFixed(1)} kB gzip (budget ${budget.initial} kB)`)
+        if (initial > budget.initial) {
+          errors.push(`initial JS for ${entry.fileName} is ${initial.toFixed(1)} kB gzip, budget ${budget.initial} kB`)
+        }
+      }
+      for (const [fileName, size] of sizes) {
+        if (size > budget.chunk) {
+          errors.push(`${fileName} is ${size.toFixed(1)} kB gzip, budget ${budget.chunk} kB`)
+        }
+      }
+
+      if (errors.length) {
+        const message = `Bundle over budget:\n  ${errors.join('\n  ')}`
+        if (warnOnly) this.warn(message)
+        else this.error(message)
+      }
+    },
+  }
+}
 
 export default defineConfig({
-  plugins: [react()],
+  plugins: [react(), bundleBudget(BUNDLE_BUDGET, BUNDLE_BUDGET_WARN_ONLY)],
   resolve: {
     alias: {
       '@': path.resolve(__dirname, './src'),
     },
   },
+  build: {
+    rollupOptions: {
+      output: {
+        // Only reached through the lazily loaded room page. Matched by path so
+        // the packages' own dependencies (e.g. @liveblocks/core) come along,
+        // and nothing the lobby shares with them is pulled into these chunks.
+        manualChunks(id) {
+          if (id.includes('/node_modules/@liveblocks/')) return 'liveblocks'
+          if (id.includes('/node_modules/@monaco-editor/')) return 'editor'
+        },
+      },
+    },
+  },
   server: {
     port: 5173,
   },